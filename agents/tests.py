@@ -1,3 +1,40 @@
+from django.core.cache import cache
+from django.shortcuts import reverse
 from django.test import TestCase
+from leads.models import User, UserProfile, UserRelation, Lead
 
-# Create your tests here.
+
+class UserUpdateTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="admin", password="pass", is_lvl4=True)
+        self.admin_organisation = UserProfile.objects.create(user=self.admin)
+        self.supervisor = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.supervisor)
+        self.other = User.objects.create_user(username="other", password="pass", is_lvl3=True)
+        self.other_organisation = UserProfile.objects.create(user=self.other)
+        self.agent = User.objects.create_user(username="agent", password="pass", is_lvl1=True)
+        UserRelation.objects.create(user=self.agent, supervisor=self.supervisor)
+        self.client.force_login(self.admin)
+
+    def update(self, user, **data):
+        return self.client.post(reverse("agents:user-update", args=[user.pk]), {
+            "first_name": "", "last_name": "", **data,
+        })
+
+    def create_lead(self, organisation, agent):
+        return Lead.objects.create(first_name="Ann", last_name="Lee", organisation=organisation, agent=agent, description="")
+
+    def test_moved_user_sees_the_new_organisation(self):
+        self.create_lead(self.organisation, self.agent)
+        lead = self.create_lead(self.other_organisation, self.agent)
+        response = self.update(self.agent, user_level="lvl1", organisor=self.other.pk)
+        self.assertRedirects(response, reverse("agents:user-list"), fetch_redirect_response=False)
+        self.assertEqual(list(Lead.objects.visible_to(self.agent)), [lead])
+
+    def test_demoted_supervisor_hands_over_the_subordinates(self):
+        self.update(self.supervisor, user_level="lvl1")
+        for user in (self.supervisor, self.agent):
+            lead = self.create_lead(self.admin_organisation, user)
+            self.assertEqual(list(Lead.objects.visible_to(User.objects.get(pk=user.pk))), [lead])
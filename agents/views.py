@@ -4,6 +4,8 @@ from django.views import generic
 from django.shortcuts import reverse, get_object_or_404
 from django.http import HttpResponseRedirect
 from leads.models import User, UserProfile, Lead, UserRelation
+from leads.hierarchy import rebuild_ancestry
+from leads.scope import invalidate_scopes
 from .forms import (AgentModelForm, UpdateAgentForm, UserModelForm, UpdateUserForm)
 from .mixins import (SupervisorAndLoginRequiredMixin, SuperAdminAndLoginRequiredMixin, NoLvl1AndLoginRequiredMixin)
 from django.db.models import Q
@@ -404,6 +406,11 @@ class UserUpdateView(SuperAdminAndLoginRequiredMixin, generic.FormView):
             organisor_profile = form.cleaned_data['organisor']
             print(organisor_profile)
 
+        # The user and everyone moved to another supervisor below
+        moved_ids = [edit_user.pk]
+        if was3 and user_level in ('lvl1', 'lvl2'):
+            moved_ids += UserRelation.objects.filter(supervisor=edit_user).values_list('user', flat=True)
+
         if user_level == 'lvl1' and was3:
 
             if was3:
@@ -435,4 +442,7 @@ class UserUpdateView(SuperAdminAndLoginRequiredMixin, generic.FormView):
         if user_level == 'lvl2' and not was3:
             UserRelation.objects.filter(user=edit_user).update(supervisor=organisor_profile)
 
+        # QuerySet.update() sends no signals, so cached scopes and ancestry rows are refreshed here
+        invalidate_scopes()
+        rebuild_ancestry(moved_ids)
         return super().form_valid(form)
\ No newline at end of file
@@ -50,4 +50,12 @@ class FolderContentUpdateForm(forms.ModelForm):
             'title',
             'description',
             'url',
-        )
\ No newline at end of file
+        )
+
+class FolderDestinationForm(forms.Form):
+    parent = forms.ModelChoiceField(queryset=Folder.objects.none(), required=False, empty_label="根目录", label="目标文件夹")
+
+    def __init__(self, *args, **kwargs):
+        folders = kwargs.pop('folders')
+        super().__init__(*args, **kwargs)
+        self.fields['parent'].queryset = folders.order_by('path', 'name')
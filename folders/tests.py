@@ -1,3 +1,87 @@
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
 from django.test import TestCase
+from django.shortcuts import reverse
+from leads.models import User, UserProfile, Folder, FolderDocument
+from .tree import subtree_document_counts, move_subtree, copy_subtree, delete_subtree
 
-# Create your tests here.
+
+class FolderTreeTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+        self.root = Folder.objects.create(name="root", organisation=self.organisation)
+        self.child = Folder.objects.create(name="child", organisation=self.organisation, parent=self.root)
+        self.leaf = Folder.objects.create(name="leaf", organisation=self.organisation, parent=self.child)
+        self.other = Folder.objects.create(name="other", organisation=self.organisation)
+
+    def test_paths_follow_moves(self):
+        self.assertEqual(self.leaf.path, f"/{self.root.pk}/{self.child.pk}/")
+        self.child.parent = self.other
+        self.child.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f"/{self.other.pk}/{self.child.pk}/")
+        self.assertCountEqual(Folder.objects.subtree(self.other), [self.other, self.child, self.leaf])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.leaf.get_ancestors(), [self.other, self.child])
+
+        self.other.parent = self.leaf
+        with self.assertRaises(ValueError):
+            self.other.save()
+
+    def test_documents_are_counted_and_searched_through_the_subtree(self):
+        FolderDocument.objects.create(title="plan", organisation=self.organisation, folder=self.leaf)
+        FolderDocument.objects.create(title="notes", organisation=self.organisation, folder=self.child)
+        FolderDocument.objects.create(title="plan", organisation=self.organisation, folder=self.other)
+        with self.assertNumQueries(1):
+            counts = subtree_document_counts(FolderDocument.objects.all())
+        self.assertEqual(counts, {self.root.pk: 2, self.other.pk: 1})
+        self.assertEqual(subtree_document_counts(FolderDocument.objects.all(), self.root), {self.child.pk: 2})
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("folders:sub-folder", kwargs={"pk": self.root.pk}), {"q": "plan"})
+        self.assertEqual([document.folder for document in response.context["curr_contents"]], [self.leaf])
+        response = self.client.get(reverse("folders:sub-folder", kwargs={"pk": self.leaf.pk}))
+        self.assertEqual(response.context["breadcrumbs"], [self.root, self.child])
+
+    def test_subtrees_are_moved_copied_and_deleted(self):
+        storage = InMemoryStorage()
+        storage.save("documents/leaf.txt", ContentFile(b"leaf"))
+        FolderDocument.objects.create(title="leaf", organisation=self.organisation, folder=self.leaf, file="documents/leaf.txt")
+        FolderDocument.objects.create(title="link", organisation=self.organisation, folder=self.child, url="https://example.com")
+
+        move_subtree(self.child, self.other)
+        self.assertCountEqual(Folder.objects.below(self.other), [self.child, self.leaf])
+
+        copy = copy_subtree(self.child, self.root, storage)
+        copies = Folder.objects.below(self.root)
+        self.assertEqual(sorted(copies.values_list("name", flat=True)), ["child", "leaf"])
+        self.assertEqual(copy.path, f"/{self.root.pk}/")
+        document = FolderDocument.objects.get(title="leaf", folder__in=copies)
+        self.assertNotEqual(document.file.name, "documents/leaf.txt")
+        self.assertEqual(storage.open(document.file.name).read(), b"leaf")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_subtree(self.root, storage)
+        self.assertCountEqual(Folder.objects.all(), [self.other, self.child, self.leaf])
+        self.assertEqual(FolderDocument.objects.count(), 2)
+        self.assertFalse(storage.exists(document.file.name))
+        self.assertTrue(storage.exists("documents/leaf.txt"))
+
+    def test_copied_files_are_deleted_when_the_copy_fails(self):
+        storage = InMemoryStorage()
+        storage.save("documents/leaf.txt", ContentFile(b"leaf"))
+        FolderDocument.objects.create(title="leaf", organisation=self.organisation, folder=self.leaf, file="documents/leaf.txt")
+        with mock.patch.object(FolderDocument.objects, "bulk_create", side_effect=RuntimeError), \
+                mock.patch.object(storage, "delete", wraps=storage.delete) as delete:
+            with self.assertRaises(RuntimeError):
+                copy_subtree(self.child, self.other, storage)
+        (name,), _ = delete.call_args
+        self.assertNotEqual(name, "documents/leaf.txt")
+        self.assertFalse(storage.exists(name))
+        self.assertTrue(storage.exists("documents/leaf.txt"))
+        self.assertEqual(Folder.objects.count(), 4)
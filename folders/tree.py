@@ -0,0 +1,163 @@
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count
+from leads.models import Folder, FolderDocument, UserProfile
+
+FOLDER_BATCH_SIZE = 1000
+# S3 deletes at most a thousand keys per request
+STORAGE_BATCH_SIZE = 1000
+# S3 copies one key per request, so several run at a time
+STORAGE_WORKERS = 16
+
+
+def subtree_document_counts(documents, folder=None):
+    """
+    Counts the documents in the subtree of each folder directly below the
+    folder, or below the root when it is None, keyed by folder pk.
+    """
+    depth = len(folder.get_ancestor_ids()) + 1 if folder else 0
+    documents = documents.filter(folder__in=Folder.objects.below(folder))
+    counts = Counter()
+    # One row per folder holding documents, rolled up to the folders below the given one
+    for folder_id, path, count in documents.order_by().values_list('folder', 'folder__path').annotate(count=Count('pk')):
+        chain = Folder(path=path).get_ancestor_ids() + [folder_id]
+        counts[chain[depth]] += count
+    return counts
+
+def delete_files(names, storage=default_storage):
+    """Deletes the stored files, a batch of keys per request on S3."""
+    names = list(names)
+    if not hasattr(storage, 'bucket_name'):
+        for name in names:
+            storage.delete(name)
+        return
+    client = storage.connection.meta.client
+    for start in range(0, len(names), STORAGE_BATCH_SIZE):
+        client.delete_objects(Bucket=storage.bucket_name, Delete={
+            'Objects': [{'Key': storage._normalize_name(name)} for name in names[start:start + STORAGE_BATCH_SIZE]],
+            'Quiet': True,
+        })
+
+def copy_files(names, storage=default_storage):
+    """
+    Copies the stored files given as (source, target) names, and returns the
+    names the copies were saved under. S3 copies inside the bucket, without
+    reading the files here. Nothing copied is left behind when one fails.
+    """
+    if not hasattr(storage, 'bucket_name'):
+        copies = []
+        try:
+            for source, target in names:
+                with storage.open(source) as file:
+                    copies.append(storage.save(target, file))
+        except Exception:
+            delete_files(copies, storage)
+            raise
+        return copies
+
+    def copy(source, target):
+        # Connections are per thread
+        storage.connection.meta.client.copy_object(
+            Bucket=storage.bucket_name,
+            CopySource={'Bucket': storage.bucket_name, 'Key': storage._normalize_name(source)},
+            Key=storage._normalize_name(target),
+        )
+        return target
+
+    try:
+        with ThreadPoolExecutor(max_workers=STORAGE_WORKERS) as pool:
+            return list(pool.map(lambda pair: copy(*pair), names))
+    except Exception:
+        # S3 skips the keys that were never written
+        delete_files([target for source, target in names], storage)
+        raise
+
+def check_destination(folder, parent):
+    if parent is not None and parent.organisation_id != folder.organisation_id:
+        raise ValueError("A folder can only be moved or copied within its organisation.")
+
+def move_subtree(folder, parent):
+    """
+    Moves the folder and everything below it under the parent, or to the
+    root when it is None. The subtree's paths change in one UPDATE, and
+    stored files keep their names.
+    """
+    check_destination(folder, parent)
+    folder.parent = parent
+    folder.save(update_fields=['parent'])
+
+def copy_subtree(folder, parent, storage=default_storage):
+    """
+    Copies the folder and everything below it under the parent, or to the
+    root when it is None, and returns the copy of the folder. Folders are
+    inserted a level at a time and documents in batches, each with a copy
+    of its stored file. The copied files are deleted again if the copy fails.
+    """
+    check_destination(folder, parent)
+    # Read before anything is added, as the parent may be in the subtree
+    levels = defaultdict(list)
+    for source in Folder.objects.subtree(folder):
+        levels[len(source.get_ancestor_ids())].append(source)
+    documents = list(FolderDocument.objects.filter(folder__in=Folder.objects.subtree(folder)).order_by('pk'))
+    organisation = UserProfile.objects.select_related('user').get(pk=folder.organisation_id)
+
+    copies = {}
+    names = []
+    try:
+        with transaction.atomic():
+            for depth in sorted(levels):
+                level = [
+                    Folder(
+                        name=source.name,
+                        organisation_id=source.organisation_id,
+                        parent=parent if source.pk == folder.pk else copies[source.parent_id],
+                    )
+                    for source in levels[depth]
+                ]
+                for copy in level:
+                    copy.path = copy.parent.get_subtree_path() if copy.parent else '/'
+                Folder.objects.bulk_create(level)
+                copies.update(zip((source.pk for source in levels[depth]), level))
+
+            # Named like uploads, prefixed by the original's pk as names may repeat in a folder
+            stored = [document for document in documents if document.file]
+            names = copy_files([
+                (
+                    document.file.name,
+                    f"documents/{organisation}/folder_{copies[document.folder_id].pk}/{document.pk}_{os.path.basename(document.file.name)}",
+                )
+                for document in stored
+            ], storage)
+            files = dict(zip((document.pk for document in stored), names))
+            FolderDocument.objects.bulk_create([
+                FolderDocument(
+                    title=document.title,
+                    description=document.description,
+                    folder=copies[document.folder_id],
+                    organisation_id=document.organisation_id,
+                    file=files.get(document.pk, document.file.name),
+                    url=document.url,
+                )
+                for document in documents
+            ], batch_size=FOLDER_BATCH_SIZE)
+    except Exception:
+        delete_files(names, storage)
+        raise
+    return copies[folder.pk]
+
+def delete_subtree(folder, storage=default_storage):
+    """
+    Deletes the folder and everything below it, the documents in one DELETE
+    before the folders, and their stored files once committed.
+    """
+    folders = Folder.objects.subtree(folder)
+    documents = FolderDocument.objects.filter(folder__in=folders)
+    with transaction.atomic():
+        names = [name for name in documents.values_list('file', flat=True) if name]
+        documents.delete()
+        # Only the folders are left to collect, so the cascade stays small
+        folders.delete()
+    transaction.on_commit(lambda: delete_files(names, storage))
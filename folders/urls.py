@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import (RootFolderView, FolderCreateView, SubFolderView, FolderDeleteView,
-                    FolderUpdateView,
+                    FolderUpdateView, FolderMoveView, FolderCopyView,
                     FolderContentCreateView, FolderContentDeleteView, FolderContentUpdateView)
 
 app_name = 'folders'
@@ -14,6 +14,10 @@ urlpatterns = [
     path('folder/<int:parent_id>/delete/<int:pk>', FolderDeleteView.as_view(), name='folder-delete'),
     path('folder/update/<int:pk>', FolderUpdateView.as_view(), name='root-folder-update'),
     path('folder/<int:parent_id>/update/<int:pk>', FolderUpdateView.as_view(), name='folder-update'),
+    path('folder/move/<int:pk>', FolderMoveView.as_view(), name='root-folder-move'),
+    path('folder/<int:parent_id>/move/<int:pk>', FolderMoveView.as_view(), name='folder-move'),
+    path('folder/copy/<int:pk>', FolderCopyView.as_view(), name='root-folder-copy'),
+    path('folder/<int:parent_id>/copy/<int:pk>', FolderCopyView.as_view(), name='folder-copy'),
     path('foldercontent/add/', FolderContentCreateView.as_view(), name='foldercontent-add'),
     path('foldercontent/<int:parent_id>/add/', FolderContentCreateView.as_view(), name='subfoldercontent-add'),
     path('foldercontent/delete/<int:pk>/', FolderContentDeleteView.as_view(), name='root-foldercontent-delete'),
@@ -1,119 +1,80 @@
 import random
 from django.core.mail import send_mail
 from django.views import generic
-from django.shortcuts import reverse, get_object_or_404
+from django.http import Http404
+from django.shortcuts import redirect, reverse, get_object_or_404
+from django.db import transaction
 from leads.models import (User, UserProfile, Folder, 
-                          FolderDocument, UserRelation
+                          FolderDocument
                           )
-from .forms import (FolderCreateForm, 
+from .forms import (FolderCreateForm, FolderDestinationForm,
                     FolderContentCreateForm, FolderContentUpdateForm
                     )
+from .tree import subtree_document_counts, move_subtree, copy_subtree, delete_subtree, delete_files
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Q
 from agents.mixins import (SupervisorAndLoginRequiredMixin, SuperAdminAndLoginRequiredMixin, NoLvl1AndLoginRequiredMixin)
 
-class RootFolderView(LoginRequiredMixin, generic.ListView):
-    template_name = "folders/root_folders.html"
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-    
-        root_folders = self.get_queryset()
-        
-        context['breadcrumbs'] = []
-        context['folders'] = root_folders
+class FolderContentsMixin:
+    """
+    Lists the folders and documents in the folder, or at the root when
+    get_folder() returns None. With ?q= they are searched through the whole
+    subtree instead.
+    """
 
-        user = self.request.user
-        curr_contents = []
+    def get_folder(self):
+        return None
 
-        if user.is_lvl4:
-            curr_contents = FolderDocument.objects.filter(folder__isnull=True)
-        
-        elif user.is_lvl3:
-            # Level 3: all folders created by them and folders created by lvl2 under their management
-            curr_contents = FolderDocument.objects.filter(
-                organisation=user.userprofile,
-                folder__isnull=True
-            )
-        
-        elif user.is_lvl2:
-
-            user_relation = get_object_or_404(UserRelation, user=user)
-            supervisor_userprofile = user_relation.supervisor.userprofile
-            # Level 2: all folders created by them and folders created by lvl3 who supervise them
-            curr_contents = FolderDocument.objects.filter(
-                organisation=supervisor_userprofile,
-                folder__isnull=True,
-            ) 
-        
-        elif user.is_lvl1:
-            user_relation = get_object_or_404(UserRelation, user=user)
-            supervisor_userprofile = user_relation.supervisor.userprofile
-            # Level 1: all folders created by lvl3 supervisors and lvl2 supervisors
-            curr_contents = FolderDocument.objects.filter(
-                organisation=supervisor_userprofile,
-                folder__isnull=True,
-            )
-    
-        context['curr_contents'] = curr_contents
-
-        return context
+    def get_search_query(self):
+        return self.request.GET.get('q', '').strip()
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Folder.objects.filter(parent__isnull=True)
+        # Level 4: all folders, level 1-3: those of the organisation they work for
+        folders = Folder.objects.visible_to(self.request.user)
+        query = self.get_search_query()
+        if query:
+            return folders.below(self.get_folder()).filter(name__icontains=query).order_by('path', 'name')
+        return folders.filter(parent=self.get_folder())
 
-        if user.is_lvl4:
-            # Level 4: all folders
-            queryset = Folder.objects.filter(parent__isnull=True)
-        
-        elif user.is_lvl3:
-            
-            # Level 3: all folders created by them and folders created by lvl2 under their management
-            queryset = Folder.objects.filter(
-                organisation=user.userprofile,
-                parent__isnull=True
-            )
-        
-        elif user.is_lvl2:
-            user_relation = get_object_or_404(UserRelation, user=user)
-            supervisor_userprofile = user_relation.supervisor.userprofile
-            # Level 2: all folders created by them and folders created by lvl3 who supervise them
-            queryset = Folder.objects.filter(
-                organisation=supervisor_userprofile,
-                parent__isnull=True,
-            ) 
-        
-        elif user.is_lvl1:
-            user_relation = get_object_or_404(UserRelation, user=user)
-            supervisor_userprofile = user_relation.supervisor.userprofile
-            # Level 1: all folders created by lvl3 supervisors and lvl2 supervisors
-            queryset = Folder.objects.filter(
-                organisation=supervisor_userprofile,
-                parent__isnull=True,
-            )
-        return queryset
+    def get_documents(self):
+        documents = FolderDocument.objects.visible_to(self.request.user)
+        query = self.get_search_query()
+        if not query:
+            return documents.filter(folder=self.get_folder())
+        documents = documents.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        if self.get_folder() is not None:
+            documents = documents.filter(folder__in=Folder.objects.subtree(self.get_folder()))
+        return documents
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        folder = self.get_folder()
+        context['query'] = self.get_search_query()
+        context['breadcrumbs'] = folder.get_ancestors() if folder else []
+        context['curr_contents'] = self.get_documents()
+        if not context['query']:
+            counts = subtree_document_counts(FolderDocument.objects.visible_to(self.request.user), folder)
+            for subfolder in context['object_list']:
+                subfolder.num_documents = counts[subfolder.pk]
+        return context
+
+class RootFolderView(LoginRequiredMixin, FolderContentsMixin, generic.ListView):
+    template_name = "folders/root_folders.html"
+    context_object_name = "folders"
     
-class SubFolderView(LoginRequiredMixin, generic.ListView):
+class SubFolderView(LoginRequiredMixin, FolderContentsMixin, generic.ListView):
     template_name = "folders/sub_folder.html"
+    context_object_name = "curr_folders"
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        current_folder = get_object_or_404(Folder, pk=self.kwargs['pk'])
-        context['curr_folder'] = current_folder
-    
-        context['curr_folders'] = self.get_queryset()
-        context['curr_contents'] = FolderDocument.objects.filter(folder=current_folder)
-
+        context['curr_folder'] = self.get_folder()
         return context
 
-    def get_queryset(self):
-
-        current_folder = get_object_or_404(Folder, pk=self.kwargs['pk'])
-
-        queryset = Folder.objects.filter(parent=current_folder)
-
-        return queryset
+    def get_folder(self):
+        if not hasattr(self, 'folder'):
+            self.folder = get_object_or_404(Folder.objects.visible_to(self.request.user), pk=self.kwargs['pk'])
+        return self.folder
     
 class FolderCreateView(NoLvl1AndLoginRequiredMixin, generic.CreateView):
     template_name = 'folders/folder_create.html'
@@ -127,17 +88,14 @@ class FolderCreateView(NoLvl1AndLoginRequiredMixin, generic.CreateView):
     def form_valid(self, form):
         parent_id = self.kwargs.get('parent_id')
         if parent_id:
-            parent_folder = Folder.objects.get(id=parent_id)
+            parent_folder = get_object_or_404(Folder.objects.visible_to(self.request.user), pk=parent_id)
             form.instance.parent = parent_folder
         else:
             form.instance.parent = None
-        user = self.request.user
-        if user.is_lvl2:
-            user_relation = get_object_or_404(UserRelation, user=user)
-            supervisor_userprofile = user_relation.supervisor.userprofile
-            form.instance.organisation = supervisor_userprofile
-        else:
-            form.instance.organisation = self.request.user.userprofile
+        organisation = self.request.scope.organisation
+        if organisation is None:
+            raise Http404("No organisation found for this user")
+        form.instance.organisation = organisation
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -151,17 +109,66 @@ class FolderDeleteView(NoLvl1AndLoginRequiredMixin, generic.DeleteView):
     template_name = "folders/folder_delete.html"
     model = Folder
 
+    def get_queryset(self):
+        return Folder.objects.visible_to(self.request.user)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['parent_id'] = self.kwargs.get('parent_id')
         return context
 
+    def form_valid(self, form):
+        # The subtree goes in bulk rather than through the ORM cascade
+        success_url = self.get_success_url()
+        delete_subtree(self.object)
+        return redirect(success_url)
+
     def get_success_url(self):
         parent_id = self.kwargs.get('parent_id')
         if parent_id:
             return reverse('folders:sub-folder', kwargs={'pk': parent_id})
         else:
             return reverse('folders:root-folders')
+
+class FolderMoveView(NoLvl1AndLoginRequiredMixin, generic.FormView):
+    template_name = "folders/folder_move.html"
+    form_class = FolderDestinationForm
+    copy = False
+
+    def get_folder(self):
+        if not hasattr(self, 'folder'):
+            self.folder = get_object_or_404(Folder.objects.visible_to(self.request.user), pk=self.kwargs['pk'])
+        return self.folder
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        folder = self.get_folder()
+        folders = Folder.objects.visible_to(self.request.user).filter(organisation=folder.organisation_id)
+        if not self.copy:
+            # A folder cannot go below itself
+            folders = folders.exclude(pk=folder.pk).exclude(path__startswith=folder.get_subtree_path())
+        kwargs['folders'] = folders
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['folder'] = self.get_folder()
+        context['parent_id'] = self.kwargs.get('parent_id')
+        context['copy'] = self.copy
+        return context
+
+    def form_valid(self, form):
+        parent = form.cleaned_data['parent']
+        if self.copy:
+            copy_subtree(self.get_folder(), parent)
+        else:
+            move_subtree(self.get_folder(), parent)
+        if parent:
+            return redirect('folders:sub-folder', pk=parent.pk)
+        return redirect('folders:root-folders')
+
+class FolderCopyView(FolderMoveView):
+    copy = True
         
 class FolderUpdateView(NoLvl1AndLoginRequiredMixin, generic.UpdateView):
     template_name = "folders/folder_update.html"
@@ -169,7 +176,7 @@ class FolderUpdateView(NoLvl1AndLoginRequiredMixin, generic.UpdateView):
 
     def get_object(self, queryset=None):
         # Retrieve the folder instance using the pk from the URL
-        return get_object_or_404(Folder, pk=self.kwargs.get('pk'))
+        return get_object_or_404(Folder.objects.visible_to(self.request.user), pk=self.kwargs.get('pk'))
 
     def get_success_url(self):
         parent_id = self.kwargs.get('parent_id')
@@ -191,17 +198,14 @@ class FolderContentCreateView(NoLvl1AndLoginRequiredMixin, generic.CreateView):
     def form_valid(self, form):
         parent_folder_id = self.kwargs.get('parent_id')
         if parent_folder_id:
-            parent_folder = get_object_or_404(Folder, pk=parent_folder_id)
+            parent_folder = get_object_or_404(Folder.objects.visible_to(self.request.user), pk=parent_folder_id)
             form.instance.folder = parent_folder
         else:
             form.instance.folder = None
-        user = self.request.user
-        if user.is_lvl2:
-            user_relation = get_object_or_404(UserRelation, user=user)
-            supervisor_userprofile = user_relation.supervisor.userprofile
-            form.instance.organisation = supervisor_userprofile
-        else:
-            form.instance.organisation = self.request.user.userprofile  
+        organisation = self.request.scope.organisation
+        if organisation is None:
+            raise Http404("No organisation found for this user")
+        form.instance.organisation = organisation
 
         files = self.request.FILES.getlist('file')
 
@@ -230,10 +234,20 @@ class FolderContentDeleteView(NoLvl1AndLoginRequiredMixin, generic.DeleteView):
     model = FolderDocument
     template_name = "folders/folder_content_delete.html"
 
+    def get_queryset(self):
+        return FolderDocument.objects.visible_to(self.request.user)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['parent_id'] = self.kwargs.get('parent_id')
         return context
+
+    def form_valid(self, form):
+        name = self.object.file.name
+        response = super().form_valid(form)
+        if name:
+            transaction.on_commit(lambda: delete_files([name]))
+        return response
     
     def get_success_url(self):
         parent_id = self.kwargs.get('parent_id')
@@ -247,6 +261,9 @@ class FolderContentUpdateView(NoLvl1AndLoginRequiredMixin, generic.UpdateView):
     form_class = FolderContentUpdateForm
     template_name = "folders/folder_content_update.html"
 
+    def get_queryset(self):
+        return FolderDocument.objects.visible_to(self.request.user)
+
     def get_success_url(self):
         parent_id = self.kwargs.get('parent_id')
         if parent_id:
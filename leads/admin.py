@@ -15,10 +15,10 @@ class LeadAdmin(admin.ModelAdmin):
     #     'last_name',
     # )
     # list_filter = ['category']
-    list_display = ['first_name', 'last_name', 'email']
+    list_display = ['order_id', 'first_name', 'last_name', 'email']
     list_display_links = ['first_name']
     list_editable = ['last_name']
-    search_fields = ['first_name', 'last_name', 'email']
+    search_fields = ['order_id', 'first_name', 'last_name', 'email']
 
 
 admin.site.register(User)
@@ -0,0 +1,67 @@
+import time
+from django.core.cache import cache
+from django.db import models
+from .models import Lead, CaseField
+
+# Lead fields that are never shown as table columns
+HIDDEN_LEAD_FIELDS = (
+    'extrafields', 'followups', 'id', 'organisation', 'phone_number', 'order_id', 'date_modified',
+    'commission_cents', 'co_commission_cents',
+)
+SCHEMA_TIMEOUT = 60 * 60
+
+
+def get_schema_version(organisation_id):
+    key = f'lead_columns_version:{organisation_id}'
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        cache.set(key, version, None)
+    return version
+
+def invalidate_column_schema(organisation_id):
+    # A new version makes every cached schema of the organisation unreachable
+    cache.set(f'lead_columns_version:{organisation_id}', time.time_ns(), None)
+
+def get_column_schema(organisation_id):
+    """
+    Returns the lead table columns of an organisation, built once per schema version:
+    {'lead_fields': [{'name', 'type'}], 'case_fields': [{'name', 'type', 'pk'}]}
+    """
+    key = f'lead_columns:{organisation_id}:{get_schema_version(organisation_id)}'
+    schema = cache.get(key)
+    if schema is None:
+        lead_fields = []
+        for field in Lead._meta.get_fields():
+            if field.name in HIDDEN_LEAD_FIELDS:
+                continue
+            # DateTimeField is a DateField as well
+            field_type = 'date' if isinstance(field, models.DateField) else 'text'
+            lead_fields.append({'name': field.name, 'type': field_type})
+
+        case_fields = [
+            {'name': name, 'type': field_type, 'pk': pk}
+            for pk, name, field_type in CaseField.objects.filter(user=organisation_id).values_list('pk', 'name', 'field_type')
+        ]
+        schema = {'lead_fields': lead_fields, 'case_fields': case_fields}
+        cache.set(key, schema, SCHEMA_TIMEOUT)
+    return schema
+
+def get_table_columns(organisation_id, exclude=(), include_case_fields=True):
+    """
+    Returns the column names of a lead table, starting with Order-ID, and the
+    DataTables indexes of its date columns.
+    """
+    schema = get_column_schema(organisation_id)
+    fields = [field for field in schema['lead_fields'] if field['name'] not in exclude]
+    if include_case_fields:
+        fields += schema['case_fields']
+
+    lead_fields = ['Order-ID'] + [field['name'] for field in fields]
+    # +1 due to the Order-ID changing the column sorting
+    datetime_fields_info = [
+        {'index': i + 1, 'type': 'date'}
+        for i, field in enumerate(fields)
+        if field['type'] == 'date'
+    ]
+    return lead_fields, datetime_fields_info
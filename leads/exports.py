@@ -0,0 +1,113 @@
+import csv
+import tempfile
+from itertools import islice
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from .models import CaseValue
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_HEADERS = [
+    'Order-ID',
+    'first_name',
+    'last_name',
+    'email',
+    'phone_number',
+    'agent',
+    'manager',
+    'status',
+    'quote',
+    'commission',
+    'co_commission',
+    'commission_amount',
+    'co_commission_amount',
+    'description',
+    'date_added',
+]
+# Spreadsheets read text starting with these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@')
+
+
+class Echo:
+    """A file-like object that hands each written line straight back to the caller."""
+
+    def write(self, value):
+        return value
+
+def escape_formula(value):
+    # The quote makes Excel show the text as typed instead of running it
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def iter_export_rows(queryset, case_field_names):
+    """
+    Yields the header and one row per lead, reading the database in chunks.
+
+    On PostgreSQL, iterator() reads through a server-side cursor, and the
+    case values of each chunk come from one pivot query. Memory use depends on
+    the chunk size, not on the number of leads. Text that would run as a
+    formula is escaped.
+    """
+    yield EXPORT_HEADERS + [escape_formula(name) for name in case_field_names]
+
+    leads = queryset.select_related('agent', 'manager').order_by('pk').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    while True:
+        chunk = CaseValue.objects.pivot_for(islice(leads, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        for lead in chunk:
+            row = [
+                lead.order_id,
+                lead.first_name,
+                lead.last_name,
+                lead.email,
+                lead.phone_number,
+                lead.agent.username if lead.agent else None,
+                lead.manager.username if lead.manager else None,
+                lead.status,
+                lead.quote,
+                lead.commission,
+                lead.co_commission,
+                lead.commission_cents / 100,
+                lead.co_commission_cents / 100,
+                lead.description,
+                timezone.localtime(lead.date_added).replace(tzinfo=None),
+            ]
+            row += [lead.case_values.get(name) for name in case_field_names]
+            yield [escape_formula(value) for value in row]
+
+def export_filename(extension):
+    return f"leads_{timezone.localdate().strftime('%Y%m%d')}.{extension}"
+
+def iter_with_bom(lines):
+    # Excel needs the BOM to read the Chinese statuses as UTF-8
+    yield '\ufeff'
+    yield from lines
+
+def csv_export_response(queryset, case_field_names):
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(row) for row in iter_export_rows(queryset, case_field_names))
+    response = StreamingHttpResponse(iter_with_bom(lines), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{export_filename("csv")}"'
+    return response
+
+def xlsx_export_response(queryset, case_field_names):
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    # A write-only workbook keeps only the current row in memory and spools the sheet to disk
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('leads')
+    for row in iter_export_rows(queryset, case_field_names):
+        # Control characters are not allowed in the sheet's XML
+        sheet.append([ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value for value in row])
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=export_filename('xlsx'),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
@@ -1,10 +1,14 @@
 from django import forms
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm, UsernameField
-from .models import Lead, FollowUp, CaseField, CaseValue, handle_upload_follow_ups, UserRelation, User
+from .models import Lead, FollowUp, CaseField, CaseValue, handle_upload_follow_ups, User
+from .hierarchy import get_organisation_users
+from .imports import UnreadableFileError, check_upload
+from .scope import get_scope
 import os
 
 User = get_user_model()
@@ -25,19 +29,8 @@ class LeadModelForm(forms.ModelForm):
         self.user = kwargs.pop('user')
         instance = kwargs.get('instance') 
         super(LeadModelForm, self).__init__(*args, **kwargs)
-        
-        up = None
-
-        if self.user.is_lvl3:
-            up = self.user.userprofile
-        elif self.user.is_lvl2:
-            sr = UserRelation.objects.get(user=self.user)
-            up = sr.supervisor.userprofile
-        elif self.user.is_lvl1:
-            sr = UserRelation.objects.get(user=self.user)
-            up = sr.supervisor.userprofile
-
-        additional_fields = CaseField.objects.filter(user=up)
+
+        additional_fields = CaseField.objects.filter(user=get_scope(self.user).organisation_id)
         for field in additional_fields:
             if field.field_type == 'text':
                 self.fields[field.name] = forms.CharField(label=field.name, required=False)
@@ -48,7 +41,7 @@ class LeadModelForm(forms.ModelForm):
             # Add more field types as needed
         
         if instance:
-            for case_value in instance.extrafields.all():
+            for case_value in instance.extrafields.select_related('field'):
                 if case_value.field.field_type == 'text':
                     self.initial[case_value.field.name] = case_value.value_text
                 elif case_value.field.field_type == 'number':
@@ -59,29 +52,10 @@ class LeadModelForm(forms.ModelForm):
     def save(self, commit=True):
         Lead = super(LeadModelForm, self).save(commit=False)
         if commit:
-            up = None
-
-            if self.user.is_lvl3:
-                up = self.user.userprofile
-            elif self.user.is_lvl2:
-                sr = UserRelation.objects.get(user=self.user)
-                up = sr.supervisor.userprofile
-            elif self.user.is_lvl1:
-                sr = UserRelation.objects.get(user=self.user)
-                up = sr.supervisor.userprofile
-
-
-            for field in CaseField.objects.filter(user=up):
-                field_name = field.name
-                value = self.cleaned_data[field_name]
-                case_value, created = CaseValue.objects.get_or_create(lead=Lead, field=field)
-                if field.field_type == 'text':
-                    case_value.value_text = value
-                elif field.field_type == 'number':
-                    case_value.value_number = value
-                elif field.field_type == 'date':
-                    case_value.value_date = value
-                case_value.save()
+            fields = CaseField.objects.filter(user=get_scope(self.user).organisation_id)
+            with transaction.atomic():
+                Lead.save()
+                CaseValue.objects.upsert_for(Lead, {field: self.cleaned_data[field.name] for field in fields})
         return Lead
 
 
@@ -119,10 +93,7 @@ class LeadUpdateForm(forms.ModelForm):
             self.fields['commission'] = forms.IntegerField(label='Commission', required=True, initial=instance.commission if instance else None)
             self.fields['co_commission'] = forms.IntegerField(label='Co-commission', required=True, initial=instance.co_commission if instance else None)
 
-            user_set = User.objects.filter(
-                Q(is_lvl3=True, userprofile=org) |
-                Q(Q(is_lvl1=True) | Q(is_lvl2=True), user_name__supervisor__userprofile=org)
-            )
+            user_set = get_organisation_users(org)
 
             self.fields['agent'] = forms.ModelChoiceField(queryset=user_set, initial=instance.agent, required=False)
             self.fields['manager'] = forms.ModelChoiceField(queryset=user_set, initial=instance.manager, required=False)
@@ -145,7 +116,7 @@ class LeadUpdateForm(forms.ModelForm):
             # Add more field types as needed
         
         if instance:
-            for case_value in instance.extrafields.all():
+            for case_value in instance.extrafields.select_related('field'):
                 if case_value.field.field_type == 'text':
                     self.initial[case_value.field.name] = case_value.value_text
                 elif case_value.field.field_type == 'number':
@@ -154,27 +125,18 @@ class LeadUpdateForm(forms.ModelForm):
                     self.initial[case_value.field.name] = case_value.value_date
 
     def save(self, commit=True):
-        Lead = super(LeadUpdateForm, self).save(commit=True)
-        if commit:
+        Lead = super(LeadUpdateForm, self).save(commit=False)
+        fields = list(CaseField.objects.filter(user=self.instance.organisation))
+
+        nonp = [field.name for field in fields]
+        for field_name in [f.name for f in Lead._meta.get_fields() if f.name not in nonp]:
+            if field_name in self.cleaned_data:  # Check if the field is present in the cleaned data
+                setattr(Lead, field_name, self.cleaned_data[field_name])
 
-            nonp = []
-            for field in CaseField.objects.filter(user=self.instance.organisation):
-                field_name = field.name
-                nonp.append(field_name)
-                value = self.cleaned_data[field_name]
-                case_value, created = CaseValue.objects.get_or_create(lead=Lead, field=field) # !
-                if field.field_type == 'text':
-                    case_value.value_text = value
-                elif field.field_type == 'number':
-                    case_value.value_number = value
-                elif field.field_type == 'date':
-                    case_value.value_date = value
-                case_value.save()
-
-            for field_name in [f.name for f in Lead._meta.get_fields() if f.name not in nonp]:
-                if field_name in self.cleaned_data:  # Check if the field is present in the cleaned data
-                    setattr(Lead, field_name, self.cleaned_data[field_name])
-            
+        if commit:
+            with transaction.atomic():
+                Lead.save()
+                CaseValue.objects.upsert_for(Lead, {field: self.cleaned_data[field.name] for field in fields})
         return Lead
 
 class FollowUpModelForm(forms.ModelForm):
@@ -215,4 +177,55 @@ class FollowUpUpdateModelForm(forms.ModelForm):
 class LeadForm(forms.Form):
     first_name = forms.CharField()
     last_name = forms.CharField()
-    age = forms.IntegerField(min_value=0)
\ No newline at end of file
+    age = forms.IntegerField(min_value=0)
+
+class LeadImportForm(forms.Form):
+    file = forms.FileField(label='CSV / XLSX', help_text='The first row names the columns: first_name, last_name, ... and custom field names')
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if os.path.splitext(file.name)[1].lower() not in ('.csv', '.xlsx'):
+            raise ValidationError("Upload a .csv or .xlsx file")
+        try:
+            check_upload(file)
+        except UnreadableFileError as error:
+            raise ValidationError(str(error))
+        return file
+
+class LeadBulkActionForm(forms.Form):
+    ACTION_CHOICES = [
+        ('status', 'status'),
+        ('agent', 'agent'),
+        ('manager', 'manager'),
+        ('delete', 'delete'),
+    ]
+    MAX_LEADS = 1000
+
+    action = forms.ChoiceField(choices=ACTION_CHOICES)
+    ids = forms.CharField(help_text='Comma separated lead ids')
+    status = forms.ChoiceField(choices=[('', '---------')] + Lead.STATUS_CHOICES, required=False)
+    user = forms.ModelChoiceField(queryset=User.objects.none(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['user'].queryset = get_assignable_users(self.user)
+
+    def clean_ids(self):
+        try:
+            ids = {int(pk) for pk in self.cleaned_data['ids'].split(',') if pk.strip()}
+        except ValueError:
+            raise ValidationError("Lead ids must be numbers")
+        if not ids:
+            raise ValidationError("Select at least one lead")
+        if len(ids) > self.MAX_LEADS:
+            raise ValidationError(f"Select at most {self.MAX_LEADS} leads at once")
+        return ids
+
+def get_assignable_users(user):
+    """Users that leads can be assigned to: everyone for lvl4, the organisation's users for lvl3."""
+    if user.is_lvl4:
+        return User.objects.filter(Q(is_lvl1=True) | Q(is_lvl2=True) | Q(is_lvl3=True))
+    if user.is_lvl3:
+        return get_organisation_users(get_scope(user).organisation_id)
+    return User.objects.none()
@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models import Q
+from .models import Team, User, UserAncestry, UserProfile, UserRelation
+
+ANCESTRY_BATCH_SIZE = 1000
+
+
+def get_supervisors(user_ids=None):
+    """
+    The supervisor of each of the users and of everyone above them, or of
+    every user when user_ids is None. Chains are read a level at a time, so
+    a rebuild only loads the relations above the users it changes.
+    """
+    # A user's first relation is their supervisor, as in get_scope
+    relations = UserRelation.objects.order_by('-pk').values_list('user', 'supervisor')
+    if user_ids is None:
+        return dict(relations)
+    supervisors = {}
+    pending = set(user_ids)
+    while pending:
+        supervisors.update(dict.fromkeys(pending))
+        supervisors.update(relations.filter(user__in=pending))
+        # Stops at the top, or where a cycle would come back
+        pending = set(supervisors.values()) - supervisors.keys() - {None}
+    return supervisors
+
+def with_descendants(user_ids):
+    # Everyone below the users, the users included, a level at a time
+    found = set(user_ids)
+    below = found
+    while below:
+        below = set(UserRelation.objects.filter(supervisor__in=below).values_list('user', flat=True)) - found
+        found |= below
+    return found
+
+def ancestry_rows(user_ids, supervisors):
+    """Builds every UserAncestry row of the users, whose chains are in supervisors."""
+    organisations = dict(UserProfile.objects.filter(user__in=supervisors.keys() | set(user_ids)).values_list('user', 'pk'))
+    teams = list(Team.objects.filter(team_leader__in=user_ids).values_list('pk', 'team_leader', 'team_leader'))
+    teams += Team.objects.filter(teammember__member__in=user_ids).values_list('pk', 'team_leader', 'teammember__member')
+
+    rows = []
+    for user_id in user_ids:
+        chain = [user_id]
+        # Stops at the top, or where a cycle would come back
+        while supervisors.get(chain[-1]) is not None and supervisors[chain[-1]] not in chain:
+            chain.append(supervisors[chain[-1]])
+        # The organisation of the nearest user in the chain owning one, like get_scope
+        organisation_id = next((organisations[ancestor_id] for ancestor_id in chain if ancestor_id in organisations), None)
+        rows += [
+            UserAncestry(user_id=user_id, ancestor_id=ancestor_id, depth=depth, organisation_id=organisation_id)
+            for depth, ancestor_id in enumerate(chain)
+        ]
+    organisation_of = {row.user_id: row.organisation_id for row in rows if row.depth == 0}
+    for team_id, leader_id, member_id in set(teams):
+        rows.append(UserAncestry(
+            user_id=member_id, ancestor_id=leader_id, depth=0 if member_id == leader_id else 1,
+            team_id=team_id, organisation_id=organisation_of[member_id],
+        ))
+    return rows
+
+def rebuild_ancestry(user_ids=None, descendants=True):
+    """
+    Rebuilds the UserAncestry rows of the users, and of everyone below them
+    with ``descendants``. Every user's rows when user_ids is None.
+    """
+    everyone = user_ids is None
+    users = User.objects.all()
+    rows = UserAncestry.objects.all()
+    if not everyone:
+        user_ids = with_descendants(user_ids) if descendants else set(user_ids)
+        rows = rows.filter(user__in=user_ids)
+        # Users deleted since the change have no rows left to build
+        users = users.filter(pk__in=user_ids)
+    user_ids = set(users.values_list('pk', flat=True))
+    # Every relation at once for a full rebuild, else only the chains above the users
+    supervisors = get_supervisors(None if everyone else user_ids)
+    with transaction.atomic():
+        rows.delete()
+        UserAncestry.objects.bulk_create(ancestry_rows(user_ids, supervisors), batch_size=ANCESTRY_BATCH_SIZE)
+
+def rebuild_team_ancestry(team_id):
+    """Rebuilds the rows of everyone in the team now or until this change."""
+    user_ids = set(UserAncestry.objects.filter(team=team_id).values_list('user', flat=True))
+    user_ids |= set(User.objects.filter(Q(teammember__team=team_id) | Q(team_leader=team_id)).values_list('pk', flat=True))
+    rebuild_ancestry(user_ids, descendants=False)
+
+def get_organisation_users(organisation_id):
+    """The lvl1 to lvl3 users of an organisation."""
+    return User.objects.filter(
+        Q(is_lvl1=True) | Q(is_lvl2=True) | Q(is_lvl3=True),
+        ancestry__organisation=organisation_id, ancestry__depth=0, ancestry__team__isnull=True,
+    )
+
+def get_team_users(user, led_only=False):
+    """
+    The users of the teams a user belongs to, leaders included, or with
+    ``led_only`` those of the teams the user leads.
+    """
+    if led_only:
+        return User.objects.filter(ancestry__ancestor=user, ancestry__team__isnull=False).distinct()
+    teams = UserAncestry.objects.filter(user=user, team__isnull=False).values('team')
+    return User.objects.filter(ancestry__team__in=teams).distinct()
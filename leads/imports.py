@@ -0,0 +1,232 @@
+import csv
+import io
+import os
+import zipfile
+from django import forms
+from django.db import transaction
+from django.utils import timezone
+from .hierarchy import get_organisation_users
+from .models import Lead, CaseValue, DailyOrderSequence, format_order_id
+from .signals import leads_changed
+
+IMPORT_BATCH_SIZE = 1000
+# Only the first errors are kept for the report, the rest are counted
+MAX_REPORTED_ERRORS = 500
+SUPERVISOR_COLUMNS = ('commission', 'co_commission', 'agent', 'manager')
+
+
+class LeadImportRowForm(forms.Form):
+    first_name = forms.CharField(max_length=20)
+    last_name = forms.CharField(max_length=20)
+    email = forms.EmailField(required=False)
+    phone_number = forms.CharField(max_length=20, required=False)
+    description = forms.CharField(required=False)
+    status = forms.ChoiceField(choices=Lead.STATUS_CHOICES, required=False)
+    quote = forms.IntegerField(required=False)
+    commission = forms.IntegerField(required=False)
+    co_commission = forms.IntegerField(required=False)
+    agent = forms.CharField(required=False)
+    manager = forms.CharField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        case_fields = kwargs.pop('case_fields')
+        super().__init__(*args, **kwargs)
+        for field in case_fields:
+            if field.field_type == 'text':
+                self.fields[field.name] = forms.CharField(max_length=255, required=False)
+            elif field.field_type == 'number':
+                self.fields[field.name] = forms.IntegerField(required=False)
+            elif field.field_type == 'date':
+                self.fields[field.name] = forms.DateField(required=False)
+
+
+class UnreadableFileError(ValueError):
+    """An upload that is neither a UTF-8 CSV nor a valid XLSX workbook."""
+
+
+def is_xlsx(uploaded_file):
+    return os.path.splitext(uploaded_file.name)[1].lower() == '.xlsx'
+
+def iter_file_rows(uploaded_file):
+    if is_xlsx(uploaded_file):
+        from openpyxl import load_workbook
+
+        # Read-only mode parses the sheet lazily instead of loading it whole
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield ['' if value is None else value for value in row]
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', newline='')
+        try:
+            yield from csv.reader(text)
+        finally:
+            # Leaves the upload open, to be read again
+            text.detach()
+
+def read_rows(uploaded_file):
+    """
+    Yields the header row and then each data row of a CSV or XLSX upload,
+    one row at a time. Raises UnreadableFileError where the file cannot be read.
+    """
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        yield from iter_file_rows(uploaded_file)
+    except UnicodeDecodeError as error:
+        raise UnreadableFileError("The file is not UTF-8 encoded, save it as CSV UTF-8 and upload it again.") from error
+    except (csv.Error, zipfile.BadZipFile, InvalidFileException) as error:
+        raise UnreadableFileError("The file could not be read as CSV or XLSX.") from error
+
+def check_upload(uploaded_file):
+    """
+    Reads a CSV upload through, or opens an XLSX one, so that most unreadable
+    files are rejected before any lead is written.
+    """
+    rows = read_rows(uploaded_file)
+    try:
+        if is_xlsx(uploaded_file):
+            next(rows, None)
+        else:
+            for row in rows:
+                pass
+    finally:
+        rows.close()
+        uploaded_file.seek(0)
+
+
+class LeadImporter:
+    """
+    Creates leads and their case values from uploaded rows.
+
+    Rows are validated one at a time and written with bulk_create in batches,
+    each batch in its own transaction. Invalid rows are skipped and reported.
+    """
+
+    def __init__(self, user, organisation, case_fields):
+        self.user = user
+        self.organisation = organisation
+        self.case_fields = {field.name: field for field in case_fields}
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+        self.ignored_columns = []
+        self.users = None
+
+    def allowed_columns(self):
+        columns = set(LeadImportRowForm.base_fields) | set(self.case_fields)
+        if not self.user.is_lvl3:
+            columns -= set(SUPERVISOR_COLUMNS)
+        return columns
+
+    def map_header(self, header):
+        allowed = self.allowed_columns()
+        mapping = {}
+        for index, name in enumerate(header):
+            name = str(name).strip()
+            if name in allowed:
+                mapping[index] = name
+            elif name.lower() in allowed:
+                mapping[index] = name.lower()
+            elif name:
+                self.ignored_columns.append(name)
+        return mapping
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    def get_user(self, username):
+        if self.users is None:
+            # Agents and managers are looked up once, by username, within the organisation
+            self.users = {user.username: user for user in get_organisation_users(self.organisation)}
+        return self.users.get(username)
+
+    def build_lead(self, data):
+        lead = Lead(
+            first_name=data['first_name'],
+            last_name=data['last_name'],
+            email=data['email'] or None,
+            phone_number=data['phone_number'] or None,
+            description=data['description'],
+            status=data['status'] or None,
+            quote=data['quote'] or 0,
+            commission=data['commission'] or 0,
+            co_commission=data['co_commission'] or 0,
+            organisation=self.organisation,
+        )
+        if self.user.is_lvl2:
+            lead.manager = self.user
+        elif self.user.is_lvl1:
+            lead.agent = self.user
+        else:
+            lead.agent = self.get_user(data['agent']) if data['agent'] else None
+            lead.manager = self.get_user(data['manager']) if data['manager'] else None
+        lead.set_commission_amounts()
+        return lead
+
+    def clean_row(self, row_number, mapping, row):
+        values = {name: row[index] for index, name in mapping.items() if index < len(row)}
+        form = LeadImportRowForm(values, case_fields=self.case_fields.values())
+        if not form.is_valid():
+            for name, messages in form.errors.items():
+                self.add_error(row_number, f"{name}: {' '.join(messages)}")
+            return None
+
+        data = form.cleaned_data
+        for role in ('agent', 'manager'):
+            if data[role] and self.get_user(data[role]) is None:
+                self.add_error(row_number, f"{role}: unknown user {data[role]}")
+                return None
+        return data
+
+    def write_batch(self, batch):
+        day = timezone.now().date()
+        with transaction.atomic():
+            # bulk_create skips Lead.save, so the batch reserves its Order-IDs at once
+            first = DailyOrderSequence.reserve(day, len(batch))
+            leads = []
+            for offset, data in enumerate(batch):
+                lead = self.build_lead(data)
+                lead.order_id = format_order_id(day, first + offset)
+                leads.append(lead)
+            Lead.objects.bulk_create(leads)
+
+            case_values = []
+            for lead, data in zip(leads, batch):
+                for name, field in self.case_fields.items():
+                    value = data.get(name)
+                    if value in (None, ''):
+                        continue
+                    case_value = CaseValue(lead=lead, field=field)
+                    case_value.set_value(field.field_type, value)
+                    case_values.append(case_value)
+            CaseValue.objects.bulk_create(case_values, batch_size=IMPORT_BATCH_SIZE)
+            leads_changed.send(sender=Lead, days={lead.get_day() for lead in leads})
+        self.created += len(leads)
+
+    def run(self, rows):
+        rows = iter(rows)
+        mapping = self.map_header(next(rows, []))
+        if 'first_name' not in mapping.values() or 'last_name' not in mapping.values():
+            self.add_error(1, "The header must contain first_name and last_name columns")
+            return self
+
+        batch = []
+        # Row 1 is the header
+        for row_number, row in enumerate(rows, start=2):
+            if not any(str(value).strip() for value in row):
+                continue
+            data = self.clean_row(row_number, mapping, row)
+            if data is None:
+                continue
+            batch.append(data)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+        return self
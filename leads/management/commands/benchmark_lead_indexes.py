@@ -0,0 +1,124 @@
+import statistics
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from leads.models import Lead, User, UserProfile, UserRelation
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds leads and shows the plans and timings of the hot lead queries "
+        "without and with the Lead indexes. Everything runs in one transaction "
+        "that is rolled back at the end. PostgreSQL only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--leads', type=int, default=1_000_000)
+        parser.add_argument('--organisations', type=int, default=20)
+        parser.add_argument('--agents', type=int, default=10, help="Agents per organisation")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The benchmark seeds with generate_series and needs PostgreSQL")
+        try:
+            with transaction.atomic():
+                organisation, agent = self.seed(options)
+                queries = self.get_queries(organisation, agent)
+
+                try:
+                    with transaction.atomic():
+                        self.drop_indexes()
+                        self.run_queries("Without indexes", queries, options['repeat'])
+                        raise Rollback
+                except Rollback:
+                    pass
+                self.run_queries("With indexes", queries, options['repeat'])
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Seeded data rolled back")
+
+    def seed(self, options):
+        organisations = []
+        agents = []
+        for i in range(options['organisations']):
+            supervisor = User.objects.create(username=f"benchmark_supervisor_{i}", is_lvl3=True)
+            organisations.append(UserProfile.objects.create(user=supervisor))
+            for j in range(options['agents']):
+                agent = User.objects.create(username=f"benchmark_agent_{i}_{j}", is_lvl1=True)
+                UserRelation.objects.create(user=agent, supervisor=supervisor)
+                agents.append(agent)
+
+        statuses = [value for value, label in Lead.STATUS_CHOICES]
+        self.stdout.write(f"Seeding {options['leads']} leads")
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            # Leads are spread over the organisations, their agents and the last two years
+            cursor.execute(
+                f"""
+                INSERT INTO {Lead._meta.db_table}
+                    (first_name, last_name, description, quote, commission, co_commission,
+                     commission_cents, co_commission_cents,
+                     status, organisation_id, agent_id, manager_id, date_added, date_modified)
+                SELECT
+                    'Seed', 'Lead' || g, '', (g %% 50) * 1000, 10, 5,
+                    (g %% 50) * 1000 * 10, (g %% 50) * 1000 * 5,
+                    (%(statuses)s::varchar[])[1 + g %% %(status_count)s],
+                    (%(organisations)s::bigint[])[1 + g %% %(organisation_count)s],
+                    (%(agents)s::bigint[])[1 + (g %% %(organisation_count)s) * %(agents_per_org)s + (g / %(organisation_count)s) %% %(agents_per_org)s],
+                    (%(agents)s::bigint[])[1 + (g %% %(organisation_count)s) * %(agents_per_org)s + (g / %(organisation_count)s + 1) %% %(agents_per_org)s],
+                    now() - (g %% 730) * interval '1 day' - (g %% 86400) * interval '1 second',
+                    now()
+                FROM generate_series(1, %(leads)s) AS g
+                """,
+                {
+                    'statuses': statuses,
+                    'status_count': len(statuses),
+                    'organisations': [organisation.pk for organisation in organisations],
+                    'organisation_count': len(organisations),
+                    'agents': [agent.pk for agent in agents],
+                    'agents_per_org': options['agents'],
+                    'leads': options['leads'],
+                },
+            )
+            cursor.execute(f"ANALYZE {Lead._meta.db_table}")
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+        return organisations[0], agents[0]
+
+    def get_queries(self, organisation, agent):
+        now = timezone.now()
+        last_month = (now - timedelta(days=30), now)
+        last_year = (now - timedelta(days=365), now)
+        leads = Lead.objects.filter(organisation=organisation)
+        return [
+            ("Lead list page", leads.order_by('-date_added')[:50]),
+            ("Lead list count", leads.filter(date_added__range=last_month).values('pk')),
+            ("Agent leads", leads.filter(Q(agent=agent) | Q(manager=agent), date_added__range=last_year)),
+            ("Status filter", leads.filter(status='待跟进')[:50]),
+            ("Completed quotes per agent", leads.filter(status='已完成', date_added__range=last_month).values('agent').annotate(total=Sum('quote'))),
+            ("Commission per agent", leads.filter(date_added__range=last_month).values('agent').annotate(total=Sum('commission_cents'))),
+            ("Cancelled this year", leads.filter(status='取消', date_added__range=last_year).values('pk')),
+        ]
+
+    def drop_indexes(self):
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for index in Lead._meta.indexes:
+                schema_editor.remove_index(Lead, index)
+
+    def run_queries(self, title, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for label, queryset in queries:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(self.style.MIGRATE_LABEL(f"{label}: median {statistics.median(timings):.2f} ms"))
+            self.stdout.write(queryset.explain(analyze=True, buffers=True))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from leads.hierarchy import rebuild_ancestry
+from leads.models import UserAncestry
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the UserAncestry rows of every user from their relations, organisations and teams."
+
+    def handle(self, *args, **options):
+        rebuild_ancestry()
+        self.stdout.write(f"Rebuilt {UserAncestry.objects.count()} rows")
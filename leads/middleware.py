@@ -0,0 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+from .scope import get_scope
+
+
+class ScopeMiddleware:
+    """Exposes the user's Scope as request.scope, resolved on first use."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.scope = SimpleLazyObject(lambda: get_scope(request.user))
+        return self.get_response(request)
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+def backfill_order_ids(apps, schema_editor):
+    # Number existing leads per creation day, in the order the Order-ID column used to show
+    Lead = apps.get_model('leads', 'Lead')
+    DailyOrderSequence = apps.get_model('leads', 'DailyOrderSequence')
+
+    last_values = {}
+    batch = []
+    for lead in Lead.objects.order_by('date_added', 'pk').only('pk', 'date_added').iterator(chunk_size=2000):
+        day = lead.date_added.date()
+        last_values[day] = last_values.get(day, 0) + 1
+        lead.order_id = f"SEI{day.strftime('%y%m%d')}{last_values[day]:03d}"
+        batch.append(lead)
+        if len(batch) >= 2000:
+            Lead.objects.bulk_update(batch, ['order_id'])
+            batch = []
+    Lead.objects.bulk_update(batch, ['order_id'])
+
+    DailyOrderSequence.objects.bulk_create(
+        [DailyOrderSequence(day=day, last_value=last_value) for day, last_value in last_values.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0023_alter_lead_email_alter_lead_phone_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('last_value', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='order_id',
+            field=models.CharField(blank=True, editable=False, max_length=20, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_order_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:32
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_case_values(apps, schema_editor):
+    # Concurrent get_or_create calls could store a value twice, the latest one wins
+    CaseValue = apps.get_model('leads', 'CaseValue')
+    duplicates = (
+        CaseValue.objects.values('lead', 'field')
+        .annotate(count=Count('pk'), latest=Max('pk'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        CaseValue.objects.filter(lead=duplicate['lead'], field=duplicate['field']).exclude(pk=duplicate['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0024_lead_order_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_case_values, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='casevalue',
+            constraint=models.UniqueConstraint(fields=('lead', 'field'), name='unique_casevalue_per_lead_field'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0025_casevalue_unique_lead_field'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'date_added'], name='lead_org_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['agent', 'date_added'], name='lead_agent_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['manager', 'date_added'], name='lead_manager_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'status'], name='lead_org_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(('status', '已完成')), fields=['organisation', 'date_added'], name='lead_org_done_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(('status', '取消')), fields=['organisation', 'date_added'], name='lead_org_cancel_date_idx'),
+        ),
+    ]
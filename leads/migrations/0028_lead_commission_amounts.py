@@ -0,0 +1,42 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:59
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast
+
+
+def backfill_commission_amounts(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    Lead.objects.update(
+        commission_cents=Cast('quote', models.BigIntegerField()) * F('commission'),
+        co_commission_cents=Cast('quote', models.BigIntegerField()) * F('co_commission'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0027_lead_date_modified'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lead',
+            name='lead_org_date_idx',
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='co_commission_cents',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='commission_cents',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_commission_amounts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'date_added'], include=('agent', 'manager', 'status', 'commission_cents', 'co_commission_cents'), name='lead_org_date_amounts_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+ANCESTRY_BATCH_SIZE = 1000
+
+
+def backfill_user_ancestry(apps, schema_editor):
+    # Built against the historical models, so later changes to leads.hierarchy leave it be
+    UserAncestry = apps.get_model('leads', 'UserAncestry')
+    Team = apps.get_model('leads', 'Team')
+    # A user's first relation is their supervisor
+    supervisors = {}
+    for user_id, supervisor_id in apps.get_model('leads', 'UserRelation').objects.order_by('-pk').values_list('user', 'supervisor'):
+        supervisors[user_id] = supervisor_id
+    organisations = dict(apps.get_model('leads', 'UserProfile').objects.values_list('user', 'pk'))
+
+    rows = []
+    organisation_of = {}
+    for user_id in apps.get_model('leads', 'User').objects.values_list('pk', flat=True):
+        chain = [user_id]
+        while supervisors.get(chain[-1]) is not None and supervisors[chain[-1]] not in chain:
+            chain.append(supervisors[chain[-1]])
+        # The organisation of the nearest user in the chain owning one
+        organisation_of[user_id] = next((organisations[ancestor_id] for ancestor_id in chain if ancestor_id in organisations), None)
+        rows += [
+            UserAncestry(user_id=user_id, ancestor_id=ancestor_id, depth=depth, organisation_id=organisation_of[user_id])
+            for depth, ancestor_id in enumerate(chain)
+        ]
+    teams = set(Team.objects.values_list('pk', 'team_leader', 'team_leader'))
+    teams |= set(Team.objects.filter(teammember__member__isnull=False).values_list('pk', 'team_leader', 'teammember__member'))
+    for team_id, leader_id, member_id in teams:
+        rows.append(UserAncestry(
+            user_id=member_id, ancestor_id=leader_id, depth=0 if member_id == leader_id else 1,
+            team_id=team_id, organisation_id=organisation_of[member_id],
+        ))
+    UserAncestry.objects.bulk_create(rows, batch_size=ANCESTRY_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0028_lead_commission_amounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAncestry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(default=0)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendants', to=settings.AUTH_USER_MODEL)),
+                ('organisation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='leads.userprofile')),
+                ('team', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='leads.team')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestry', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'team', 'user'], name='ancestry_ancestor_idx'), models.Index(fields=['team', 'user'], name='ancestry_team_idx'), models.Index(condition=models.Q(('depth', 0), ('team__isnull', True)), fields=['organisation', 'user'], name='ancestry_org_user_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='userancestry',
+            constraint=models.UniqueConstraint(condition=models.Q(('team__isnull', True)), fields=('user', 'ancestor'), name='unique_user_ancestor'),
+        ),
+        migrations.AddConstraint(
+            model_name='userancestry',
+            constraint=models.UniqueConstraint(fields=('user', 'team'), name='unique_user_team_ancestor'),
+        ),
+        migrations.RunPython(backfill_user_ancestry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0029_user_ancestry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workreport',
+            index=models.Index(fields=['creator', 'date_added'], name='workreport_creator_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workreport',
+            index=models.Index(fields=['organisation', 'date_added'], name='workreport_org_date_idx'),
+        ),
+    ]
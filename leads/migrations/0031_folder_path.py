@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+FOLDER_BATCH_SIZE = 1000
+
+
+def backfill_folder_paths(apps, schema_editor):
+    # The pks of each folder's ancestors from the root down, from the parent links
+    Folder = apps.get_model('leads', 'Folder')
+    parents = dict(Folder.objects.values_list('pk', 'parent'))
+    paths = {}
+    for pk in parents:
+        # Up to the nearest folder with a known path, then down again
+        chain = [pk]
+        while chain[-1] not in paths and parents[chain[-1]] not in (None, *chain):
+            chain.append(parents[chain[-1]])
+        if chain[-1] not in paths:
+            paths[chain[-1]] = '/'
+        for child, parent in zip(reversed(chain[:-1]), reversed(chain[1:])):
+            paths[child] = f'{paths[parent]}{parent}/'
+    folders = [Folder(pk=pk, path=path) for pk, path in paths.items()]
+    Folder.objects.bulk_update(folders, ['path'], batch_size=FOLDER_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0030_workreport_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='/', editable=False, max_length=1000),
+        ),
+        migrations.RunPython(backfill_folder_paths, migrations.RunPython.noop),
+    ]
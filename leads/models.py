@@ -1,7 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Cast, Concat, Length, Substr, TruncDate
+from django.utils import timezone
+from .signals import leads_changed
 import os
 import datetime
 # from storages.backends.s3boto3 import S3Boto3Storage
@@ -31,6 +35,118 @@ class UserRelation(models.Model):
     def __str__(self):
         return f'{self.user.username} supervised by {self.supervisor.username}'
 
+class DailyOrderSequence(models.Model):
+    day = models.DateField(unique=True)
+    last_value = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.last_value}"
+
+    @classmethod
+    def reserve(cls, day, count=1):
+        # The row lock serialises concurrent reservations for the same day
+        with transaction.atomic():
+            sequence, created = cls.objects.select_for_update().get_or_create(day=day)
+            first = sequence.last_value + 1
+            sequence.last_value += count
+            sequence.save(update_fields=['last_value'])
+        return first
+
+def format_order_id(day, number):
+    # Format the Order-ID: SEIYYMMDD00X
+    company_abbreviation = "SEI"
+    return f"{company_abbreviation}{day.strftime('%y%m%d')}{number:03d}"
+
+def order_id_ordering():
+    """
+    Sorts Order-IDs by day, then number. Past 999 leads a day the number
+    takes more digits, so a longer ID of the same day is a later one.
+    """
+    return (Substr('order_id', 1, len("SEIYYMMDD")), Length('order_id'), 'order_id')
+
+# Lead fields that the performance rollups depend on
+ROLLUP_FIELDS = frozenset((
+    'organisation', 'agent', 'manager', 'date_added', 'status', 'quote', 'commission', 'co_commission',
+))
+# Stored commission amounts and the quote and rate each is computed from
+COMMISSION_AMOUNTS = (
+    ('commission_cents', 'commission'),
+    ('co_commission_cents', 'co_commission'),
+)
+
+def touches_rollups(field_names):
+    return any(name.removesuffix('_id') in ROLLUP_FIELDS for name in field_names)
+
+class OrganisationQuerySet(models.QuerySet):
+    """
+    Rows that belong to an organisation through organisation_field, and to a
+    lead through lead_prefix when it is set.
+    """
+    organisation_field = 'organisation'
+    lead_prefix = None
+
+    def visible_to(self, user):
+        """
+        The rows a user may see, as a single filter: every row for lvl4 users,
+        the rows of their organisation for lvl1 to lvl3 users, read in a
+        subquery on UserAncestry instead of a query of its own. Rows of a lead
+        are only visible to lvl1 users who are its agent or manager.
+        """
+        from .scope import get_level
+
+        level = get_level(user)
+        if level == 4:
+            return self.all()
+        if not level:
+            return self.none()
+        organisations = UserAncestry.objects.filter(user=user, depth=0, team__isnull=True).values('organisation')
+        queryset = self.filter(**{f'{self.organisation_field}__in': organisations})
+        if level == 1 and self.lead_prefix is not None:
+            queryset = queryset.filter(Q(**{f'{self.lead_prefix}agent': user}) | Q(**{f'{self.lead_prefix}manager': user}))
+        return queryset
+
+class LeadQuerySet(OrganisationQuerySet):
+    lead_prefix = ''
+
+    def get_days(self):
+        """Returns the (organisation_id, date) pairs the leads were created on."""
+        return set(
+            self.order_by().annotate(day=TruncDate('date_added'))
+            .values_list('organisation', 'day').distinct()
+        )
+
+    def update(self, **kwargs):
+        if not touches_rollups(kwargs):
+            return super().update(**kwargs)
+        kwargs.setdefault('date_modified', timezone.now())
+        for amount_field, rate_field in COMMISSION_AMOUNTS:
+            if 'quote' in kwargs or rate_field in kwargs:
+                # UPDATE reads the old row, so the new quote and rate are used as given
+                quote = kwargs.get('quote', F('quote'))
+                rate = kwargs.get(rate_field, F(rate_field))
+                kwargs[amount_field] = ExpressionWrapper(
+                    Cast(quote, models.BigIntegerField()) * rate, output_field=models.BigIntegerField()
+                )
+        with transaction.atomic(using=self.db):
+            days = self.get_days()
+            count = super().update(**kwargs)
+            # The updated leads may have moved to another organisation or day
+            organisation = kwargs.get('organisation', kwargs.get('organisation_id'))
+            if isinstance(organisation, (int, UserProfile)):
+                days |= {(getattr(organisation, 'pk', organisation), day) for _, day in days}
+            if isinstance(kwargs.get('date_added'), datetime.datetime):
+                day = timezone.localdate(kwargs['date_added'])
+                days |= {(organisation_id, day) for organisation_id, _ in days}
+            leads_changed.send(sender=Lead, days=days)
+        return count
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            days = self.get_days()
+            result = super().delete()
+            leads_changed.send(sender=Lead, days=days)
+        return result
+
 class Lead(models.Model):
     STATUS_CHOICES  = [
         ('进行中', '进行中'),
@@ -53,10 +169,83 @@ class Lead(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES , null=True, blank=True)
     description = models.TextField()
     date_added = models.DateTimeField(auto_now_add=True)
+    # Moves forward whenever a field the performance figures depend on changes
+    date_modified = models.DateTimeField(auto_now=True)
+    # quote * rate in hundredths of a unit, set on save and update
+    commission_cents = models.BigIntegerField(default=0, editable=False)
+    co_commission_cents = models.BigIntegerField(default=0, editable=False)
+    order_id = models.CharField(max_length=20, unique=True, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Lead lists and reports filter by owner and a date_added range. On PostgreSQL
+            # the included columns let performance totals be summed from the index alone
+            models.Index(
+                fields=['organisation', 'date_added'], name='lead_org_date_amounts_idx',
+                include=['agent', 'manager', 'status', 'commission_cents', 'co_commission_cents'],
+            ),
+            models.Index(fields=['agent', 'date_added'], name='lead_agent_date_idx'),
+            models.Index(fields=['manager', 'date_added'], name='lead_manager_date_idx'),
+            models.Index(fields=['organisation', 'status'], name='lead_org_status_idx'),
+            # Lead snapshots read what changed since their last refresh
+            models.Index(fields=['organisation', 'date_modified'], name='lead_org_modified_idx'),
+            # Commissions only count completed leads, cancellations are reported apart
+            models.Index(fields=['organisation', 'date_added'], name='lead_org_done_date_idx', condition=models.Q(status='已完成')),
+            models.Index(fields=['organisation', 'date_added'], name='lead_org_cancel_date_idx', condition=models.Q(status='取消')),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    objects = LeadQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the day the lead is counted on, in case a save moves it
+        if 'organisation_id' in instance.__dict__ and 'date_added' in instance.__dict__:
+            instance._loaded_day = instance.get_day()
+        return instance
+
+    def get_day(self):
+        return (self.organisation_id, timezone.localdate(self.date_added))
+
+    def set_commission_amounts(self):
+        for amount_field, rate_field in COMMISSION_AMOUNTS:
+            setattr(self, amount_field, int(self.quote or 0) * int(getattr(self, rate_field) or 0))
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not touches_rollups(update_fields):
+            super().save(*args, **kwargs)
+            return
+        self.set_commission_amounts()
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'date_modified', 'commission_cents', 'co_commission_cents'}
+
+        days = set()
+        if not self._state.adding:
+            if hasattr(self, '_loaded_day'):
+                days.add(self._loaded_day)
+            else:
+                days |= Lead.objects.filter(pk=self.pk).get_days()
+        with transaction.atomic():
+            if self._state.adding and not self.order_id:
+                # Number the lead within the day it is created, once and for all
+                day = timezone.now().date()
+                self.order_id = format_order_id(day, DailyOrderSequence.reserve(day))
+            super().save(*args, **kwargs)
+            self._loaded_day = self.get_day()
+            days.add(self._loaded_day)
+            leads_changed.send(sender=Lead, days=days)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            days = {self.get_day()}
+            result = super().delete(*args, **kwargs)
+            leads_changed.send(sender=Lead, days=days)
+        return result
+
 class CaseField(models.Model):
     FIELD_TYPES = [
         ('text', 'Text'),
@@ -75,6 +264,46 @@ class CaseField(models.Model):
     def __str__(self):
         return self.name
 
+class CaseValueQuerySet(models.QuerySet):
+
+    def pivot_for(self, leads):
+        """
+        Reads the case values of all given leads in one query and attaches them
+        to each lead as ``lead.case_values``, a dict of field name to value.
+        """
+        leads = list(leads)
+        case_values = {lead.pk: {} for lead in leads}
+        rows = self.filter(lead__in=case_values.keys()).values_list(
+            'lead_id', 'field__name', 'field__field_type', 'value_text', 'value_number', 'value_date'
+        )
+        for lead_id, name, field_type, value_text, value_number, value_date in rows:
+            if field_type == 'text':
+                case_values[lead_id][name] = value_text
+            elif field_type == 'number':
+                case_values[lead_id][name] = value_number
+            elif field_type == 'date':
+                case_values[lead_id][name] = value_date
+        for lead in leads:
+            lead.case_values = case_values[lead.pk]
+        return leads
+
+    def upsert_for(self, lead, values):
+        """
+        Writes the case values of a lead, given as a dict of CaseField to value,
+        with one INSERT ... ON CONFLICT DO UPDATE statement.
+        """
+        case_values = []
+        for field, value in values.items():
+            case_value = CaseValue(lead=lead, field=field)
+            case_value.set_value(field.field_type, value)
+            case_values.append(case_value)
+        return self.bulk_create(
+            case_values,
+            update_conflicts=True,
+            unique_fields=['lead', 'field'],
+            update_fields=['value_text', 'value_number', 'value_date'],
+        )
+
 class CaseValue(models.Model):
     lead = models.ForeignKey(Lead, related_name="extrafields", on_delete=models.CASCADE)
     field = models.ForeignKey(CaseField, on_delete=models.CASCADE)
@@ -82,6 +311,19 @@ class CaseValue(models.Model):
     value_number = models.IntegerField(default=0, blank=True, null=True)
     value_date = models.DateField(blank=True, null=True)
 
+    objects = CaseValueQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['lead', 'field'], name='unique_casevalue_per_lead_field')
+        ]
+
+    def set_value(self, field_type, value):
+        # Only the value column matching the field type is kept
+        self.value_text = value if field_type == 'text' else None
+        self.value_number = value if field_type == 'number' else None
+        self.value_date = value if field_type == 'date' else None
+
     def save(self, *args, **kwargs):
         # Ensure that only the appropriate value field is set
         if self.field.field_type == 'text':
@@ -116,23 +358,77 @@ def handle_upload_follow_ups(instance, filename):
     result = os.path.join(directory, os.path.basename(target_file))
     return result
 
+class FollowUpQuerySet(OrganisationQuerySet):
+    organisation_field = 'lead__organisation'
+    lead_prefix = 'lead__'
+
 class FollowUp(models.Model):
     lead = models.ForeignKey(Lead, related_name="followups", on_delete=models.CASCADE)
     date_added = models.DateTimeField(auto_now_add=True)
     notes = models.TextField(blank=True, null=True)
     file = models.FileField(null=True, blank=True, upload_to=handle_upload_follow_ups)
 
+    objects = FollowUpQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.lead.first_name} {self.lead.last_name}"
     
+class FolderQuerySet(OrganisationQuerySet):
+
+    def subtree(self, folder):
+        """The folder and every folder below it."""
+        return self.filter(Q(pk=folder.pk) | Q(path__startswith=folder.get_subtree_path()))
+
+    def below(self, folder):
+        """Every folder below the folder, or every folder when it is None."""
+        if folder is None:
+            return self.all()
+        return self.filter(path__startswith=folder.get_subtree_path())
+
 class Folder(models.Model):
     
     name = models.CharField(max_length=255)
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='subfolders', null=True, blank=True)
+    # The pks of the folder's ancestors from the root down, like /1/5/
+    path = models.CharField(max_length=1000, default='/', editable=False, db_index=True)
+
+    objects = FolderQuerySet.as_manager()
 
     def __str__(self):
         return self.name
+
+    def get_subtree_path(self):
+        """The path every folder below this one starts with."""
+        return f'{self.path}{self.pk}/'
+
+    def get_ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/') if pk]
+
+    def get_ancestors(self):
+        """The folders above this one, from the root down, in one query."""
+        ancestor_ids = self.get_ancestor_ids()
+        folders = Folder.objects.in_bulk(ancestor_ids)
+        return [folders[pk] for pk in ancestor_ids if pk in folders]
+
+    def save(self, *args, **kwargs):
+        ancestor_ids = self.get_ancestor_ids()
+        if not self._state.adding and (ancestor_ids[-1] if ancestor_ids else None) == self.parent_id:
+            return super().save(*args, **kwargs)
+
+        # Created or moved: the path of the folder and of its subtree follow the parent's
+        subtree_path = None if self._state.adding else self.get_subtree_path()
+        self.path = self.parent.get_subtree_path() if self.parent_id else '/'
+        if subtree_path and self.path.startswith(subtree_path):
+            raise ValueError("A folder cannot be moved below itself.")
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'path'}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if subtree_path:
+                Folder.objects.filter(path__startswith=subtree_path).update(
+                    path=Concat(Value(self.get_subtree_path()), Substr('path', len(subtree_path) + 1))
+                )
     
 def handle_upload_custom_files(instance, filename):
     directory = ""
@@ -167,6 +463,8 @@ class FolderDocument(models.Model):
     file = models.FileField(upload_to=handle_upload_custom_files, blank=True, null=True)
     url = models.URLField(blank=True, null=True)
 
+    objects = OrganisationQuerySet.as_manager()
+
     def __str__(self):
         return self.title if self.title else "NoName"
 
@@ -207,6 +505,36 @@ class TeamMember(models.Model):
     def __str__(self):
         return self.member.username if self.member else "NoName"
 
+class UserAncestry(models.Model):
+    """
+    The users above each user: the user themselves at depth 0, their supervisor
+    chain from depth 1, and the leader of every team they belong to, on a row
+    with that team. organisation is the user's own, copied on every row.
+
+    Rebuilt by leads.hierarchy when relations, organisations or teams change,
+    so that the users visible to someone are one indexed join.
+    """
+    user = models.ForeignKey(User, related_name='ancestry', on_delete=models.CASCADE)
+    ancestor = models.ForeignKey(User, related_name='descendants', on_delete=models.CASCADE)
+    depth = models.PositiveSmallIntegerField(default=0)
+    team = models.ForeignKey(Team, null=True, blank=True, on_delete=models.CASCADE)
+    organisation = models.ForeignKey(UserProfile, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ancestor'], condition=models.Q(team__isnull=True), name='unique_user_ancestor'),
+            models.UniqueConstraint(fields=['user', 'team'], name='unique_user_team_ancestor'),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor', 'team', 'user'], name='ancestry_ancestor_idx'),
+            models.Index(fields=['team', 'user'], name='ancestry_team_idx'),
+            # One row per user: their own one
+            models.Index(fields=['organisation', 'user'], name='ancestry_org_user_idx', condition=models.Q(depth=0, team__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} under {self.ancestor_id} ({self.depth}, team {self.team_id})"
+
 def handle_upload_work_report(instance, filename):
     directory = f"workreports/{instance.organisation}/"
 
@@ -228,12 +556,44 @@ def handle_upload_work_report(instance, filename):
     result = os.path.join(directory, os.path.basename(target_file))
     return result
     
+class WorkReportQuerySet(OrganisationQuerySet):
+
+    def visible_to(self, user):
+        """
+        Level 1 users see the reports of everyone in their teams, level 2 users
+        those of the members of the teams they lead, both their own included.
+        """
+        from .scope import get_level
+        level = get_level(user)
+        if level not in (1, 2):
+            return super().visible_to(user)
+        if level == 1:
+            teams = UserAncestry.objects.filter(user=user, team__isnull=False).values('team')
+            team_users = UserAncestry.objects.filter(team__in=teams).values('user')
+        else:
+            team_users = UserAncestry.objects.filter(ancestor=user, team__isnull=False).values('user')
+        return self.filter(Q(creator=user) | Q(creator__in=team_users))
+
+    def before(self, date_added, pk):
+        """The reports listed after the one added at date_added with pk, newest first."""
+        return self.filter(
+            Q(date_added__lt=date_added) | Q(date_added=date_added, pk__lt=pk)
+        ).order_by('-date_added', '-pk')
+
 class WorkReport(models.Model):
     title = models.CharField(max_length=500, default="work_report")
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     creator = models.ForeignKey(User, on_delete=models.CASCADE, default=1)
     file = models.FileField(upload_to=handle_upload_work_report, blank=True, null=True)
     date_added = models.DateTimeField(auto_now_add=True)
+
+    objects = WorkReportQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['creator', 'date_added'], name='workreport_creator_date_idx'),
+            models.Index(fields=['organisation', 'date_added'], name='workreport_org_date_idx'),
+        ]
  
     def __str__(self):
         return self.title if self.title else "NoName"
\ No newline at end of file
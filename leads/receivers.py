@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .hierarchy import rebuild_ancestry, rebuild_team_ancestry
+from .models import Team, TeamMember, UserProfile, UserRelation
+from .scope import invalidate_scopes
+
+
+def after_change(signal, function, *args, **kwargs):
+    # Rows of a deleted object may belong to users or teams still being deleted with it
+    if signal is post_delete:
+        transaction.on_commit(lambda: function(*args, **kwargs))
+    else:
+        function(*args, **kwargs)
+
+
+@receiver([post_save, post_delete], sender=UserRelation)
+@receiver([post_save, post_delete], sender=UserProfile)
+def hierarchy_changed(sender, instance, signal, **kwargs):
+    invalidate_scopes()
+    after_change(signal, rebuild_ancestry, [instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Team)
+def team_changed(sender, instance, signal, **kwargs):
+    after_change(signal, rebuild_team_ancestry, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=TeamMember)
+def team_member_changed(sender, instance, signal, **kwargs):
+    after_change(signal, rebuild_ancestry, [instance.member_id], descendants=False)
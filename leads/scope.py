@@ -0,0 +1,78 @@
+import time
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from .models import UserProfile, UserRelation
+
+SCOPE_TIMEOUT = 60 * 60
+SCOPE_VERSION_KEY = 'user_scope_version'
+
+
+class Scope:
+    """
+    What a user acts for: their level, their supervisor and the organisation
+    (UserProfile) whose leads, fields and folders they work on.
+
+    lvl3 users own their organisation, lvl1 and lvl2 users act for their
+    supervisor's one, lvl4 users have none.
+    """
+
+    def __init__(self, user, supervisor_id=None, organisation_id=None):
+        self.user = user
+        self.supervisor_id = supervisor_id
+        self.organisation_id = organisation_id
+
+    @property
+    def level(self):
+        return get_level(self.user)
+
+    @cached_property
+    def organisation(self):
+        if self.organisation_id is None:
+            return None
+        # Built from the cached ids, without a query
+        owner_id = self.user.pk if self.level == 3 else self.supervisor_id
+        return UserProfile.from_db(None, ['id', 'user_id'], [self.organisation_id, owner_id])
+
+
+def get_level(user):
+    for level in (4, 3, 2, 1):
+        if getattr(user, f'is_lvl{level}', False):
+            return level
+    return 0
+
+def invalidate_scopes():
+    # Hierarchy changes are rare, so any of them makes every cached scope unreachable
+    cache.set(SCOPE_VERSION_KEY, time.time_ns(), None)
+
+def resolve_scope(user, level):
+    if level == 3:
+        organisation_id = UserProfile.objects.filter(user=user).values_list('pk', flat=True).first()
+        return {'supervisor_id': None, 'organisation_id': organisation_id}
+    if level in (1, 2):
+        relation = UserRelation.objects.filter(user=user).values_list('supervisor', 'supervisor__userprofile').first()
+        if relation:
+            return {'supervisor_id': relation[0], 'organisation_id': relation[1]}
+    return {'supervisor_id': None, 'organisation_id': None}
+
+def get_scope(user):
+    """
+    Returns the Scope of a user, resolved at most once per user instance and
+    cached across requests until the user hierarchy changes.
+    """
+    if not user.is_authenticated:
+        return Scope(user)
+    scope = getattr(user, '_scope', None)
+    if scope is None:
+        version = cache.get(SCOPE_VERSION_KEY)
+        if version is None:
+            version = time.time_ns()
+            cache.set(SCOPE_VERSION_KEY, version, None)
+        level = get_level(user)
+        # The level is part of the key, so a changed level never reads a stale scope
+        key = f'user_scope:{version}:{user.pk}:{level}'
+        data = cache.get(key)
+        if data is None:
+            data = resolve_scope(user, level)
+            cache.set(key, data, SCOPE_TIMEOUT)
+        scope = user._scope = Scope(user, **data)
+    return scope
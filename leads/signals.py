@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent with days, a set of (organisation_id, date) pairs, whenever leads
+# created on those days are created, changed or deleted
+leads_changed = Signal()
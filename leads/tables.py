@@ -0,0 +1,174 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q, Exists, OuterRef, Subquery
+from django.http.response import JsonResponse
+from django.utils import formats
+from django.utils.html import conditional_escape
+from .models import Lead, CaseValue, order_id_ordering
+from .columns import get_column_schema
+from .templatetags.fetchfield import get_field_value
+
+
+class LeadTableJsonMixin:
+    """
+    Serves the view's lead queryset to a DataTables table in server-side mode.
+
+    Paging, sorting (including CaseField columns), status filtering and search
+    run in SQL, so only the rows of the page being viewed are rendered.
+    The view keeps its own get_queryset, which decides which leads are visible.
+    """
+    max_page_length = 200
+    search_fields = (
+        'order_id',
+        'first_name',
+        'last_name',
+        'email',
+        'phone_number',
+        'description',
+        'status',
+        'agent__username',
+        'manager__username',
+    )
+    # Columns ordered by a related or derived value instead of their own name
+    order_fields = {
+        'Order-ID': order_id_ordering(),
+        'agent': 'agent__username',
+        'manager': 'manager__username',
+    }
+    case_value_fields = {
+        'text': 'value_text',
+        'number': 'value_number',
+        'date': 'value_date',
+    }
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        columns = self.get_table_columns()
+        records_total = queryset.count()
+
+        queryset = self.filter_table(queryset)
+        records_filtered = queryset.count() if self.is_filtered() else records_total
+
+        queryset = self.order_table(queryset, columns)
+        start, length = self.get_page_bounds()
+        # Custom columns of the whole page come from a single CaseValue query
+        page = CaseValue.objects.pivot_for(queryset.select_related('agent', 'manager')[start:start + length])
+
+        return JsonResponse({
+            'draw': self.get_int_param('draw', 0),
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': [self.get_table_row(lead, columns) for lead in page],
+        })
+
+    def get_int_param(self, name, default):
+        try:
+            return int(self.request.GET.get(name, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_table_columns(self):
+        # DataTables sends the column names declared in the template as columns[i][name]
+        columns = []
+        index = 0
+        while f'columns[{index}][name]' in self.request.GET:
+            columns.append(self.request.GET.get(f'columns[{index}][name]'))
+            index += 1
+        return columns
+
+    def get_table_organisation(self):
+        # Custom columns belong to the organisation of the leads being shown
+        return self.get_queryset().values_list('organisation', flat=True).first()
+
+    def get_case_fields(self):
+        if not hasattr(self, '_table_case_fields'):
+            organisation_id = self.get_table_organisation()
+            self._table_case_fields = {
+                field['name']: field
+                for field in get_column_schema(organisation_id)['case_fields']
+            } if organisation_id else {}
+        return self._table_case_fields
+
+    def is_lead_column(self, name):
+        if name in self.order_fields:
+            return True
+        try:
+            field = Lead._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return field.concrete
+
+    def get_search_value(self):
+        return self.request.GET.get('search[value]', '').strip()
+
+    def get_status_value(self):
+        status = self.request.GET.get('status', '')
+        return status if status in dict(Lead.STATUS_CHOICES) else ''
+
+    def is_filtered(self):
+        return bool(self.get_search_value() or self.get_status_value())
+
+    def filter_table(self, queryset):
+        status = self.get_status_value()
+        if status:
+            queryset = queryset.filter(status=status)
+
+        value = self.get_search_value()
+        if value:
+            search = Q()
+            for field_name in self.search_fields:
+                search |= Q(**{f'{field_name}__icontains': value})
+            search |= Exists(CaseValue.objects.filter(lead=OuterRef('pk'), value_text__icontains=value))
+            queryset = queryset.filter(search)
+        return queryset
+
+    def order_table(self, queryset, columns):
+        ordering = []
+        index = 0
+        while f'order[{index}][column]' in self.request.GET:
+            try:
+                column = columns[int(self.request.GET.get(f'order[{index}][column]'))]
+            except (ValueError, IndexError):
+                column = None
+            prefix = '-' if self.request.GET.get(f'order[{index}][dir]') == 'desc' else ''
+            index += 1
+
+            if not column:
+                continue
+            if self.is_lead_column(column):
+                fields = self.order_fields.get(column, column)
+                for field in fields if isinstance(fields, tuple) else (fields,):
+                    field = F(field) if isinstance(field, str) else field
+                    ordering.append(field.desc() if prefix else field.asc())
+                continue
+
+            case_field = self.get_case_fields().get(column)
+            if case_field is None:
+                continue
+            alias = f'case_field_{case_field["pk"]}'
+            queryset = queryset.annotate(**{
+                alias: Subquery(
+                    CaseValue.objects.filter(lead=OuterRef('pk'), field=case_field['pk'])
+                    .values(self.case_value_fields[case_field['type']])[:1]
+                )
+            })
+            ordering.append(prefix + alias)
+
+        # Keep paging stable when the sorted values tie
+        return queryset.order_by(*ordering, '-pk')
+
+    def get_page_bounds(self):
+        start = max(self.get_int_param('start', 0), 0)
+        length = self.get_int_param('length', self.max_page_length)
+        if length <= 0 or length > self.max_page_length:
+            length = self.max_page_length
+        return start, length
+
+    def get_table_cell(self, lead, column):
+        value = get_field_value(lead, column)
+        if value is None:
+            return ''
+        return conditional_escape(formats.localize(value))
+
+    def get_table_row(self, lead, columns):
+        # The lead pk is appended after the cells for the link and edit columns
+        return [self.get_table_cell(lead, column) for column in columns if column] + [lead.pk]
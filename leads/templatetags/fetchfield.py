@@ -22,17 +22,14 @@ def get_field_value(instance, field_name):
         return value
     
     if field_name == "Order-ID":
-        # Assuming 'created_at' is the field storing the creation date
-        created_date = instance.date_added.date()
-        same_day_leads = instance.__class__.objects.filter(date_added__date=created_date).order_by('date_added')
-        
-        # Get the index of the current instance in the list of same-day leads (1-based)
-        lead_index = list(same_day_leads).index(instance) + 1
-        
-        # Format the Order-ID: SEIYYMMDD00X
-        company_abbreviation = "SEI"
-        order_id = f"{company_abbreviation}{created_date.strftime('%y%m%d')}{lead_index:03d}"
-        return order_id
+        # Assigned once when the lead is created, see Lead.save
+        return instance.order_id
+
+    # Leads loaded through CaseValue.objects.pivot_for already carry their values
+    case_values = getattr(instance, 'case_values', None)
+    if case_values is not None:
+        return case_values.get(field_name)
+
     # If the attribute is not found, try to get it from CaseValue
     try:
         # Get the CaseField that matches the field_name for the user's profile
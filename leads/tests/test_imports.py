@@ -0,0 +1,66 @@
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.shortcuts import reverse
+from django.test import TestCase
+from leads.models import User, UserProfile, UserRelation, Lead, CaseField
+
+
+class LeadImportTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.supervisor = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.supervisor)
+        self.agent = User.objects.create_user(username="agent", password="pass", is_lvl1=True)
+        UserRelation.objects.create(user=self.agent, supervisor=self.supervisor)
+        CaseField.objects.create(user=self.organisation, name="region", field_type="text")
+        CaseField.objects.create(user=self.organisation, name="signed", field_type="date")
+
+    def upload(self, user, content, name="leads.csv", encoding="utf-8"):
+        self.client.force_login(user)
+        if isinstance(content, str):
+            content = content.encode(encoding)
+        upload = SimpleUploadedFile(name, content)
+        return self.client.post(reverse("leads:lead-import"), {"file": upload})
+
+    def test_imports_valid_rows_and_reports_invalid_ones(self):
+        response = self.upload(self.supervisor, (
+            "first_name,last_name,quote,commission,agent,region,signed,unknown\n"
+            "Ann,Lee,1000,10,agent,north,2024-05-01,x\n"
+            ",Lee,1000,10,,south,,\n"
+            "Bob,Lee,abc,10,,,,\n"
+            "Cid,Lee,500,5,nobody,,,\n"
+        ))
+        importer = response.context["importer"]
+        self.assertEqual(importer.created, 1)
+        self.assertEqual([row for row, message in importer.errors], [3, 4, 5])
+        self.assertEqual(importer.ignored_columns, ["unknown"])
+
+        lead = Lead.objects.get()
+        self.assertEqual((lead.agent, lead.quote, lead.commission, lead.commission_cents), (self.agent, 1000, 10, 10000))
+        self.assertTrue(lead.order_id)
+        values = {value.field.name: value for value in lead.extrafields.all()}
+        self.assertEqual(values["region"].value_text, "north")
+        self.assertEqual(str(values["signed"].value_date), "2024-05-01")
+
+    def test_agents_import_their_own_leads_without_rates(self):
+        self.upload(self.agent, "first_name,last_name,commission\nAnn,Lee,50\n")
+        lead = Lead.objects.get()
+        self.assertEqual((lead.agent, lead.organisation, lead.commission), (self.agent, self.organisation, 0))
+
+    def test_unreadable_files_are_form_errors(self):
+        response = self.upload(self.supervisor, "first_name,last_name\n张,伟\n", encoding="gbk")
+        self.assertIn("UTF-8", response.context["form"].errors["file"][0])
+        response = self.upload(self.supervisor, b"PK\x03\x04 not a workbook", name="leads.xlsx")
+        self.assertTrue(response.context["form"].errors["file"])
+        self.assertFalse(Lead.objects.exists())
+
+    def test_an_error_later_in_the_file_keeps_the_imported_batches(self):
+        # Past the first chunk the upload is decoded in
+        content = ("first_name,last_name\n" + "Ann,Lee\n" * 2000).encode() + "张,伟\n".encode("gbk")
+        with mock.patch("leads.forms.check_upload"), mock.patch("leads.imports.IMPORT_BATCH_SIZE", 500):
+            response = self.upload(self.supervisor, content)
+        created = Lead.objects.count()
+        self.assertTrue(created)
+        self.assertIn(f"{created} leads were imported", response.context["form"].errors["file"][0])
@@ -0,0 +1,88 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from leads.hierarchy import get_organisation_users, get_supervisors, get_team_users, with_descendants
+from leads.models import User, UserProfile, UserRelation, UserAncestry, Team, TeamMember, Lead
+from leads.scope import get_scope
+
+# Query counts below leave out the shared database cache
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ScopeTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.supervisor = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.supervisor)
+        self.agent = User.objects.create_user(username="agent", password="pass", is_lvl1=True)
+        UserRelation.objects.create(user=self.agent, supervisor=self.supervisor)
+
+    def test_scope_is_resolved_once_and_cached(self):
+        scope = get_scope(self.supervisor)
+        self.assertEqual((scope.level, scope.organisation_id), (3, self.organisation.pk))
+
+        agent = User.objects.get(pk=self.agent.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_scope(agent).organisation_id, self.organisation.pk)
+            self.assertEqual(get_scope(agent).supervisor_id, self.supervisor.pk)
+        # A later request reads the cached scope
+        with self.assertNumQueries(0):
+            self.assertEqual(get_scope(User(pk=agent.pk, is_lvl1=True)).organisation, self.organisation)
+
+    def test_relation_changes_invalidate_the_scope(self):
+        get_scope(self.agent)
+        other = User.objects.create_user(username="other", password="pass", is_lvl3=True)
+        other_organisation = UserProfile.objects.create(user=other)
+        UserRelation.objects.filter(user=self.agent).delete()
+        UserRelation.objects.create(user=self.agent, supervisor=other)
+
+        agent = User.objects.get(pk=self.agent.pk)
+        self.assertEqual(get_scope(agent).organisation_id, other_organisation.pk)
+
+
+class UserAncestryTest(TestCase):
+
+    setUp = ScopeTest.setUp
+
+    def test_ancestry_follows_relations_and_teams(self):
+        manager = User.objects.create_user(username="manager", password="pass", is_lvl2=True)
+        UserRelation.objects.create(user=manager, supervisor=self.supervisor)
+        team = Team.objects.create(name="team", team_leader=manager)
+        TeamMember.objects.create(team=team, member=self.agent)
+        self.assertCountEqual(get_organisation_users(self.organisation.pk), [self.supervisor, self.agent, manager])
+        self.assertEqual(
+            set(UserAncestry.objects.filter(user=self.agent, team=None).values_list('ancestor', 'depth')),
+            {(self.agent.pk, 0), (self.supervisor.pk, 1)},
+        )
+        self.assertCountEqual(get_team_users(self.agent), [self.agent, manager])
+        self.assertCountEqual(get_team_users(manager, led_only=True), [self.agent, manager])
+
+        # Deletions are applied once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            UserRelation.objects.filter(user=self.agent).delete()
+            team.delete()
+        self.assertCountEqual(get_organisation_users(self.organisation.pk), [self.supervisor, manager])
+        self.assertCountEqual(get_team_users(self.agent), [])
+
+    def test_visible_to_is_a_single_query(self):
+        mine = Lead.objects.create(first_name="Ann", last_name="Lee", organisation=self.organisation, description="", agent=self.agent)
+        theirs = Lead.objects.create(first_name="Bob", last_name="Lee", organisation=self.organisation, description="")
+        other = User.objects.create_user(username="other", password="pass", is_lvl3=True)
+        UserProfile.objects.create(user=other)
+
+        agent = User.objects.get(pk=self.agent.pk)
+        with self.assertNumQueries(1):
+            self.assertCountEqual(Lead.objects.visible_to(agent), [mine])
+        self.assertCountEqual(Lead.objects.visible_to(self.supervisor), [mine, theirs])
+        self.assertCountEqual(Lead.objects.visible_to(other), [])
+
+    def test_rebuilds_read_only_the_chains_they_change(self):
+        other = User.objects.create_user(username="other", password="pass", is_lvl3=True)
+        UserProfile.objects.create(user=other)
+        UserRelation.objects.create(user=User.objects.create_user(username="theirs", password="pass", is_lvl1=True), supervisor=other)
+        manager = User.objects.create_user(username="manager", password="pass", is_lvl2=True)
+        UserRelation.objects.create(user=manager, supervisor=self.supervisor)
+        UserRelation.objects.filter(user=self.agent).update(supervisor=manager)
+
+        self.assertEqual(get_supervisors([self.agent.pk]), {self.agent.pk: manager.pk, manager.pk: self.supervisor.pk, self.supervisor.pk: None})
+        self.assertEqual(with_descendants([manager.pk]), {manager.pk, self.agent.pk})
@@ -1,5 +1,13 @@
+import csv
+import io
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
 from django.shortcuts import reverse
+from leads.models import User, UserProfile, UserRelation, Lead, CaseField, CaseValue
 
 class LandingPageTest(TestCase):
     
@@ -8,3 +16,236 @@ class LandingPageTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "landing.html")
 
+
+
+class LeadListDataTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+        self.region = CaseField.objects.create(user=self.organisation, name="region", field_type="text")
+        for first_name, status, region in [("Ann", "进行中", "north"), ("Bob", "已完成", "south"), ("Cid", "已完成", "east")]:
+            lead = Lead.objects.create(
+                first_name=first_name, last_name="Lee", organisation=self.organisation,
+                status=status, description="",
+            )
+            CaseValue.objects.create(lead=lead, field=self.region, value_text=region)
+        self.client.force_login(self.user)
+
+    def get_data(self, **params):
+        query = {
+            "draw": 1,
+            "start": 0,
+            "length": 10,
+            "columns[0][name]": "first_name",
+            "columns[1][name]": "status",
+            "columns[2][name]": "region",
+            "columns[3][name]": "",
+        }
+        query.update(params)
+        return self.client.get(reverse("leads:lead-list-data"), query).json()
+
+    def test_pages_and_sorts_by_case_field(self):
+        data = self.get_data(**{"order[0][column]": 2, "order[0][dir]": "asc", "length": 2})
+        self.assertEqual(data["recordsTotal"], 3)
+        self.assertEqual(data["recordsFiltered"], 3)
+        self.assertEqual([row[0] for row in data["data"]], ["Cid", "Ann"])
+        self.assertEqual(data["data"][0][2], "east")
+
+    def test_sorts_order_ids_by_day_then_number(self):
+        for first_name, order_id in [("Ann", "SEI2401011000"), ("Bob", "SEI240101999"), ("Cid", "SEI240102001")]:
+            Lead.objects.filter(first_name=first_name).update(order_id=order_id)
+        data = self.get_data(**{"columns[3][name]": "Order-ID", "order[0][column]": 3, "order[0][dir]": "asc"})
+        self.assertEqual([row[0] for row in data["data"]], ["Bob", "Ann", "Cid"])
+        data = self.get_data(**{"columns[3][name]": "Order-ID", "order[0][column]": 3, "order[0][dir]": "desc"})
+        self.assertEqual([row[0] for row in data["data"]], ["Cid", "Ann", "Bob"])
+
+    def test_filters_by_status_and_search(self):
+        data = self.get_data(status="已完成", **{"search[value]": "sou"})
+        self.assertEqual(data["recordsTotal"], 3)
+        self.assertEqual(data["recordsFiltered"], 1)
+        self.assertEqual(data["data"][0][0], "Bob")
+
+    def test_query_count_does_not_grow_with_custom_columns(self):
+        CaseField.objects.create(user=self.organisation, name="source", field_type="text")
+        CaseField.objects.create(user=self.organisation, name="signed", field_type="date")
+        self.get_data()
+        with CaptureQueriesContext(connection) as one_column:
+            self.get_data()
+        with CaptureQueriesContext(connection) as three_columns:
+            self.get_data(**{"columns[3][name]": "source", "columns[4][name]": "signed", "columns[5][name]": ""})
+        self.assertEqual(len(one_column), len(three_columns))
+
+
+class LeadOrderIdTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+
+    def create_lead(self):
+        return Lead.objects.create(first_name="Ann", last_name="Lee", organisation=self.organisation, description="")
+
+    def test_order_ids_count_up_within_the_day(self):
+        first, second = self.create_lead(), self.create_lead()
+        prefix = "SEI" + timezone.now().strftime("%y%m%d")
+        self.assertEqual(first.order_id, prefix + "001")
+        self.assertEqual(second.order_id, prefix + "002")
+
+        second.description = "updated"
+        second.save()
+        second.refresh_from_db()
+        self.assertEqual(second.order_id, prefix + "002")
+
+    def test_lookup_redirects_to_lead(self):
+        lead = self.create_lead()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("leads:lead-order-lookup"), {"order_id": lead.order_id.lower()})
+        self.assertRedirects(response, reverse("leads:lead-detail", kwargs={"pk": lead.pk}))
+
+
+class LeadColumnSchemaTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+        Lead.objects.create(first_name="Ann", last_name="Lee", organisation=self.organisation, description="")
+        self.client.force_login(self.user)
+
+    def test_header_is_cached_until_fields_change(self):
+        self.client.get(reverse("leads:lead-list"))
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get(reverse("leads:lead-list"))
+        self.assertFalse([query for query in warm if "leads_casefield" in query["sql"]])
+
+        self.client.post(reverse("leads:create-field"), {"fieldName": "signed", "fieldType": "date"})
+        response = self.client.get(reverse("leads:lead-list"))
+        self.assertEqual(response.context["lead_fields"][-1], "signed")
+        self.assertIn('"index": %d' % (len(response.context["lead_fields"]) - 1), response.context["datetime_fields_info"])
+
+
+class LeadExportTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+        region = CaseField.objects.create(user=self.organisation, name="region", field_type="text")
+        lead = Lead.objects.create(
+            first_name="Ann", last_name="Lee", organisation=self.organisation,
+            quote=1000, commission=10, co_commission=5, status="已完成", description="",
+        )
+        CaseValue.objects.create(lead=lead, field=region, value_text="north")
+        self.client.force_login(self.user)
+
+    def test_csv_streams_leads_with_custom_columns(self):
+        response = self.client.get(reverse("leads:lead-export"), {"format": "csv"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0].split(",")[-1], "region")
+        row = lines[1].split(",")
+        self.assertEqual(row[1:3], ["Ann", "Lee"])
+        self.assertEqual(row[11:13], ["100.0", "50.0"])
+        self.assertEqual(row[-1], "north")
+
+    def test_text_is_exported_as_text(self):
+        Lead.objects.update(first_name="=HYPERLINK(\"http://example.com\")", last_name="-1+1", description="a\x0bb")
+        response = self.client.get(reverse("leads:lead-export"), {"format": "csv"})
+        row = next(csv.reader(b"".join(response.streaming_content).decode("utf-8-sig").splitlines()[1:]))
+        self.assertEqual(row[1:3], ["'=HYPERLINK(\"http://example.com\")", "'-1+1"])
+
+        response = self.client.get(reverse("leads:lead-export"), {"format": "xlsx"})
+        sheet = load_workbook(io.BytesIO(b"".join(response.streaming_content))).active
+        first_name, last_name = sheet.cell(row=2, column=2), sheet.cell(row=2, column=3)
+        self.assertEqual((first_name.data_type, first_name.value), ("s", "'=HYPERLINK(\"http://example.com\")"))
+        self.assertEqual(last_name.value, "'-1+1")
+        self.assertEqual(sheet.cell(row=2, column=14).value, "ab")
+        self.assertEqual(sheet.cell(row=2, column=9).value, 1000)
+
+
+class LeadCaseValueSaveTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+        self.lead = Lead.objects.create(first_name="Ann", last_name="Lee", organisation=self.organisation, description="")
+        self.client.force_login(self.user)
+
+    def update(self, **values):
+        data = {
+            "first_name": "Ann", "last_name": "Lee", "description": "d", "quote": 1000,
+            "commission": 10, "co_commission": 5, "status": "进行中",
+        }
+        data.update(values)
+        return self.client.post(reverse("leads:lead-update", args=[self.lead.pk]), data)
+
+    def test_update_writes_case_values_in_constant_queries(self):
+        region = CaseField.objects.create(user=self.organisation, name="region", field_type="text")
+        self.update(region="west")
+        with CaptureQueriesContext(connection) as one_field:
+            self.update(region="north")
+        for name in ("source", "floor", "signed"):
+            CaseField.objects.create(user=self.organisation, name=name, field_type="number" if name == "floor" else "text")
+        with CaptureQueriesContext(connection) as four_fields:
+            response = self.update(region="south", floor="3", source="web")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(one_field), len(four_fields))
+
+        values = {value.field.name: value for value in self.lead.extrafields.select_related("field")}
+        self.assertEqual(CaseValue.objects.filter(lead=self.lead, field=region).count(), 1)
+        self.assertEqual((values["region"].value_text, values["region"].value_number), ("south", None))
+        self.assertEqual((values["floor"].value_number, values["floor"].value_text), (3, None))
+        self.lead.refresh_from_db()
+        self.assertEqual((self.lead.quote, self.lead.commission, self.lead.description), (1000, 10, "d"))
+
+
+class LeadBulkActionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.user)
+        self.agent = User.objects.create_user(username="agent", password="pass", is_lvl1=True)
+        UserRelation.objects.create(user=self.agent, supervisor=self.user)
+        self.leads = [
+            Lead.objects.create(first_name=name, last_name="Lee", organisation=self.organisation, description="")
+            for name in ("Ann", "Bob", "Cid")
+        ]
+        other = User.objects.create_user(username="other", password="pass", is_lvl3=True)
+        self.other_lead = Lead.objects.create(
+            first_name="Dan", last_name="Lee", organisation=UserProfile.objects.create(user=other), description="",
+        )
+
+    def post(self, as_user, **data):
+        self.client.force_login(as_user)
+        return self.client.post(reverse("leads:lead-bulk-action"), data)
+
+    def test_updates_only_visible_leads_in_one_statement(self):
+        ids = ",".join(str(lead.pk) for lead in self.leads[:2] + [self.other_lead])
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("leads:lead-bulk-action"), {"action": "status", "ids": ids, "status": "已完成"})
+        self.assertEqual(response.json(), {"action": "status", "count": 2})
+        self.assertEqual(len([query for query in queries if query["sql"].startswith("UPDATE")]), 1)
+        self.assertEqual(Lead.objects.filter(status="已完成").count(), 2)
+
+        response = self.post(self.user, action="agent", ids=ids, user=self.agent.pk)
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(Lead.objects.filter(agent=self.agent).count(), 2)
+
+    def test_permission_rules(self):
+        lead = self.leads[0]
+        lead.agent = self.agent
+        lead.save()
+        response = self.post(self.agent, action="manager", ids=str(lead.pk), user=self.agent.pk)
+        self.assertEqual(response.status_code, 400)
+        response = self.post(self.agent, action="delete", ids=str(lead.pk))
+        self.assertEqual(response.status_code, 403)
+
+        response = self.post(self.user, action="delete", ids=f"{lead.pk},{self.other_lead.pk}")
+        self.assertEqual(response.json()["count"], 1)
+        self.assertTrue(Lead.objects.filter(pk=self.other_lead.pk).exists())
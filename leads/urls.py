@@ -1,7 +1,7 @@
 
 from django.urls import path
 from .views import (
-    LeadListView, LeadDetailView, LeadCreateView, LeadUpdateView, LeadDeleteView, LeadJsonView, 
+    LeadListView, LeadListDataView, LeadExportView, LeadOrderLookupView, LeadBulkActionView, LeadDetailView, LeadCreateView, LeadUpdateView, LeadDeleteView, LeadJsonView, LeadImportView, 
     FollowUpCreateView, FollowUpUpdateView, FollowUpDeleteView, CreateFieldView, CaseFieldListView, CreateFieldDeleteView,
 )
 
@@ -9,6 +9,10 @@ app_name = "leads"
 
 urlpatterns = [
     path('', LeadListView.as_view(), name='lead-list'),
+    path('data/', LeadListDataView.as_view(), name='lead-list-data'),
+    path('export/', LeadExportView.as_view(), name='lead-export'),
+    path('order/', LeadOrderLookupView.as_view(), name='lead-order-lookup'),
+    path('bulk/', LeadBulkActionView.as_view(), name='lead-bulk-action'),
     path('json/', LeadJsonView.as_view(), name='lead-list-json'),
     path('<int:pk>/', LeadDetailView.as_view(), name='lead-detail'),
     path('<int:pk>/update/', LeadUpdateView.as_view(), name='lead-update'),
@@ -17,6 +21,7 @@ urlpatterns = [
     path('followups/<int:pk>/', FollowUpUpdateView.as_view(), name='lead-followup-update'),
     path('followups/<int:pk>/delete/', FollowUpDeleteView.as_view(), name='lead-followup-delete'),
     path('create/', LeadCreateView.as_view(), name='lead-create'),
+    path('import/', LeadImportView.as_view(), name='lead-import'),
     path('create_field/', CreateFieldView.as_view(), name='create-field'),
     path('casefields/', CaseFieldListView.as_view(), name='casefield-list'),
     path('casefields/<int:pk>/delete', CreateFieldDeleteView.as_view(), name='casefield-delete'),
@@ -4,20 +4,25 @@ from django import contrib
 from django.contrib import messages
 from django.core.mail import send_mail
 from django.http.response import JsonResponse
-from django.shortcuts import render, redirect, reverse
+from django.shortcuts import get_object_or_404, render, redirect, reverse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import generic, View
 from agents.mixins import SupervisorAndLoginRequiredMixin, NotSuperuserAndLoginRequiredMixin, NoLvl1AndLoginRequiredMixin
-from .models import Lead, FollowUp, CaseField, CaseValue, UserRelation, User
+from .models import Lead, FollowUp, CaseField, CaseValue, User
 from .forms import (
     LeadModelForm, 
     FollowUpModelForm,
     LeadUpdateForm,
-    FollowUpUpdateModelForm
+    FollowUpUpdateModelForm,
+    LeadImportForm,
+    LeadBulkActionForm,
+    get_assignable_users,
 )
-from django.db.models import Q
-from django.db import models
-from django.core.exceptions import FieldDoesNotExist
+from .tables import LeadTableJsonMixin
+from .scope import get_scope
+from .columns import get_column_schema, get_table_columns, invalidate_column_schema
+from .exports import csv_export_response, xlsx_export_response
+from .imports import LeadImporter, UnreadableFileError, read_rows
 import json
 from django.db import IntegrityError
 
@@ -47,146 +52,99 @@ class LeadListView(LoginRequiredMixin, generic.ListView):
     context_object_name = "leads"
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Lead.objects.all()
-        # initial queryset of leads for the entire organisation
-        if user.is_lvl4:
-            queryset = Lead.objects.all()
-        elif user.is_lvl3:
-            queryset = Lead.objects.filter(
-                organisation=user.userprofile, 
-                #agent__isnull=False
-            )
-        elif user.is_lvl2:
-            
-            sr = get_or_none(UserRelation, user=user)
-            if sr:
-                up = sr.supervisor.userprofile
-                queryset = Lead.objects.filter(
-                    organisation=up, 
-                    #agent__isnull=False
-                )
-            else:
-                queryset = Lead.objects.none()
-            # queryset = queryset.filter(manager__user=user)
-        elif user.is_lvl1:
-            sr = get_or_none(UserRelation, user=user)
-            if sr:
-                up = sr.supervisor.userprofile
-                queryset = Lead.objects.filter(
-                    organisation=up, 
-                    #agent__isnull=False
-                )
-                queryset = queryset.filter(
-                    Q(agent=user) | Q(manager=user)
-                )
-            else:
-                queryset = Lead.objects.none()
-        return queryset
+        return Lead.objects.visible_to(self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super(LeadListView, self).get_context_data(**kwargs)
         lead_fields = []
-        case_field_names = []
         datetime_fields_info = []
-        # leads_data = []
-        # Get the first lead from the queryset to extract field names
-        lead = self.get_queryset().first()
-        if lead:
-            lead_fields = [field.name for field in lead._meta.get_fields()]
-            if "extrafields" in lead_fields:
-                lead_fields.remove("extrafields")
-            if "followups" in lead_fields:
-                lead_fields.remove('followups')
-            if "id" in lead_fields:
-                lead_fields.remove('id')
-            if "organisation" in lead_fields:
-                lead_fields.remove('organisation')
-            if "phone_number" in lead_fields:
-                lead_fields.remove("phone_number")
-
-            case_fields = CaseField.objects.filter(user=lead.organisation)
-            case_field_names = [field.name for field in case_fields]
-
-            combined_fields = lead_fields + case_field_names
-
-            # Check field types and save index and type if it's DateTimeField or DateField
-            # +1 due to the Order-ID changing the column sorting
-            for i, field_name in enumerate(combined_fields):
-                try:
-                    if field_name in lead_fields:
-                        # Check lead fields
-                        field = lead._meta.get_field(field_name)
-                        if isinstance(field, models.DateTimeField):
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                        elif isinstance(field, models.DateField):
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                    else:
-                        # Handle case fields if needed
-                        # Assuming you might have some way to access field type
-                        case_field = CaseField.objects.get(user=lead.organisation, name=field_name)
-                        if case_field.field_type == 'date':
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                        elif case_field.field_type == 'datetime':
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                except FieldDoesNotExist:
-                    pass
-
-        #     for lead in self.get_queryset():
-        #         lead_data = {field: getattr(lead, field) for field in lead_fields}
-        #         for case_field in case_fields:
-        #             try:
-        #                 case_value = CaseValue.objects.get(lead=lead, field=case_field)
-        #                 if case_field.field_type == 'text':
-        #                     lead_data[case_field.name] = case_value.value_text
-        #                 elif case_field.field_type == 'number':
-        #                     lead_data[case_field.name] = case_value.value_number
-        #                 elif case_field.field_type == 'date':
-        #                     lead_data[case_field.name] = case_value.value_date
-        #             except CaseValue.DoesNotExist:
-        #                 lead_data[case_field.name] = None
-        #         lead_data['pk'] = lead.id
-        #         leads_data.append(lead_data)
-        # print(lead_fields)
-        # print(leads_data)
+        # Custom columns belong to the organisation of the listed leads
+        organisation_id = self.object_list.values_list('organisation', flat=True).first()
+        if organisation_id:
+            lead_fields, datetime_fields_info = get_table_columns(organisation_id)
+
         context.update({
-            # "basic_fields": lead_fields,
-            "lead_fields": ['Order-ID'] + lead_fields + case_field_names,
-            "datetime_fields_info": json.dumps(datetime_fields_info) 
-            # "lead_list": leads_data
+            "lead_fields": lead_fields,
+            "lead_fields_json": json.dumps(lead_fields),
+            "datetime_fields_info": json.dumps(datetime_fields_info),
+            "status_choices": Lead.STATUS_CHOICES,
+            "assignable_users": get_assignable_users(self.request.user),
         })
 
         return context
 
+class LeadListDataView(LeadTableJsonMixin, LeadListView):
+    """Server-side rows for the lead list table."""
+
+class LeadExportView(LeadListView):
+    """Downloads the visible leads, with their custom columns, as CSV or XLSX."""
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        status = request.GET.get('status')
+        if status in dict(Lead.STATUS_CHOICES):
+            queryset = queryset.filter(status=status)
+
+        case_field_names = []
+        organisation_id = queryset.values_list('organisation', flat=True).first()
+        if organisation_id:
+            case_field_names = [field['name'] for field in get_column_schema(organisation_id)['case_fields']]
+
+        if request.GET.get('format') == 'xlsx':
+            return xlsx_export_response(queryset, case_field_names)
+        return csv_export_response(queryset, case_field_names)
+
+class LeadOrderLookupView(LeadListView):
+    """Opens the visible lead with the given Order-ID."""
+
+    def get(self, request, *args, **kwargs):
+        order_id = request.GET.get('order_id', '').strip().upper()
+        lead = self.get_queryset().filter(order_id=order_id).first() if order_id else None
+        if lead is None:
+            messages.error(request, f"No lead found with Order-ID {order_id}")
+            return redirect("leads:lead-list")
+        return redirect("leads:lead-detail", pk=lead.pk)
+
+class LeadBulkActionView(LeadListView):
+    """
+    Changes the status of, reassigns or deletes the selected visible leads with
+    a single UPDATE or DELETE. Reassignment is for lvl3 and lvl4 users and
+    deletion is not for lvl1 users, as in the single lead views.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        user = request.user
+        form = LeadBulkActionForm(request.POST, user=user)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+
+        action = form.cleaned_data['action']
+        leads = self.get_queryset().filter(pk__in=form.cleaned_data['ids'])
+        if action == 'delete':
+            if user.is_lvl1:
+                return JsonResponse({'errors': {'action': ["You cannot delete leads"]}}, status=403)
+            deleted = leads.delete()[1].get(Lead._meta.label, 0)
+            return JsonResponse({'action': action, 'count': deleted})
+
+        if action == 'status':
+            count = leads.update(status=form.cleaned_data['status'] or None)
+        else:
+            if not (user.is_lvl3 or user.is_lvl4):
+                return JsonResponse({'errors': {'action': ["You cannot reassign leads"]}}, status=403)
+            assignee = form.cleaned_data['user']
+            if assignee is not None:
+                # Leads are only handed to users of their own organisation
+                leads = leads.filter(organisation=get_scope(assignee).organisation_id)
+            count = leads.update(**{action: assignee})
+        return JsonResponse({'action': action, 'count': count})
+
 class LeadDetailView(LoginRequiredMixin, generic.DetailView):
     template_name = "leads/lead_detail.html"
     context_object_name = "lead"
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_lvl4:
-            queryset = Lead.objects.all()
-        elif user.is_lvl3:
-            queryset = Lead.objects.filter(
-                organisation=user.userprofile, 
-                #agent__isnull=False
-            )
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = Lead.objects.filter(
-                organisation=up, 
-                #agent__isnull=False
-            )
-        elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = Lead.objects.filter(
-                organisation=up, 
-                #agent__isnull=False
-            )
-            queryset = queryset.filter(agent=user)
-        return queryset
+        return Lead.objects.visible_to(self.request.user)
 
 class LeadCreateView(NotSuperuserAndLoginRequiredMixin, generic.CreateView):
     template_name = "leads/lead_create.html"
@@ -202,28 +160,38 @@ class LeadCreateView(NotSuperuserAndLoginRequiredMixin, generic.CreateView):
 
     def form_valid(self, form):
         lead = form.save(commit=False)
-        up = None
         user = self.request.user
-        if user.is_lvl3:
-            up = user.userprofile
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
+        if user.is_lvl2:
             lead.manager = user
         elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
             lead.agent = user
-        lead.organisation = up
-        lead.save()
+        lead.organisation = self.request.scope.organisation
         # send_mail(
         #     subject="A lead has been created",
         #     message="Go to the site to see the new lead",
         #     from_email="test@test.com",
         #     recipient_list=["test2@test.com"]
         # )
+        response = super(LeadCreateView, self).form_valid(form)
         messages.success(self.request, "You have successfully created a lead")
-        return super(LeadCreateView, self).form_valid(form)
+        return response
+
+class LeadImportView(NotSuperuserAndLoginRequiredMixin, generic.FormView):
+    template_name = "leads/lead_import.html"
+    form_class = LeadImportForm
+
+    def form_valid(self, form):
+        up = self.request.scope.organisation
+        importer = LeadImporter(self.request.user, up, CaseField.objects.filter(user=up))
+        try:
+            importer.run(read_rows(form.cleaned_data['file']))
+        except UnreadableFileError as error:
+            # The batches before the error stay imported
+            form.add_error('file', f"{error} {importer.created} leads were imported before the error.")
+            return self.form_invalid(form)
+        if importer.created:
+            messages.success(self.request, f"You have successfully imported {importer.created} leads")
+        return self.render_to_response(self.get_context_data(form=form, importer=importer))
 
 class LeadUpdateView(LoginRequiredMixin, generic.UpdateView):
     template_name = "leads/lead_update.html"
@@ -236,27 +204,12 @@ class LeadUpdateView(LoginRequiredMixin, generic.UpdateView):
         return kwargs
 
     def get_queryset(self):
-        user = self.request.user
-        up = None
-        if user.is_lvl3:
-            up = user.userprofile
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-        elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-
-        if user.is_lvl3 or user.is_lvl2 or user.is_lvl1:
-            return Lead.objects.filter(organisation=up)
-        else:
-            return Lead.objects.all()
+        return Lead.objects.visible_to(self.request.user)
 
     def get_success_url(self):
         return reverse("leads:lead-list")
 
     def form_valid(self, form):
-        form.save()
         messages.info(self.request, "You have successfully updated this lead")
         return super(LeadUpdateView, self).form_valid(form)
 
@@ -267,18 +220,7 @@ class LeadDeleteView(NoLvl1AndLoginRequiredMixin, generic.DeleteView):
         return reverse("leads:lead-list")
 
     def get_queryset(self):
-        user = self.request.user
-        up = None
-        if user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-        elif user.is_lvl3:
-            up = user.userprofile
-        elif user.is_lvl4:
-            return Lead.objects.all()
-
-        # initial queryset of leads for the entire organisation
-        return Lead.objects.filter(organisation=up)
+        return Lead.objects.visible_to(self.request.user)
 
 class FollowUpCreateView(LoginRequiredMixin, generic.CreateView):
     template_name = "leads/followup_create.html"
@@ -287,15 +229,18 @@ class FollowUpCreateView(LoginRequiredMixin, generic.CreateView):
     def get_success_url(self):
         return reverse("leads:lead-detail", kwargs={"pk": self.kwargs["pk"]})
 
+    def get_lead(self):
+        return get_object_or_404(Lead.objects.visible_to(self.request.user), pk=self.kwargs["pk"])
+
     def get_context_data(self, **kwargs):
         context = super(FollowUpCreateView, self).get_context_data(**kwargs)
         context.update({
-            "lead": Lead.objects.get(pk=self.kwargs["pk"])
+            "lead": self.get_lead()
         })
         return context
 
     def form_valid(self, form):
-        lead = Lead.objects.get(pk=self.kwargs["pk"])
+        lead = self.get_lead()
         files = self.request.FILES.getlist('file')
         form.instance.lead = lead
         if files:
@@ -314,21 +259,7 @@ class FollowUpUpdateView(LoginRequiredMixin, generic.UpdateView):
     form_class = FollowUpUpdateModelForm
 
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_lvl4:
-            queryset = FollowUp.objects.all()
-        elif user.is_lvl3:
-            queryset = FollowUp.objects.filter(lead__organisation=user.userprofile)
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = FollowUp.objects.filter(lead__organisation=up)
-        elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = FollowUp.objects.filter(lead__organisation=up)
-        return queryset
+        return FollowUp.objects.visible_to(self.request.user)
 
     def get_success_url(self):
         return reverse("leads:lead-detail", kwargs={"pk": self.get_object().lead.id})
@@ -341,21 +272,7 @@ class FollowUpDeleteView(LoginRequiredMixin, generic.DeleteView):
         return reverse("leads:lead-detail", kwargs={"pk": followup.lead.pk})
 
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_lvl4:
-            queryset = FollowUp.objects.all()
-        elif user.is_lvl3:
-            queryset = FollowUp.objects.filter(lead__organisation=user.userprofile)
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = FollowUp.objects.filter(lead__organisation=up)
-        elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = FollowUp.objects.filter(lead__organisation=up)
-        return queryset
+        return FollowUp.objects.visible_to(self.request.user)
     
     # def form_valid(self, form):
     #     followup = self.get_object()
@@ -375,9 +292,7 @@ class CaseFieldListView(SupervisorAndLoginRequiredMixin, generic.ListView):
     context_object_name = 'casefields'
 
     def get_queryset(self):
-        user = self.request.user
-        userprofile = user.userprofile
-        return CaseField.objects.filter(user=userprofile)
+        return CaseField.objects.filter(user=self.request.scope.organisation_id)
     
 class CreateFieldDeleteView(SupervisorAndLoginRequiredMixin, generic.DeleteView):
     template_name = "leads/casefield_delete.html"
@@ -385,21 +300,23 @@ class CreateFieldDeleteView(SupervisorAndLoginRequiredMixin, generic.DeleteView)
     def get_success_url(self):
         return reverse('leads:casefield-list')
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        invalidate_column_schema(self.object.user_id)
+        return response
+
     def get_queryset(self):
-        user = self.request.user
-        up = None
-        if user.is_lvl3:
-            up = user.userprofile
-        return CaseField.objects.filter(user=up)
+        return CaseField.objects.filter(user=self.request.scope.organisation_id)
 
 class CreateFieldView(SupervisorAndLoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         field_type = request.POST.get('fieldType')
         field_name = request.POST.get('fieldName')
-        user = self.request.user.userprofile
+        user = self.request.scope.organisation
         
         try:
             CaseField.objects.create(user=user, name=field_name, field_type=field_type)
+            invalidate_column_schema(user.pk)
         except IntegrityError:
             pass  # Ignore the error and proceed with the redirect
 
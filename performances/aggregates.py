@@ -0,0 +1,231 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, Count, ExpressionWrapper, F, Func, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from leads.models import Lead, TeamMember
+from .models import DailyPerformance
+from .timeranges import start_of_day
+
+CANCELLED = '取消'
+COMPLETED = '已完成'
+# Each role earns its own rate of the lead quote, stored on the lead in hundredths
+ROLE_AMOUNTS = (
+    ('agent', 'commission_cents'),
+    ('manager', 'co_commission_cents'),
+)
+ROLLUP_BATCH_SIZE = 1000
+
+
+def empty_stats():
+    return {
+        'num_leads': 0,
+        'total_commission': 0,
+        'num_completed_leads': 0,
+        'completed_lead_commission': 0,
+    }
+
+def commission_amount(amount_field, truncate):
+    amount = F(amount_field)
+    if truncate:
+        # Whole units per lead, as the ranking has always shown them
+        amount = amount / 100
+    return ExpressionWrapper(amount, output_field=BigIntegerField())
+
+def lead_rollup_rows(leads, users=None, by_day=False):
+    """
+    Groups leads into rollup rows, one per organisation, user, role and status
+    (and creation day with ``by_day``), with one grouped query per role.
+
+    A lead whose agent is also its manager is counted in the agent row only,
+    so that summing a user's rows counts each of their leads once.
+    """
+    leads = leads.order_by()
+    group_by = ['organisation', 'status']
+    if by_day:
+        leads = leads.annotate(day=TruncDate('date_added'))
+        group_by.append('day')
+
+    rows = []
+    for role, amount_field in ROLE_AMOUNTS:
+        role_leads = leads.filter(**{f'{role}__isnull': False})
+        if users is not None:
+            role_leads = role_leads.filter(**{f'{role}__in': users})
+        if role == 'agent':
+            num_leads = Count('pk')
+        else:
+            num_leads = Count('pk', filter=Q(agent__isnull=True) | ~Q(agent=F('manager')))
+        for row in role_leads.values(role, *group_by).annotate(
+            num_leads=num_leads,
+            # Named apart from the Lead fields they are summed from
+            amount=Sum(commission_amount(amount_field, truncate=True)),
+            amount_cents=Sum(commission_amount(amount_field, truncate=False)),
+        ):
+            row['user'] = row.pop(role)
+            row['commission'] = row.pop('amount')
+            row['commission_cents'] = row.pop('amount_cents')
+            row['role'] = role
+            row['status'] = row['status'] or ''
+            rows.append(row)
+    return rows
+
+def summarise(rows, truncate=True, count_cancelled=False):
+    """
+    Adds rollup rows up into {user_id: stats}. Cancelled leads earn nothing and
+    are only counted with ``count_cancelled``. ``truncate`` sums each lead's
+    commission rounded down to whole units instead of the exact amounts.
+    """
+    stats = defaultdict(empty_stats)
+    for row in rows:
+        user_stats = stats[row['user']]
+        if row['status'] == CANCELLED:
+            if count_cancelled:
+                user_stats['num_leads'] += row['num_leads']
+            continue
+        commission = row['commission'] if truncate else row['commission_cents']
+        user_stats['num_leads'] += row['num_leads']
+        user_stats['total_commission'] += commission
+        if row['status'] == COMPLETED:
+            user_stats['num_completed_leads'] += row['num_leads']
+            user_stats['completed_lead_commission'] += commission
+    if not truncate:
+        # Exact amounts are added up in hundredths and divided once
+        for user_stats in stats.values():
+            user_stats['total_commission'] /= 100
+            user_stats['completed_lead_commission'] /= 100
+    return dict(stats)
+
+def aggregate_performance(leads, users=None, truncate=True, count_cancelled=False):
+    """Returns {user_id: stats} for the agent and manager roles of the given leads."""
+    return summarise(lead_rollup_rows(leads, users), truncate, count_cancelled)
+
+def performance_rows(time_range, organisation=None, users=None):
+    """
+    Returns the rollup rows of the leads created in the time range, optionally
+    limited to one organisation's leads and to some users.
+
+    Whole days are read from the DailyPerformance rollups, grouped by user and
+    status, and only the partial days at the edges of the range from the leads.
+    """
+    days, edges = time_range.split()
+    rows = []
+    if days is not None:
+        rollups = DailyPerformance.objects.all()
+        if organisation is not None:
+            rollups = rollups.filter(organisation=organisation)
+        if users is not None:
+            rollups = rollups.filter(user__in=users)
+        first, end = days
+        if first is not None:
+            rollups = rollups.filter(day__gte=first)
+        if end is not None:
+            rollups = rollups.filter(day__lt=end)
+        rows += rollups.values('user', 'status').annotate(
+            num_leads=Sum('num_leads'),
+            commission=Sum('commission'),
+            commission_cents=Sum('commission_cents'),
+        ).order_by()
+
+    for edge in edges:
+        leads = Lead.objects.all()
+        if organisation is not None:
+            leads = leads.filter(organisation=organisation)
+        rows += lead_rollup_rows(edge.filter(leads), users)
+    return rows
+
+def get_performance_stats(time_range, organisation=None, users=None, truncate=True, count_cancelled=False):
+    """Returns {user_id: stats} for the leads created in the time range, see performance_rows."""
+    return summarise(performance_rows(time_range, organisation, users), truncate, count_cancelled)
+
+def team_role_filter(role):
+    # Inside a lead subquery of a team: the role is held by the team leader or a member
+    members = TeamMember.objects.filter(team=OuterRef(OuterRef('pk'))).values('member')
+    return Q(**{role: OuterRef('team_leader')}) | Q(**{f'{role}__in': members})
+
+def subquery_total(leads, expression):
+    # An aggregate over the whole subquery, without a GROUP BY
+    total = leads.order_by().annotate(total=Func(expression, function='SUM')).values('total')
+    return Coalesce(Subquery(total, output_field=BigIntegerField()), Value(0))
+
+def annotate_team_performance(teams, time_range):
+    """
+    Annotates each team with the leads its leader or members hold as agent or
+    manager, in one query: num_members (leader included), num_leads,
+    num_completed_leads and commission_cents, the exact commission the team
+    earned on completed leads in hundredths of a unit.
+
+    A lead counts once per team. Its agent commission is earned when the agent
+    is in the team, its manager commission when the manager is.
+    """
+    in_agent, in_manager = team_role_filter('agent'), team_role_filter('manager')
+    team_leads = time_range.filter(Lead.objects.filter(in_agent | in_manager))
+    completed_leads = team_leads.filter(status=COMPLETED)
+    one = Value(1, output_field=BigIntegerField())
+    commission_cents = (
+        Case(When(in_agent, then=F('commission_cents')), default=0) +
+        Case(When(in_manager, then=F('co_commission_cents')), default=0)
+    )
+    members = TeamMember.objects.filter(team=OuterRef('pk')).order_by().annotate(
+        total=Func(F('pk'), function='COUNT')
+    ).values('total')
+    return teams.select_related('team_leader').annotate(
+        num_members=Subquery(members, output_field=BigIntegerField()) + 1,
+        num_leads=subquery_total(team_leads, one),
+        num_completed_leads=subquery_total(completed_leads, one),
+        commission_cents=subquery_total(completed_leads, commission_cents),
+    )
+
+def build_daily_performance(leads):
+    rollups = []
+    for row in lead_rollup_rows(leads, by_day=True):
+        row['organisation_id'] = row.pop('organisation')
+        row['user_id'] = row.pop('user')
+        rollups.append(DailyPerformance(**row))
+    return rollups
+
+def lock_days(days):
+    """
+    Holds a lock on each (organisation_id, date) pair until the transaction
+    ends, so concurrent recounts of a day run one after the other and each
+    sees the leads the previous one counted. SQLite serialises writes anyway.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        # In a fixed order, so two writers cannot wait on each other
+        for organisation_id, day in sorted(days):
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [organisation_id, day.toordinal()])
+
+def refresh_daily_performance(days):
+    """Recounts the rollup rows of the given (organisation_id, date) pairs from their leads."""
+    days_by_organisation = defaultdict(set)
+    for organisation_id, day in days:
+        days_by_organisation[organisation_id].add(day)
+
+    with transaction.atomic():
+        lock_days(set(days))
+        for organisation_id, organisation_days in days_by_organisation.items():
+            DailyPerformance.objects.filter(organisation=organisation_id, day__in=organisation_days).delete()
+            # The date_added range lets the (organisation, date_added) index narrow the scan
+            leads = Lead.objects.filter(
+                organisation=organisation_id,
+                date_added__gte=start_of_day(min(organisation_days)),
+                date_added__lt=start_of_day(max(organisation_days)) + timedelta(days=1),
+            )
+            rollups = [rollup for rollup in build_daily_performance(leads) if rollup.day in organisation_days]
+            # A rebuild of the organisation running alongside takes no day locks
+            DailyPerformance.objects.bulk_create(
+                rollups,
+                batch_size=ROLLUP_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['organisation', 'user', 'role', 'day', 'status'],
+                update_fields=['num_leads', 'commission', 'commission_cents'],
+            )
+
+def rebuild_daily_performance(organisation_ids):
+    """Recounts every rollup row of the given organisations."""
+    for organisation_id in organisation_ids:
+        with transaction.atomic():
+            DailyPerformance.objects.filter(organisation=organisation_id).delete()
+            rollups = build_daily_performance(Lead.objects.filter(organisation=organisation_id))
+            DailyPerformance.objects.bulk_create(rollups, batch_size=ROLLUP_BATCH_SIZE)
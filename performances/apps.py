@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PerformancesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'performances'
+
+    def ready(self):
+        from . import receivers  # noqa: F401
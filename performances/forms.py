@@ -4,4 +4,57 @@ from django.db.models import Q
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm, UsernameField
-from leads.models import Lead, FollowUp, CaseField, CaseValue, handle_upload_follow_ups, UserRelation, User
\ No newline at end of file
+from leads.models import Lead, FollowUp, CaseField, CaseValue, handle_upload_follow_ups, UserRelation, User
+
+
+class CommissionSimulationForm(forms.Form):
+    """
+    The what-if scenarios of a commission simulation, as a JSON list of
+    {"name": ..., "changes": [{"target": "all"|"user"|"team", "id": ...,
+    "role": "agent"|"manager", "rate": ...}]}.
+    """
+    TARGETS = ('all', 'user', 'team')
+    ROLES = ('agent', 'manager')
+    MAX_SCENARIOS = 50
+    MAX_CHANGES = 200
+
+    scenarios = forms.JSONField()
+
+    def __init__(self, *args, **kwargs):
+        # The ids that changes may target
+        self.user_ids = kwargs.pop('user_ids')
+        self.team_ids = kwargs.pop('team_ids')
+        super().__init__(*args, **kwargs)
+
+    def clean_change(self, change):
+        if not isinstance(change, dict):
+            raise ValidationError("Each change must be an object")
+        target, role, rate = change.get('target'), change.get('role'), change.get('rate')
+        if target not in self.TARGETS or role not in self.ROLES:
+            raise ValidationError(f"Changes need a target in {self.TARGETS} and a role in {self.ROLES}")
+        if isinstance(rate, bool) or not isinstance(rate, int) or not 0 <= rate <= 100:
+            raise ValidationError("Rates must be whole numbers from 0 to 100")
+        target_id = change.get('id')
+        if target != 'all':
+            if isinstance(target_id, bool) or not isinstance(target_id, int):
+                raise ValidationError(f"The {target} id must be a whole number")
+            if target_id not in (self.user_ids if target == 'user' else self.team_ids):
+                raise ValidationError(f"Unknown {target} {target_id}")
+        return {'target': target, 'id': target_id, 'role': role, 'rate': rate}
+
+    def clean_scenarios(self):
+        scenarios = self.cleaned_data['scenarios']
+        if not isinstance(scenarios, list) or not scenarios:
+            raise ValidationError("Send a list of scenarios")
+        if len(scenarios) > self.MAX_SCENARIOS:
+            raise ValidationError(f"Send at most {self.MAX_SCENARIOS} scenarios at once")
+        cleaned = []
+        for index, scenario in enumerate(scenarios, start=1):
+            changes = scenario.get('changes') if isinstance(scenario, dict) else None
+            if not isinstance(changes, list) or len(changes) > self.MAX_CHANGES:
+                raise ValidationError(f"Scenario {index} needs a list of at most {self.MAX_CHANGES} changes")
+            cleaned.append({
+                'name': str(scenario.get('name') or f"Scenario {index}"),
+                'changes': [self.clean_change(change) for change in changes],
+            })
+        return cleaned
@@ -0,0 +1,34 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from performances.reports import build_report
+from performances.timeranges import TimeRange, start_of_day, start_of_month
+
+
+class Command(BaseCommand):
+    help = "Ranks every user over all organisations for a time range and saves it as a performance report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="YYYY-MM, the last month by default")
+        parser.add_argument('--start', type=date.fromisoformat, help="First day, YYYY-MM-DD")
+        parser.add_argument('--end', type=date.fromisoformat, help="Day after the last one, YYYY-MM-DD")
+        parser.add_argument('--processes', type=int, help="Worker processes, one per CPU by default")
+
+    def get_time_range(self, options):
+        if options['start'] or options['end']:
+            return TimeRange(*(start_of_day(day) if day else None for day in (options['start'], options['end'])))
+        if options['month']:
+            try:
+                year, month = map(int, options['month'].split('-'))
+            except ValueError:
+                raise CommandError("--month must look like 2024-03")
+            return TimeRange(start_of_month(year, month), start_of_month(year, month + 1))
+        today = timezone.localdate()
+        return TimeRange(start_of_month(today.year, today.month - 1), start_of_month(today.year, today.month))
+
+    def handle(self, *args, **options):
+        report = build_report(self.get_time_range(options), processes=options['processes'])
+        self.stdout.write(
+            f"Report {report.pk}: {len(report.stats)} users in {report.num_organisations} organisations, "
+            f"{(report.date_created - report.date_started).total_seconds():.1f}s"
+        )
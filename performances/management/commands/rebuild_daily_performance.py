@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from leads.models import UserProfile
+from performances.aggregates import rebuild_daily_performance
+
+
+class Command(BaseCommand):
+    help = "Recounts the daily performance rollups from the leads, one organisation at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', type=int, action='append', help="UserProfile id, can be repeated")
+
+    def handle(self, *args, **options):
+        organisation_ids = options['organisation'] or UserProfile.objects.order_by('pk').values_list('pk', flat=True)
+        for organisation_id in organisation_ids:
+            rebuild_daily_performance([organisation_id])
+            self.stdout.write(f"Rebuilt organisation {organisation_id}")
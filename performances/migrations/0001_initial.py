@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('leads', '0026_lead_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPerformance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('agent', 'agent'), ('manager', 'manager')], max_length=10)),
+                ('day', models.DateField()),
+                ('status', models.CharField(blank=True, default='', max_length=20)),
+                ('num_leads', models.IntegerField(default=0)),
+                ('commission', models.BigIntegerField(default=0)),
+                ('commission_cents', models.BigIntegerField(default=0)),
+                ('organisation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organisation', 'day'], name='daily_perf_org_day_idx'), models.Index(fields=['user', 'day'], name='daily_perf_user_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyperformance',
+            constraint=models.UniqueConstraint(fields=('organisation', 'user', 'role', 'day', 'status'), name='unique_daily_performance'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Cast, TruncDate
+
+ROLLUP_BATCH_SIZE = 1000
+# Each role earns its own rate of the lead quote
+ROLE_RATES = (
+    ('agent', 'commission'),
+    ('manager', 'co_commission'),
+)
+
+
+def backfill_daily_performance(apps, schema_editor):
+    # Counted against the historical models, so later changes to performances.aggregates leave it be
+    Lead = apps.get_model('leads', 'Lead')
+    UserProfile = apps.get_model('leads', 'UserProfile')
+    DailyPerformance = apps.get_model('performances', 'DailyPerformance')
+    for organisation_id in UserProfile.objects.values_list('pk', flat=True):
+        leads = Lead.objects.filter(organisation=organisation_id).order_by().annotate(day=TruncDate('date_added'))
+        rollups = []
+        for role, rate_field in ROLE_RATES:
+            amount = Cast('quote', BigIntegerField()) * F(rate_field)
+            if role == 'agent':
+                num_leads = Count('pk')
+            else:
+                # A lead whose agent is also its manager is counted in the agent row only
+                num_leads = Count('pk', filter=Q(agent__isnull=True) | ~Q(agent=F('manager')))
+            for row in leads.filter(**{f'{role}__isnull': False}).values(role, 'status', 'day').annotate(
+                num_leads=num_leads,
+                amount=Sum(ExpressionWrapper(amount / 100, output_field=BigIntegerField())),
+                amount_cents=Sum(ExpressionWrapper(amount, output_field=BigIntegerField())),
+            ):
+                rollups.append(DailyPerformance(
+                    organisation_id=organisation_id, user_id=row[role], role=role, day=row['day'],
+                    status=row['status'] or '', num_leads=row['num_leads'],
+                    commission=row['amount'], commission_cents=row['amount_cents'],
+                ))
+        DailyPerformance.objects.bulk_create(rollups, batch_size=ROLLUP_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('performances', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_performance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+ROLLUP_BATCH_SIZE = 1000
+# Each role's commission, stored on the lead in hundredths
+ROLE_AMOUNTS = (
+    ('agent', 'commission_cents'),
+    ('manager', 'co_commission_cents'),
+)
+
+
+def rebuild_daily_performance(apps, schema_editor):
+    # Counted against the historical models, so later changes to performances.aggregates leave it be
+    Lead = apps.get_model('leads', 'Lead')
+    UserProfile = apps.get_model('leads', 'UserProfile')
+    DailyPerformance = apps.get_model('performances', 'DailyPerformance')
+    DailyPerformance.objects.all().delete()
+    for organisation_id in UserProfile.objects.values_list('pk', flat=True):
+        leads = Lead.objects.filter(organisation=organisation_id).order_by().annotate(day=TruncDate('date_added'))
+        rollups = []
+        for role, amount_field in ROLE_AMOUNTS:
+            if role == 'agent':
+                num_leads = Count('pk')
+            else:
+                # A lead whose agent is also its manager is counted in the agent row only
+                num_leads = Count('pk', filter=Q(agent__isnull=True) | ~Q(agent=F('manager')))
+            for row in leads.filter(**{f'{role}__isnull': False}).values(role, 'status', 'day').annotate(
+                num_leads=num_leads,
+                amount=Sum(ExpressionWrapper(F(amount_field) / 100, output_field=BigIntegerField())),
+                amount_cents=Sum(amount_field),
+            ):
+                rollups.append(DailyPerformance(
+                    organisation_id=organisation_id, user_id=row[role], role=role, day=row['day'],
+                    status=row['status'] or '', num_leads=row['num_leads'],
+                    commission=row['amount'], commission_cents=row['amount_cents'],
+                ))
+        DailyPerformance.objects.bulk_create(rollups, batch_size=ROLLUP_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('performances', '0002_backfill_daily_performance'),
+        ('leads', '0028_lead_commission_amounts'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_daily_performance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('performances', '0003_rebuild_daily_performance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerformanceReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(blank=True, null=True)),
+                ('end', models.DateTimeField(blank=True, null=True)),
+                ('stats', models.JSONField(default=dict)),
+                ('num_organisations', models.IntegerField(default=0)),
+                ('date_started', models.DateTimeField()),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start', 'end', 'date_started'], name='perf_report_range_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,70 @@
 from django.db import models
+from leads.models import User, UserProfile
 
-# Create your models here.
+
+class DailyPerformance(models.Model):
+    """
+    Leads of one user in one role, created on one day with one status.
+
+    Rows are kept up to date from the leads_changed signal and can be rebuilt
+    with the rebuild_daily_performance command. A lead whose agent is also its
+    manager is counted in the agent row only, but earns both commissions.
+    """
+    ROLE_CHOICES = [
+        ('agent', 'agent'),
+        ('manager', 'manager'),
+    ]
+
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    day = models.DateField()
+    # Empty for leads without a status
+    status = models.CharField(max_length=20, blank=True, default='')
+    num_leads = models.IntegerField(default=0)
+    # Sum of each lead's commission rounded down to whole units
+    commission = models.BigIntegerField(default=0)
+    # Exact sum of quote * rate, in hundredths of a unit
+    commission_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['organisation', 'user', 'role', 'day', 'status'], name='unique_daily_performance')
+        ]
+        indexes = [
+            models.Index(fields=['organisation', 'day'], name='daily_perf_org_day_idx'),
+            models.Index(fields=['user', 'day'], name='daily_perf_user_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.role} {self.day} {self.status}: {self.num_leads}"
+
+
+
+class PerformanceReport(models.Model):
+    """
+    The ranking of every user over all organisations for one time range, as
+    built by the build_performance_report command.
+
+    A report shows the leads as they were when it was started. The ranking
+    reads it for lvl4 users once the range has ended before that.
+    """
+    # Either side may be open, like TimeRange
+    start = models.DateTimeField(null=True, blank=True)
+    end = models.DateTimeField(null=True, blank=True)
+    # {user_id: stats}, the ids as strings
+    stats = models.JSONField(default=dict)
+    num_organisations = models.IntegerField(default=0)
+    date_started = models.DateTimeField()
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start', 'end', 'date_started'], name='perf_report_range_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.start} - {self.end} ({self.date_started})"
+
+    def get_stats(self):
+        return {int(user_id): stats for user_id, stats in self.stats.items()}
@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from leads.models import Team, TeamMember
+from leads.signals import leads_changed
+from .aggregates import refresh_daily_performance
+from .results import bump_lead_versions, invalidate_team_results
+
+
+@receiver(leads_changed)
+def recount_daily_performance(sender, days, **kwargs):
+    if days:
+        refresh_daily_performance(days)
+        organisation_ids = {organisation_id for organisation_id, day in days}
+        # A refresh started before the commit would cache the old leads under the new version
+        transaction.on_commit(lambda: bump_lead_versions(organisation_ids))
+
+
+@receiver([post_save, post_delete], sender=TeamMember)
+@receiver([post_save, post_delete], sender=Team)
+def team_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_team_results)
@@ -0,0 +1,56 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import django
+from django.db import connections
+from django.utils import timezone
+from leads.models import UserProfile
+from .aggregates import performance_rows, summarise
+from .models import PerformanceReport
+
+# Organisations handed to a worker at a time
+REPORT_CHUNK_SIZE = 4
+
+
+def organisation_rows(time_range, organisation_ids, processes=None):
+    """
+    Yields the rollup rows of each organisation, read by a pool of worker
+    processes, or in this process when processes is 1.
+    """
+    if processes == 1:
+        for organisation_id in organisation_ids:
+            yield performance_rows(time_range, organisation_id)
+        return
+
+    # Forked workers would otherwise share the connections opened here
+    connections.close_all()
+    # Spawned workers set Django up again, forked ones already have it
+    with ProcessPoolExecutor(max_workers=processes, initializer=django.setup) as pool:
+        yield from pool.map(performance_rows, repeat(time_range), organisation_ids, chunksize=REPORT_CHUNK_SIZE)
+
+def build_report(time_range, processes=None):
+    """
+    Ranks every user over all organisations, each organisation counted apart,
+    and saves the ranking as a PerformanceReport.
+    """
+    date_started = timezone.now()
+    organisation_ids = list(UserProfile.objects.order_by('pk').values_list('pk', flat=True))
+    rows = [row for part in organisation_rows(time_range, organisation_ids, processes) for row in part]
+    return PerformanceReport.objects.create(
+        start=time_range.start,
+        end=time_range.end,
+        # Rows of a user from several organisations add up
+        stats=summarise(rows),
+        num_organisations=len(organisation_ids),
+        date_started=date_started,
+    )
+
+def get_latest_report(time_range):
+    """Returns the latest report of the range started after the range ended, or None."""
+    if time_range.end is None:
+        return None
+    reports = PerformanceReport.objects.filter(end=time_range.end, date_started__gte=time_range.end)
+    if time_range.start is None:
+        reports = reports.filter(start__isnull=True)
+    else:
+        reports = reports.filter(start=time_range.start)
+    return reports.order_by('-date_started').first()
@@ -0,0 +1,68 @@
+import threading
+import time
+from django.core.cache import cache
+from django.db import connections
+from leads.scope import SCOPE_VERSION_KEY
+
+RESULT_TIMEOUT = 60 * 60 * 24
+# A refresh that has not finished by then may be started again
+REFRESH_LOCK_TIMEOUT = 5 * 60
+TEAM_VERSION_KEY = 'team_performance_version'
+
+
+def lead_version_key(organisation_id):
+    # None stands for the leads of every organisation
+    return f'lead_version:{"all" if organisation_id is None else organisation_id}'
+
+def get_lead_version(organisation_id):
+    key = lead_version_key(organisation_id)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        cache.set(key, version, None)
+    return version
+
+def bump_lead_versions(organisation_ids):
+    """Makes the cached results of the organisations, and of all organisations, stale."""
+    version = time.time_ns()
+    keys = [lead_version_key(organisation_id) for organisation_id in organisation_ids] + [lead_version_key(None)]
+    cache.set_many(dict.fromkeys(keys, version), None)
+
+def get_team_version():
+    # Team membership and the user hierarchy decide whose leads a team counts
+    return cache.get(TEAM_VERSION_KEY), cache.get(SCOPE_VERSION_KEY)
+
+def invalidate_team_results():
+    cache.set(TEAM_VERSION_KEY, time.time_ns(), None)
+
+def refresh_result(key, version, compute):
+    try:
+        cache.set(key, (version, compute()), RESULT_TIMEOUT)
+    finally:
+        cache.delete(f'{key}:refreshing')
+        # The thread's own connections are not closed by the request cycle
+        connections.close_all()
+
+def start_refresh(key, version, compute):
+    # Only the first request to find the entry stale refreshes it, the others keep serving it
+    if cache.add(f'{key}:refreshing', True, REFRESH_LOCK_TIMEOUT):
+        threading.Thread(target=refresh_result, args=(key, version, compute), daemon=True).start()
+
+def get_cached_result(key, version, compute):
+    """
+    Returns compute() cached under key, with stale-while-revalidate.
+
+    An entry stored for another version is still returned at once, while a
+    single background thread recomputes it for the current version. Only a
+    missing entry is computed in the request.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        result = compute()
+        cache.set(key, (version, result), RESULT_TIMEOUT)
+        return result
+
+    entry_version, result = entry
+    if entry_version != version:
+        start_refresh(key, version, compute)
+    return result
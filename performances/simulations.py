@@ -0,0 +1,101 @@
+import numpy as np
+from .aggregates import COMPLETED
+from .trends import as_json, user_columns
+
+# The Lead rate field each role is paid
+ROLE_RATE_FIELDS = {
+    'agent': 'commission',
+    'manager': 'co_commission',
+}
+SIMULATION_COLUMNS = ('quote', 'commission', 'co_commission', 'agent', 'manager')
+
+
+def load_simulation_leads(leads):
+    """
+    Reads the completed leads once, as {column: array}. Leads without an
+    agent or manager hold NaN there.
+    """
+    rows = list(leads.filter(status=COMPLETED).order_by().values_list(*SIMULATION_COLUMNS))
+    quote, commission, co_commission, agent, manager = zip(*rows) if rows else [()] * len(SIMULATION_COLUMNS)
+    return {
+        'quote': np.array(quote, dtype=np.int64),
+        'commission': np.array(commission, dtype=np.int64),
+        'co_commission': np.array(co_commission, dtype=np.int64),
+        'agent': np.array(agent, dtype=np.float64),
+        'manager': np.array(manager, dtype=np.float64),
+    }
+
+def scenario_rates(leads, changes, team_members):
+    """
+    Returns the (agent, manager) rates of every lead after the changes, applied
+    in order: a later change wins over an earlier one on the leads both touch.
+    """
+    rates = {role: leads[field].copy() for role, field in ROLE_RATE_FIELDS.items()}
+    for change in changes:
+        holders = leads[change['role']]
+        if change['target'] == 'all':
+            touched = slice(None)
+        elif change['target'] == 'user':
+            touched = holders == change['id']
+        else:
+            touched = np.isin(holders, team_members[change['id']])
+        rates[change['role']][touched] = change['rate']
+    return rates['agent'], rates['manager']
+
+def user_payouts(leads, columns, agent_rates, manager_rates):
+    """
+    Each user's commission on the leads, in hundredths of a unit, given the
+    user column of each lead's agent and manager.
+    """
+    agent_columns, manager_columns, num_users = columns
+    # Leads of users outside the columns land in the last, dropped, slot
+    payouts = (
+        np.bincount(agent_columns, weights=leads['quote'] * agent_rates, minlength=num_users + 1) +
+        np.bincount(manager_columns, weights=leads['quote'] * manager_rates, minlength=num_users + 1)
+    )
+    return payouts[:-1]
+
+def simulate(leads, scenarios, users, teams):
+    """
+    Pays the leads under the current rates and under every scenario, and
+    returns each scenario's change from the current payouts per user and team.
+
+    users are (id, username) pairs and teams (id, name, member ids) triples.
+    A team is paid what its members are paid, a lead once per role held in it.
+    Nothing is written back.
+    """
+    users = sorted(users)
+    user_ids = np.array([user_id for user_id, username in users], dtype=np.float64)
+    team_members = {team_id: members for team_id, name, members in teams}
+    membership = np.zeros((len(users), len(teams)))
+    for index, (team_id, name, members) in enumerate(teams):
+        membership[np.isin(user_ids, members), index] = 1
+
+    columns = (user_columns(user_ids, leads['agent']), user_columns(user_ids, leads['manager']), len(users))
+    # Row 0 is the current rates, then one row per scenario
+    payouts = np.stack([user_payouts(leads, columns, leads['commission'], leads['co_commission'])] + [
+        user_payouts(leads, columns, *scenario_rates(leads, scenario['changes'], team_members))
+        for scenario in scenarios
+    ]) / 100
+    team_payouts = payouts @ membership
+    user_deltas, team_deltas = payouts[1:] - payouts[0], team_payouts[1:] - team_payouts[0]
+
+    return {
+        'users': [{'id': user_id, 'username': username} for user_id, username in users],
+        'teams': [{'id': team_id, 'name': name} for team_id, name, members in teams],
+        'current': {
+            'total': round(float(payouts[0].sum()), 2),
+            'users': as_json(payouts[0]),
+            'teams': as_json(team_payouts[0]),
+        },
+        'scenarios': [
+            {
+                'name': scenario['name'],
+                'total': round(float(payouts[index + 1].sum()), 2),
+                'delta': round(float(user_deltas[index].sum()), 2),
+                'users': as_json(user_deltas[index]),
+                'teams': as_json(team_deltas[index]),
+            }
+            for index, scenario in enumerate(scenarios)
+        ],
+    }
@@ -1,3 +1,377 @@
-from django.test import TestCase
+import json
+import time
+from datetime import date, timedelta
+from unittest import mock
+from django.core.cache import cache, caches
+from django.shortcuts import reverse
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from leads.models import User, UserProfile, UserRelation, Lead, Team, TeamMember
+from .aggregates import aggregate_performance, get_performance_stats, rebuild_daily_performance, refresh_daily_performance
+from .models import DailyPerformance
+from .reports import build_report, get_latest_report
+from .results import bump_lead_versions, get_cached_result, get_lead_version, lead_version_key
+from .snapshot import get_snapshot, snapshot_stats, snapshots
+from .timeranges import TimeRange, start_of_day, start_of_month
+from .trends import METRICS
 
-# Create your tests here.
+# Query counts below leave out the shared database cache
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class AggregatePerformanceTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.supervisor = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.supervisor)
+        self.agent = User.objects.create_user(username="agent", password="pass", is_lvl1=True)
+        self.manager = User.objects.create_user(username="manager", password="pass", is_lvl2=True)
+        for user in (self.agent, self.manager):
+            UserRelation.objects.create(user=user, supervisor=self.supervisor)
+
+        for agent, manager, status, quote in [
+            (self.agent, self.manager, "已完成", 1000),
+            (self.agent, None, "进行中", 999),
+            (self.manager, self.manager, "已完成", 100),
+            (self.agent, self.manager, "取消", 5000),
+            (None, self.manager, None, 300),
+        ]:
+            Lead.objects.create(
+                first_name="Ann", last_name="Lee", organisation=self.organisation, description="",
+                agent=agent, manager=manager, status=status, quote=quote, commission=29, co_commission=5,
+            )
+
+    def test_counts_both_roles_once_per_lead(self):
+        with self.assertNumQueries(2):
+            stats = aggregate_performance(Lead.objects.all())
+        self.assertEqual(stats[self.agent.pk], {
+            'num_leads': 2, 'total_commission': 290 + 289,
+            'num_completed_leads': 1, 'completed_lead_commission': 290,
+        })
+        # Agent and manager of the same lead: counted once, paid both rates
+        self.assertEqual(stats[self.manager.pk], {
+            'num_leads': 3, 'total_commission': 50 + 29 + 5 + 15,
+            'num_completed_leads': 2, 'completed_lead_commission': 50 + 29 + 5,
+        })
+
+    def test_ranking_is_sorted_by_completed_commission(self):
+        self.client.force_login(self.supervisor)
+        response = self.client.get(reverse("performances:performance_ranking"))
+        rows = [performance['user_stats'] for performance in response.context['performances']]
+        self.assertEqual(rows[0], ["agent", 2, 579, 1, 290])
+        self.assertEqual(rows[1], ["manager", 3, 99, 2, 84])
+
+    def test_stored_commission_amounts_follow_quote_and_rates(self):
+        def amounts():
+            return sorted(Lead.objects.values_list('quote', 'commission_cents', 'co_commission_cents'))
+
+        self.assertEqual(amounts()[0], (100, 2900, 500))
+        lead = Lead.objects.get(quote=100)
+        lead.commission = 10
+        lead.save(update_fields=['commission'])
+        Lead.objects.filter(quote=300).update(quote=400)
+        Lead.objects.filter(quote=999).update(co_commission=7)
+        self.assertEqual(amounts()[:3], [(100, 1000, 500), (400, 11600, 2000), (999, 28971, 6993)])
+
+
+class DailyPerformanceTest(TestCase):
+
+    setUp = AggregatePerformanceTest.setUp
+
+    def assertRollupsMatchLeads(self):
+        for truncate in (True, False):
+            self.assertEqual(
+                get_performance_stats(TimeRange(), truncate=truncate),
+                aggregate_performance(Lead.objects.all(), truncate=truncate),
+            )
+
+    def test_rollups_follow_lead_changes(self):
+        self.assertRollupsMatchLeads()
+
+        lead = Lead.objects.filter(status="进行中").get()
+        lead.status = "已完成"
+        lead.manager = self.manager
+        lead.save()
+        self.assertRollupsMatchLeads()
+
+        Lead.objects.filter(status="取消").update(status="已完成", quote=77)
+        self.assertRollupsMatchLeads()
+        Lead.objects.filter(manager=self.manager).update(date_added=start_of_day(date(2024, 2, 10)))
+        self.assertRollupsMatchLeads()
+
+        Lead.objects.filter(agent__isnull=True).delete()
+        Lead.objects.first().delete()
+        self.assertRollupsMatchLeads()
+
+        DailyPerformance.objects.all().delete()
+        rebuild_daily_performance([self.organisation.pk])
+        self.assertRollupsMatchLeads()
+
+    def test_a_day_is_recounted_twice_in_one_transaction(self):
+        day = timezone.localdate()
+        with transaction.atomic():
+            refresh_daily_performance([(self.organisation.pk, day)])
+            Lead.objects.filter(status="进行中").update(status="已完成")
+            refresh_daily_performance([(self.organisation.pk, day), (self.organisation.pk, day)])
+        self.assertRollupsMatchLeads()
+
+    def test_partial_days_are_read_from_leads(self):
+        day = date(2024, 3, 31)
+        Lead.objects.filter(status="已完成").update(date_added=start_of_day(day) + timedelta(hours=20))
+        Lead.objects.exclude(status="已完成").update(date_added=start_of_day(day) + timedelta(hours=8))
+
+        march = TimeRange(start_of_month(2024, 3), start_of_month(2024, 4))
+        self.assertEqual(march.split(), ((date(2024, 3, 1), date(2024, 4, 1)), []))
+        self.assertEqual(
+            get_performance_stats(march),
+            aggregate_performance(Lead.objects.all()),
+        )
+
+        evening = TimeRange(start_of_day(date(2024, 3, 30)), start_of_day(day) + timedelta(hours=12))
+        self.assertEqual(len(evening.split()[1]), 1)
+        self.assertEqual(
+            get_performance_stats(evening),
+            aggregate_performance(evening.filter(Lead.objects.all())),
+        )
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class TeamsPerformanceTest(TestCase):
+
+    setUp = AggregatePerformanceTest.setUp
+
+    def test_teams_are_counted_in_one_query(self):
+        Team.objects.create(name="agents", team_leader=self.agent)
+        managers_team = Team.objects.create(name="managers", team_leader=self.manager)
+        TeamMember.objects.create(team=managers_team, member=self.agent)
+
+        self.client.force_login(self.supervisor)
+        # Resolves the scope and caches the result of another range
+        self.client.get(reverse("performances:team_performances"), {'time_range': 'years', 'year': 2000})
+        # The session and the user, then every team at once
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("performances:team_performances"))
+        rows = {row['team_stats'][0]: row['team_stats'][1:] for row in response.context['teams_performances']}
+        # Cancelled leads are counted, completed leads earn the rates of the roles held in the team
+        self.assertEqual(rows["agents"], ["agent", 1, 3, 1, 290])
+        self.assertEqual(rows["managers"], ["manager", 2, 5, 2, 290 + 50 + 29 + 5])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class UserPerformanceTest(TestCase):
+
+    setUp = AggregatePerformanceTest.setUp
+
+    def test_page_and_lead_rows_in_constant_queries(self):
+        self.client.force_login(self.supervisor)
+        page_url = reverse("performances:user_performance_list", args=[self.agent.pk])
+        leads_url = reverse("performances:user_performance_leads", args=[self.agent.pk])
+        params = {'columns[0][name]': 'first_name', 'columns[1][name]': 'agent', 'columns[2][name]': 'manager', 'length': 2}
+        # Resolves the scopes and reads the snapshot
+        self.client.get(page_url)
+        # The session and the user, then the listed user; the summary and the columns are cached
+        with self.assertNumQueries(3):
+            response = self.client.get(page_url)
+        self.assertEqual(response.context['performance_summary']['num_leads'], 3)
+
+        # The session and the user, then the listed user, the count, one page with its users and its case values
+        with self.assertNumQueries(6):
+            response = self.client.get(leads_url, params)
+        data = response.json()
+        self.assertEqual(data['recordsTotal'], 3)
+        self.assertEqual([row[1:3] for row in data['data']], [["agent", "manager"], ["agent", ""]])
+
+    def test_users_of_other_organisations_are_not_found(self):
+        other = User.objects.create_user(username="other", password="pass", is_lvl3=True)
+        UserProfile.objects.create(user=other)
+        self.client.force_login(other)
+        response = self.client.get(reverse("performances:user_performance_leads", args=[self.agent.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class PerformanceReportTest(TestCase):
+
+    setUp = AggregatePerformanceTest.setUp
+
+    def test_lvl4_ranking_reads_the_report_of_an_ended_range(self):
+        other = UserProfile.objects.create(user=User.objects.create_user(username="other", password="pass", is_lvl3=True))
+        Lead.objects.create(
+            first_name="Bo", last_name="Lee", organisation=other, description="",
+            agent=self.agent, status="已完成", quote=100, commission=10,
+        )
+        time_range = TimeRange(start_of_month(2000, 1), start_of_day(timezone.localdate() + timedelta(days=1)))
+        self.assertIsNone(get_latest_report(time_range))
+        with mock.patch('performances.reports.timezone.now', return_value=time_range.end):
+            report = build_report(time_range, processes=1)
+        self.assertEqual(report.num_organisations, 2)
+        self.assertEqual(report.get_stats(), get_performance_stats(time_range))
+
+        # Changes after the report was started are not shown
+        Lead.objects.filter(organisation=other).delete()
+        admin = User.objects.create_user(username="admin", password="pass", is_lvl4=True)
+        self.client.force_login(admin)
+        response = self.client.get(reverse("performances:performance_ranking"), {
+            'time_range': 'custom',
+            'start_datetime': time_range.start.isoformat(),
+            'end_datetime': (time_range.end - timedelta(microseconds=1)).isoformat(),
+        })
+        self.assertEqual(response.context['report'], report)
+        rows = {row['user_stats'][0]: row['user_stats'][1:] for row in response.context['performances']}
+        self.assertEqual(rows["agent"], [3, 579 + 10, 2, 290 + 10])
+
+
+class CommissionSimulationTest(TestCase):
+
+    setUp = AggregatePerformanceTest.setUp
+
+    def simulate(self, scenarios):
+        self.client.force_login(self.supervisor)
+        return self.client.post(reverse("performances:commission_simulation"), {'scenarios': json.dumps(scenarios)})
+
+    def test_scenarios_change_payouts_without_saving(self):
+        team = Team.objects.create(name="managers", team_leader=self.manager)
+        response = self.simulate([
+            {'name': "agents at 30", 'changes': [{'target': 'all', 'role': 'agent', 'rate': 30}]},
+            {'changes': [
+                {'target': 'team', 'id': team.pk, 'role': 'manager', 'rate': 0},
+                {'target': 'user', 'id': self.manager.pk, 'role': 'manager', 'rate': 10},
+            ]},
+        ])
+        data = response.json()
+        users = [user['username'] for user in data['users']]
+        current = dict(zip(users, data['current']['users']))
+        self.assertEqual((current['agent'], current['manager'], current['supervisor']), (290, 84, 0))
+        self.assertEqual(data['current']['teams'], [84])
+
+        agents, managers = data['scenarios']
+        self.assertEqual(dict(zip(users, agents['users']))['agent'], 10)
+        self.assertEqual((agents['name'], agents['delta'], agents['teams']), ("agents at 30", 11, [1]))
+        # The later change wins on the leads both touch
+        self.assertEqual(dict(zip(users, managers['users']))['manager'], 55)
+        self.assertEqual((managers['name'], managers['total']), ("Scenario 2", 374 + 55))
+        self.assertEqual(Lead.objects.filter(commission=29).count(), 5)
+
+    def test_invalid_scenarios(self):
+        for scenarios in [[], [{'changes': [{'target': 'user', 'id': 0, 'role': 'agent', 'rate': 5}]}],
+                          [{'changes': [{'target': 'all', 'role': 'agent', 'rate': 500}]}],
+                          [{'changes': [{'target': 'user', 'id': [self.agent.pk], 'role': 'agent', 'rate': 5}]}],
+                          [{'changes': [{'target': 'user', 'id': True, 'role': 'agent', 'rate': 5}]}]]:
+            self.assertEqual(self.simulate(scenarios).status_code, 400)
+
+
+class CachedResultTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('performances.results.threading.Thread')
+    def test_stale_result_is_served_while_one_refresh_runs(self, thread):
+        compute = mock.Mock(return_value={'num_leads': 1})
+        version = get_lead_version(7)
+        self.assertEqual(get_cached_result('result', version, compute), {'num_leads': 1})
+        self.assertEqual(get_cached_result('result', get_lead_version(7), compute), {'num_leads': 1})
+        self.assertEqual(compute.call_count, 1)
+
+        bump_lead_versions([7])
+        self.assertNotEqual(get_lead_version(7), version)
+        for _ in range(3):
+            self.assertEqual(get_cached_result('result', get_lead_version(7), compute), {'num_leads': 1})
+        self.assertEqual(compute.call_count, 1)
+        thread.assert_called_once()
+        self.assertEqual(thread.call_args.kwargs['args'][:2], ('result', get_lead_version(7)))
+
+
+class PerformanceTrendsTest(TestCase):
+
+    setUp = AggregatePerformanceTest.setUp
+
+    def get_trends(self, **params):
+        self.client.force_login(self.supervisor)
+        return self.client.get(reverse("performances:performance_trends"), params).json()
+
+    def test_monthly_series_match_the_totals(self):
+        Lead.objects.filter(status="已完成").update(date_added=start_of_day(date(2024, 1, 15)))
+        Lead.objects.exclude(status="已完成").update(date_added=start_of_day(date(2024, 3, 2)))
+
+        trends = self.get_trends(time_range='years', year=2024, window=2)
+        self.assertEqual(len(trends['periods']), 12)
+        self.assertEqual(trends['periods'][:3], ['2024-01-01', '2024-02-01', '2024-03-01'])
+        series = {row['name']: row for row in trends['series']}
+        stats = aggregate_performance(Lead.objects.all(), truncate=False)
+        for user in (self.agent, self.manager):
+            for metric, value in stats[user.pk].items():
+                self.assertAlmostEqual(series[user.username][metric]['cumulative'][-1], value)
+
+        agent = series["agent"]['total_commission']
+        self.assertEqual(agent['values'][:4], [290, 0, 289.71, 0])
+        self.assertEqual(agent['moving_average'][:4], [290, 145, 144.86, 144.86])
+        self.assertEqual(agent['delta'][:4], [None, -290, 289.71, -289.71])
+
+    def test_team_counts_a_shared_lead_once(self):
+        team = Team.objects.create(name="both", team_leader=self.manager)
+        TeamMember.objects.create(team=team, member=self.agent)
+
+        trends = self.get_trends(group='team', period='week')
+        totals = {metric: values['cumulative'][-1] for metric, values in trends['series'][0].items() if metric in METRICS}
+        self.assertEqual(totals['num_leads'], 4)
+        self.assertEqual(totals['num_completed_leads'], 2)
+        self.assertAlmostEqual(totals['completed_lead_commission'], 290 + 50 + 29 + 5)
+
+    def test_invalid_parameters(self):
+        self.client.force_login(self.supervisor)
+        response = self.client.get(reverse("performances:performance_trends"), {'period': 'day'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class LeadSnapshotTest(TestCase):
+
+    def setUp(self):
+        AggregatePerformanceTest.setUp(self)
+        snapshots.clear()
+
+    def assertSnapshotMatchesLeads(self, **kwargs):
+        columns = get_snapshot(self.organisation.pk)
+        self.assertEqual(len(columns), Lead.objects.count())
+        for truncate in (True, False):
+            for count_cancelled in (True, False):
+                self.assertEqual(
+                    snapshot_stats(columns, truncate=truncate, count_cancelled=count_cancelled, **kwargs),
+                    aggregate_performance(TimeRange(kwargs.get('start'), kwargs.get('end')).filter(Lead.objects.all()), kwargs.get('users'), truncate, count_cancelled),
+                )
+
+    def test_snapshot_follows_lead_changes(self):
+        self.assertSnapshotMatchesLeads()
+        self.assertSnapshotMatchesLeads(users=[self.manager.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Lead.objects.filter(status="取消").update(status="已完成", quote=1234)
+            Lead.objects.filter(agent__isnull=True).delete()
+            Lead.objects.filter(status="进行中").update(date_added=start_of_day(date(2024, 1, 1)))
+        # Only the leads modified since the last refresh are read again, and the pks to spot the deletion
+        with self.assertNumQueries(2):
+            get_snapshot(self.organisation.pk)
+        self.assertSnapshotMatchesLeads()
+        self.assertSnapshotMatchesLeads(start=start_of_day(date(2024, 6, 1)))
+        with self.assertNumQueries(0):
+            get_snapshot(self.organisation.pk)
+
+
+class SharedLeadVersionTest(TestCase):
+
+    setUp = LeadSnapshotTest.setUp
+
+    def test_snapshot_follows_a_version_set_by_another_process(self):
+        get_snapshot(self.organisation.pk)
+        # Written by another worker: a lead goes, and one committed late by a long transaction comes, the count stays
+        deleted = Lead.objects.filter(agent__isnull=True).get().pk
+        with self.captureOnCommitCallbacks(execute=False):
+            Lead.objects.filter(pk=deleted).delete()
+            late = Lead.objects.create(first_name="Bo", last_name="Li", organisation=self.organisation, description="", agent=self.agent)
+            Lead.objects.filter(pk=late.pk).update(date_modified=timezone.now() - timedelta(hours=1))
+        other = caches.create_connection('default')
+        other.set(lead_version_key(self.organisation.pk), time.time_ns(), None)
+
+        self.assertNotIn(deleted, get_snapshot(self.organisation.pk).pk)
@@ -0,0 +1,109 @@
+from datetime import date, datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+QUARTER_MONTHS = {
+    'Q1': (1, 3),
+    'Q2': (4, 6),
+    'Q3': (7, 9),
+    'Q4': (10, 12),
+}
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def start_of_month(year, month):
+    # Month 13 is January of the next year
+    return start_of_day(date(year + (month - 1) // 12, (month - 1) % 12 + 1, 1))
+
+
+class TimeRange:
+    """
+    A range of lead creation times, start included and end excluded.
+    A missing start or end leaves that side open.
+    """
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_request(cls, params):
+        """Reads the range picked on a performance page, all time by default."""
+        time_range = params.get('time_range', 'all')
+        now = timezone.localtime()
+        if time_range == 'years':
+            year = int(params.get('year', now.year))
+            return cls(start_of_month(year, 1), start_of_month(year + 1, 1))
+
+        elif time_range == 'quarters':
+            year = int(params.get('quarter_year', now.year))
+            start_month, end_month = QUARTER_MONTHS[params.get('quarter')]
+            return cls(start_of_month(year, start_month), start_of_month(year, end_month + 1))
+
+        elif time_range == 'months':
+            year = int(params.get('month_year', now.year))
+            month = int(params.get('month', now.month))
+            return cls(start_of_month(year, month), start_of_month(year, month + 1))
+
+        elif time_range == 'custom':
+            start = parse_datetime(params.get('start_datetime') or '')
+            end = parse_datetime(params.get('end_datetime') or '')
+            if start and end and end >= start:
+                if timezone.is_naive(start):
+                    start = timezone.make_aware(start)
+                if timezone.is_naive(end):
+                    end = timezone.make_aware(end)
+                # The custom end is picked inclusive
+                return cls(start, end + timedelta(microseconds=1))
+
+        return cls()
+
+    def cache_key(self):
+        # The same range picked in any time zone gives the same key
+        return '-'.join('' if bound is None else str(bound.timestamp()) for bound in (self.start, self.end))
+
+    def filter(self, leads):
+        if self.start is not None:
+            leads = leads.filter(date_added__gte=self.start)
+        if self.end is not None:
+            leads = leads.filter(date_added__lt=self.end)
+        return leads
+
+    def split(self):
+        """
+        Splits the range into the whole days it covers, as a (first, end) pair
+        of dates with end excluded, and the datetime ranges left at its edges.
+        The whole days are None when the range covers none.
+        """
+        first = None
+        if self.start is not None:
+            first = timezone.localdate(self.start)
+            if start_of_day(first) < self.start:
+                first += timedelta(days=1)
+        end = None
+        if self.end is not None:
+            end = timezone.localdate(self.end)
+
+        if first is not None and end is not None and first >= end:
+            return None, [TimeRange(self.start, self.end)]
+
+        edges = []
+        if first is not None and start_of_day(first) > self.start:
+            edges.append(TimeRange(self.start, start_of_day(first)))
+        if end is not None and start_of_day(end) < self.end:
+            edges.append(TimeRange(start_of_day(end), self.end))
+        return (first, end), edges
+
+
+class TimeRangeMixin:
+    """Reads the time range of a performance page from its query string."""
+
+    def get_time_range(self):
+        if not hasattr(self, '_time_range'):
+            self._time_range = TimeRange.from_request(self.request.GET)
+        return self._time_range
+
+    def filter_by_time_range(self, queryset):
+        return self.get_time_range().filter(queryset)
@@ -0,0 +1,175 @@
+from datetime import timedelta
+import numpy as np
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
+from django.utils import timezone
+from .aggregates import CANCELLED, COMPLETED
+
+PERIODS = {
+    'month': TruncMonth,
+    'week': TruncWeek,
+}
+METRICS = ('num_leads', 'num_completed_leads', 'total_commission', 'completed_lead_commission')
+MAX_WINDOW = 12
+# Ten years of weeks; longer axes keep their most recent periods
+MAX_PERIODS = 520
+
+
+def trend_rows(leads, period):
+    """
+    Buckets leads by period in SQL, grouped by agent, manager and status.
+    Returns (period, agent, manager, status, count, agent_cents, manager_cents)
+    tuples, with the exact agent and manager commissions in hundredths.
+    """
+    return list(
+        leads.order_by()
+        .annotate(period=PERIODS[period]('date_added', output_field=DateField()))
+        .values('period', 'agent', 'manager', 'status')
+        .annotate(
+            count=Count('pk'),
+            agent_cents=Coalesce(Sum('commission_cents'), 0),
+            manager_cents=Coalesce(Sum('co_commission_cents'), 0),
+        )
+        .values_list('period', 'agent', 'manager', 'status', 'count', 'agent_cents', 'manager_cents')
+    )
+
+def period_start(day, period):
+    if period == 'month':
+        return day.replace(day=1)
+    return day - timedelta(days=day.weekday())
+
+def period_axis(rows, time_range, period):
+    """
+    The start of every period shown, as datetime64[D]: the picked range, with
+    its open sides ending at the first or last bucket of the data.
+    """
+    days = [row[0] for row in rows]
+    first = timezone.localdate(time_range.start) if time_range.start is not None else min(days, default=None)
+    # The range end is excluded
+    last = timezone.localdate(time_range.end - timedelta(microseconds=1)) if time_range.end is not None else max(days, default=None)
+    if first is None or last is None or first > last:
+        return np.array([], dtype='datetime64[D]')
+
+    first, last = period_start(first, period), period_start(last, period)
+    if period == 'month':
+        axis = np.arange(np.datetime64(first, 'M'), np.datetime64(last, 'M') + 1).astype('datetime64[D]')
+    else:
+        axis = np.arange(np.datetime64(first, 'D'), np.datetime64(last, 'D') + 1, 7)
+    return axis[-MAX_PERIODS:]
+
+def expand_pairs(user_columns, indptr, groups):
+    """
+    Pairs every row with every group of the user at user_columns[row], given
+    the groups of each user in CSR form. Returns (rows, groups) index arrays.
+    """
+    starts = indptr[user_columns]
+    counts = indptr[user_columns + 1] - starts
+    rows = np.repeat(np.arange(len(user_columns)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, groups[np.repeat(starts, counts) + offsets]
+
+def user_columns(user_ids, values):
+    # Column of each user id in the sorted user_ids, or len(user_ids) for NaN and unknown users
+    columns = np.searchsorted(user_ids, values)
+    found = columns < len(user_ids)
+    found[found] = user_ids[columns[found]] == values[found]
+    return np.where(found, columns, len(user_ids))
+
+def bucket_series(rows, axis, group_members):
+    """
+    Adds the rows up into a (metric, group, period) array.
+
+    group_members lists the user ids of each group. A lead counts once for a
+    group holding its agent, its manager or both, and earns the group the
+    commission of each role the group holds. Cancelled leads count for nothing.
+    """
+    values = np.zeros((len(METRICS), len(group_members), len(axis)))
+    if not rows or not len(axis) or not group_members:
+        return values
+
+    # The groups of user column c are groups[indptr[c]:indptr[c + 1]]
+    pairs = sorted({(user_id, index) for index, members in enumerate(group_members) for user_id in members})
+    user_ids = sorted({user_id for user_id, index in pairs})
+    pair_columns = np.searchsorted(user_ids, [user_id for user_id, index in pairs])
+    groups = np.array([index for user_id, index in pairs], dtype=np.int64)
+    # One more column, in no group, for rows without a user or with a user outside the groups
+    indptr = np.searchsorted(pair_columns, np.arange(len(user_ids) + 2))
+
+    # Column arrays from the row tuples
+    periods, agents, managers, statuses, count, agent_cents, manager_cents = zip(*rows)
+    user_ids = np.array(user_ids, dtype=np.float64)
+    agents = user_columns(user_ids, np.array(agents, dtype=np.float64))
+    managers = user_columns(user_ids, np.array(managers, dtype=np.float64))
+    statuses = np.array(statuses, dtype=object)
+    count = np.array(count, dtype=np.float64)
+    agent_amount = np.array(agent_cents, dtype=np.float64) / 100
+    manager_amount = np.array(manager_cents, dtype=np.float64) / 100
+    # Rows outside the axis get -1
+    axis_index = {day: index for index, day in enumerate(axis.tolist())}
+    period_index = np.array([axis_index.get(day, -1) for day in periods], dtype=np.int64)
+
+    live = (period_index >= 0) & (statuses != CANCELLED)
+    completed = live & (statuses == COMPLETED)
+
+    agent_rows, agent_groups = expand_pairs(agents, indptr, groups)
+    manager_rows, manager_groups = expand_pairs(managers, indptr, groups)
+    # A lead counts once for a group holding both of its roles
+    held = np.unique(np.concatenate([agent_rows, manager_rows]) * len(group_members) + np.concatenate([agent_groups, manager_groups]))
+    held_rows, held_groups = np.divmod(held, len(group_members))
+
+    num_leads, num_completed_leads, total_commission, completed_lead_commission = values
+    for target, pair_rows, pair_groups, amount, mask in [
+        (num_leads, held_rows, held_groups, count, live),
+        (num_completed_leads, held_rows, held_groups, count, completed),
+        (total_commission, agent_rows, agent_groups, agent_amount, live),
+        (total_commission, manager_rows, manager_groups, manager_amount, live),
+        (completed_lead_commission, agent_rows, agent_groups, agent_amount, completed),
+        (completed_lead_commission, manager_rows, manager_groups, manager_amount, completed),
+    ]:
+        keep = mask[pair_rows]
+        pair_rows = pair_rows[keep]
+        np.add.at(target, (pair_groups[keep], period_index[pair_rows]), amount[pair_rows])
+    return values
+
+def moving_average(values, window):
+    # Trailing mean over the last window periods, fewer at the start of the axis
+    padded = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)], axis=-1)
+    end = np.arange(1, values.shape[-1] + 1)
+    start = np.maximum(end - window, 0)
+    return (padded[..., end] - padded[..., start]) / (end - start)
+
+def as_json(array):
+    return np.round(array, 2).tolist()
+
+def build_trends(rows, axis, groups, window):
+    """
+    Returns the series of each (id, name, user_ids) group, with the moving
+    average, running total and period-over-period change of every metric.
+    """
+    values = bucket_series(rows, axis, [members for group_id, name, members in groups])
+    values, averages, totals, deltas = (as_json(array) for array in (
+        values,
+        moving_average(values, window),
+        np.cumsum(values, axis=-1),
+        np.diff(values, axis=-1),
+    ))
+    return {
+        'periods': np.datetime_as_string(axis).tolist(),
+        'series': [
+            {
+                'id': group_id,
+                'name': name,
+                **{
+                    metric: {
+                        'values': values[m][g],
+                        'moving_average': averages[m][g],
+                        'cumulative': totals[m][g],
+                        # The first period has nothing to compare with
+                        'delta': [None] + deltas[m][g] if axis.size else [],
+                    }
+                    for m, metric in enumerate(METRICS)
+                },
+            }
+            for g, (group_id, name, members) in enumerate(groups)
+        ],
+    }
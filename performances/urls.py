@@ -8,7 +8,11 @@ urlpatterns = [
     path('performances/<int:team_id>/', SingleTeamPerformanceListView.as_view(), name='performance_list'),
     path('', TeamsPerformanceListView.as_view(), name='team_performances'),
     path('user-performance/<int:user_id>/', UserPerformanceListView.as_view(), name='user_performance_list'),
+    path('user-performance/<int:user_id>/leads/', UserPerformanceLeadDataView.as_view(), name='user_performance_leads'),
     path('ranking/', performanceRankingView.as_view(), name='performance_ranking'),
     path('personal/', personalPerformanceView.as_view(), name='personal_work'),
+    path('personal/leads/', personalPerformanceLeadDataView.as_view(), name='personal_work_leads'),
+    path('trends/', PerformanceTrendsView.as_view(), name='performance_trends'),
+    path('simulate/', CommissionSimulationView.as_view(), name='commission_simulation'),
 
 ]
\ No newline at end of file
@@ -1,18 +1,26 @@
 import os
-import datetime
 from django import contrib
 from django.contrib import messages
 from django.core.mail import send_mail
 from django.http.response import JsonResponse
-from django.shortcuts import render, redirect, reverse
+from django.shortcuts import get_object_or_404, render, redirect, reverse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import generic, View
 from agents.mixins import SupervisorAndLoginRequiredMixin, NotSuperuserAndLoginRequiredMixin, NoLvl1AndLoginRequiredMixin
-from leads.models import Lead, CaseField, UserRelation, User, Team
+from leads.models import Lead, User, Team, TeamMember
+from leads.tables import LeadTableJsonMixin
+from leads.columns import get_table_columns
+from leads.hierarchy import get_organisation_users
+from leads.scope import get_scope
+from .aggregates import annotate_team_performance, empty_stats
+from .reports import get_latest_report
+from .results import get_cached_result, get_lead_version, get_team_version
+from .simulations import load_simulation_leads, simulate
+from .snapshot import get_snapshot_stats
+from .trends import MAX_WINDOW, PERIODS, build_trends, period_axis, trend_rows
+from .timeranges import TimeRangeMixin
 from .forms import * #()
 from django.db.models import Count, Sum, Q
-from django.db import models
-from django.core.exceptions import FieldDoesNotExist
 import json
 from django.db import IntegrityError
 
@@ -20,10 +28,50 @@ from django.db import IntegrityError
 # Used by major update
 from django.core.exceptions import ObjectDoesNotExist
 
-from django.utils.dateparse import parse_datetime
-from datetime import datetime, timedelta
-
-class SingleTeamPerformanceListView(LoginRequiredMixin, generic.ListView):
+def get_visible_teams(request):
+    user = request.user
+    queryset = Team.objects.none()
+
+    # Fetch appropriate queryset based on user level
+    if user.is_lvl4:
+        queryset = Team.objects.all()
+    elif user.is_lvl3:
+        queryset = Team.objects.filter(team_leader__user_name__supervisor=user)
+    elif user.is_lvl2 or user.is_lvl1:
+        queryset = Team.objects.filter(team_leader__user_name__supervisor=request.scope.supervisor_id)
+
+    return queryset
+
+def get_ranked_users(user, organisation_id):
+    # Every user of the organisation, or of all of them for lvl4
+    if user.is_lvl4:
+        return User.objects.all()
+    if user.is_lvl3 or user.is_lvl2 or user.is_lvl1:
+        return get_organisation_users(organisation_id)
+    return User.objects.none()
+
+def get_team_groups(request):
+    # (id, name, member ids) of every visible team, the leader among the members
+    teams = get_visible_teams(request).order_by('pk')
+    members = {}
+    for team_id, member_id in TeamMember.objects.filter(team__in=teams).values_list('team', 'member'):
+        members.setdefault(team_id, []).append(member_id)
+    return [
+        (team_id, name, members.get(team_id, []) + [leader_id])
+        for team_id, name, leader_id in teams.values_list('pk', 'name', 'team_leader')
+    ]
+
+def get_user_summary(user, time_range):
+    # Cancelled leads are counted but earn nothing
+    organisation_id = get_scope(user).organisation_id
+    stats = get_cached_result(
+        f'user_performance:{user.pk}:{time_range.cache_key()}',
+        get_lead_version(organisation_id),
+        lambda: get_snapshot_stats(time_range, organisation_id, users=[user.pk], truncate=False, count_cancelled=True),
+    )
+    return stats.get(user.pk, empty_stats())
+
+class SingleTeamPerformanceListView(TimeRangeMixin, LoginRequiredMixin, generic.ListView):
     template_name = "performances/performance_list.html"
     context_object_name = 'performances'
 
@@ -37,104 +85,27 @@ class SingleTeamPerformanceListView(LoginRequiredMixin, generic.ListView):
             Q(agent=team.team_leader) | 
             Q(manager=team.team_leader)
         )
-        # Apply time range filtering
-        time_range = self.request.GET.get('time_range', 'all')
-        if time_range != 'all':
-            leads = self.filter_by_time_range(leads, time_range)
+        leads = self.filter_by_time_range(leads)
         return leads
 
-    def filter_by_time_range(self, queryset, time_range):
-        if time_range == 'years':
-            year = int(self.request.GET.get('year', datetime.now().year))
-            start_date = datetime(year, 1, 1)
-            end_date = datetime(year, 12, 31, 23, 59, 59)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'quarters':
-            year = int(self.request.GET.get('quarter_year', datetime.now().year))
-            quarter = self.request.GET.get('quarter')
-            quarter_start_end = {
-                'Q1': (1, 3),
-                'Q2': (4, 6),
-                'Q3': (7, 9),
-                'Q4': (10, 12)
-            }
-            start_month, end_month = quarter_start_end[quarter]
-            start_date = datetime(year, start_month, 1)
-            end_date = datetime(year, end_month, 1).replace(day=1) + timedelta(days=31) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'months':
-            year = int(self.request.GET.get('month_year', datetime.now().year))
-            month = int(self.request.GET.get('month', datetime.now().month))
-            start_date = datetime(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'custom':
-            start_datetime = parse_datetime(self.request.GET.get('start_datetime'))
-            end_datetime = parse_datetime(self.request.GET.get('end_datetime'))
-
-            if start_datetime and end_datetime and end_datetime >= start_datetime:
-                return queryset.filter(date_added__range=(start_datetime, end_datetime))
-
-            return queryset
-        
-        return queryset  # No filtering if 'all'
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         team_id = self.kwargs.get('team_id')
-        team = Team.objects.get(id=team_id)
-        leads = self.get_queryset()
+        team = Team.objects.select_related('team_leader').get(id=team_id)
 
         # Initialize team member data
-        team_members = list(team.teammember_set.values_list('member', flat=True)) + [team.team_leader.id]
-        team_members_data = {member.member.id: {
-                'user_id': member.member.id,
-                'username': member.member.username,
-                'num_leads': 0,
-                'total_commission': 0,
-                'num_completed_leads': 0,
-                'completed_lead_commission': 0,
-            }
-            for member in team.teammember_set.all()
-        }
-        team_leader = team.team_leader
-        team_members_data[team_leader.id] = {
-            'user_id': team_leader.id,
-            'username': team_leader.username,
-            'num_leads': 0,
-            'total_commission': 0,
-            'num_completed_leads': 0,
-            'completed_lead_commission': 0,
-        }
-
-        # Populate member data based on filtered leads
-        for lead in leads:
-            if lead.status == "取消":
-                continue 
-            if lead.agent and lead.agent.id in team_members:
-                commission = int(lead.quote) * int(lead.commission) / 100
-                team_members_data[lead.agent.id]['num_leads'] += 1
-                team_members_data[lead.agent.id]['total_commission'] += commission
-                if lead.status == '已完成':
-                    team_members_data[lead.agent.id]['num_completed_leads'] += 1
-                    team_members_data[lead.agent.id]['completed_lead_commission'] += commission
-
-            if lead.manager and lead.manager.id in team_members:
-                co_commission = int(lead.quote) * int(lead.co_commission) / 100
-                team_members_data[lead.manager.id]['num_leads'] += 1
-                team_members_data[lead.manager.id]['total_commission'] += co_commission
-                if lead.status == '已完成':
-                    team_members_data[lead.manager.id]['num_completed_leads'] += 1
-                    team_members_data[lead.manager.id]['completed_lead_commission'] += co_commission
-            
-            if lead.agent and lead.manager and lead.agent == lead.manager and lead.agent.id in team_members:
-                team_members_data[lead.agent.id]['num_leads'] -= 1
-                if lead.status == '已完成':
-                    team_members_data[lead.agent.id]['num_completed_leads'] -= 1
-
+        team_members = list(team.teammember_set.values_list('member', flat=True)) + [team.team_leader_id]
+        time_range = self.get_time_range()
+        organisation_id = get_scope(team.team_leader).organisation_id
+        stats = get_cached_result(
+            f'team_performance:{team.pk}:{time_range.cache_key()}',
+            (get_lead_version(organisation_id), get_team_version()),
+            lambda: get_snapshot_stats(time_range, organisation_id, users=team_members, truncate=False),
+        )
+        usernames = dict(User.objects.filter(pk__in=team_members).values_list('pk', 'username'))
+        team_members_data = {}
+        for member_id in team_members:
+            team_members_data[member_id] = {'user_id': member_id, 'username': usernames[member_id], **stats.get(member_id, empty_stats())}
 
         performances = [
             {
@@ -155,105 +126,37 @@ class SingleTeamPerformanceListView(LoginRequiredMixin, generic.ListView):
         context['curr_team'] = team
         return context
 
-class TeamsPerformanceListView(LoginRequiredMixin, generic.ListView):
+class TeamsPerformanceListView(TimeRangeMixin, LoginRequiredMixin, generic.ListView):
     template_name = "performances/teams_performances.html"
     context_object_name = 'teams_performances'
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Team.objects.none()
-
-        # Fetch appropriate queryset based on user level
-        if user.is_lvl4:
-            queryset = Team.objects.all()
-        elif user.is_lvl3:
-            queryset = Team.objects.filter(team_leader__user_name__supervisor=user)
-        elif user.is_lvl2 or user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            queryset = Team.objects.filter(team_leader__user_name__supervisor=sr.supervisor)
-
-        return queryset
-    
-    def filter_by_time_range(self, queryset, time_range):
-        """Filters queryset by the time range provided"""
-        if time_range == 'years':
-            year = int(self.request.GET.get('year', datetime.now().year))
-            start_date = datetime(year, 1, 1)
-            end_date = datetime(year, 12, 31, 23, 59, 59)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'quarters':
-            year = int(self.request.GET.get('quarter_year', datetime.now().year))
-            quarter = self.request.GET.get('quarter')
-            quarter_start_end = {
-                'Q1': (1, 3),
-                'Q2': (4, 6),
-                'Q3': (7, 9),
-                'Q4': (10, 12)
-            }
-            start_month, end_month = quarter_start_end[quarter]
-            start_date = datetime(year, start_month, 1)
-            end_date = datetime(year, end_month, 1).replace(day=1) + timedelta(days=31) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'months':
-            year = int(self.request.GET.get('month_year', datetime.now().year))
-            month = int(self.request.GET.get('month', datetime.now().month))
-            start_date = datetime(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'custom':
-            start_datetime = parse_datetime(self.request.GET.get('start_datetime'))
-            end_datetime = parse_datetime(self.request.GET.get('end_datetime'))
-
-            if start_datetime and end_datetime and end_datetime >= start_datetime:
-                return queryset.filter(date_added__range=(start_datetime, end_datetime))
-
-            return queryset
-        
-        return queryset  # No filtering if 'all'
+        return get_visible_teams(self.request)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        teams = self.get_queryset()
-        time_range = self.request.GET.get('time_range', 'all')
-
-        # Initialize team data
-        team_data = {}
-        for team in teams:
-
-            leads = Lead.objects.filter(
-                Q(agent__in=team.teammember_set.values_list('member', flat=True)) | 
-                Q(manager__in=team.teammember_set.values_list('member', flat=True)) | 
-                Q(agent=team.team_leader) | 
-                Q(manager=team.team_leader)
-            )
-
-            if time_range != 'all':
-                leads = self.filter_by_time_range(leads, time_range)
-
-            completed_leads = leads.filter(status='已完成')
-
-            team_members = list(team.teammember_set.values_list('member', flat=True))  # List of member IDs
-            total_commission = 0
-            for lead in completed_leads:
-
-                if lead.agent and lead.agent.pk in team_members or lead.agent == team.team_leader:
-                    total_commission += int(lead.quote) * int(lead.commission) / 100
-
-                if lead.manager and lead.manager.pk in team_members or lead.manager == team.team_leader:
-                    total_commission += int(lead.quote) * int(lead.co_commission) / 100
-
-            team_data[team] = {
+    def get_team_data(self, time_range):
+        # Every team's counts and commission come from one query
+        return [
+            {
                 'team_id': team.pk,
                 'team_name': team.name,
                 'team_leader': team.team_leader.username,
-                'num_teammembers': team.teammember_set.count() + 1,
-                'num_leads': leads.count(),
-                'num_completed_leads': completed_leads.count(),
-                'total_commission': total_commission,
+                'num_teammembers': team.num_members,
+                'num_leads': team.num_leads,
+                'num_completed_leads': team.num_completed_leads,
+                'total_commission': team.commission_cents / 100,
             }
+            for team in annotate_team_performance(self.get_queryset(), time_range)
+        ]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        scope = self.request.scope
+        time_range = self.get_time_range()
+        team_data = get_cached_result(
+            f'teams_performance:{scope.level}:{scope.organisation_id}:{time_range.cache_key()}',
+            (get_lead_version(None if scope.level == 4 else scope.organisation_id), get_team_version()),
+            lambda: self.get_team_data(time_range),
+        )
 
         # Convert team data to a list for display
         performances = [
@@ -268,301 +171,105 @@ class TeamsPerformanceListView(LoginRequiredMixin, generic.ListView):
                 ],
                 'team_id': team_info['team_id']
             }
-            for team_info in team_data.values()
+            for team_info in team_data
         ]
 
         context['teams_performances'] = performances
         return context
 
-class UserPerformanceListView(LoginRequiredMixin, generic.ListView):
-    template_name = "performances/user_performance_list.html"
-    context_object_name = 'leads'
+class UserPerformanceMixin(TimeRangeMixin):
+    """
+    The leads a user holds as agent or manager, with their performance summary.
 
-    def get_queryset(self):
-        # Retrieve user ID from the URL
-        user_id = self.kwargs.get('user_id')
-        user = User.objects.get(id=user_id)
+    The page renders the summary and the table columns only; the lead rows are
+    served a page at a time by the LeadTableJsonMixin view of the same user.
+    """
+    include_case_fields = True
 
+    def get_performance_user(self):
+        # Looked up once per request, by the queryset, the columns and the summary
+        if not hasattr(self, '_performance_user'):
+            users = get_ranked_users(self.request.user, self.request.scope.organisation_id)
+            self._performance_user = get_object_or_404(users, id=self.kwargs.get('user_id'))
+        return self._performance_user
+
+    def get_queryset(self):
+        user = self.get_performance_user()
         leads = Lead.objects.filter(
             Q(agent=user) | Q(manager=user)
         )
+        return self.filter_by_time_range(leads)
 
-        # Apply time range filtering
-        time_range = self.request.GET.get('time_range', 'all')
-        if time_range != 'all':
-            leads = self.filter_by_time_range(leads, time_range)
-
-        return leads
-
-    def filter_by_time_range(self, queryset, time_range):
-        if time_range == 'years':
-            year = int(self.request.GET.get('year', datetime.now().year))
-            start_date = datetime(year, 1, 1)
-            end_date = datetime(year, 12, 31, 23, 59, 59)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'quarters':
-            year = int(self.request.GET.get('quarter_year', datetime.now().year))
-            quarter = self.request.GET.get('quarter')
-            quarter_start_end = {
-                'Q1': (1, 3),
-                'Q2': (4, 6),
-                'Q3': (7, 9),
-                'Q4': (10, 12)
-            }
-            start_month, end_month = quarter_start_end[quarter]
-            start_date = datetime(year, start_month, 1)
-            end_date = datetime(year, end_month, 1).replace(day=1) + timedelta(days=31) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'months':
-            year = int(self.request.GET.get('month_year', datetime.now().year))
-            month = int(self.request.GET.get('month', datetime.now().month))
-            start_date = datetime(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'custom':
-            start_datetime = parse_datetime(self.request.GET.get('start_datetime'))
-            end_datetime = parse_datetime(self.request.GET.get('end_datetime'))
-
-            if start_datetime and end_datetime and end_datetime >= start_datetime:
-                return queryset.filter(date_added__range=(start_datetime, end_datetime))
-
-            return queryset
-        
-        return queryset  # No filtering if 'all'
+    def get_table_organisation(self):
+        # Custom columns belong to the user's organisation, lvl4 users have none
+        organisation_id = get_scope(self.get_performance_user()).organisation_id
+        return organisation_id or self.get_queryset().values_list('organisation', flat=True).first()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_id = self.kwargs.get('user_id')
-        leads = self.get_queryset()
-        curr_user = User.objects.get(id=user_id)
-
-        # Performance summary
-        num_leads = leads.count()
-        total_commission = 0
-        num_completed_leads = 0
-        completed_lead_commission = 0
-
-        lead_fields = []
-        case_field_names = []
-        datetime_fields_info = []
-
-        lead = self.get_queryset().first()
-        if lead:
-            lead_fields = [field.name for field in lead._meta.get_fields()]
-            if "extrafields" in lead_fields:
-                lead_fields.remove("extrafields")
-            if "followups" in lead_fields:
-                lead_fields.remove('followups')
-            if "id" in lead_fields:
-                lead_fields.remove('id')
-            if "organisation" in lead_fields:
-                lead_fields.remove('organisation')
-            if "description" in lead_fields:
-                lead_fields.remove('description')
-            if "phone_number" in lead_fields:
-                lead_fields.remove("phone_number")
-
-            case_fields = CaseField.objects.filter(user=lead.organisation)
-            case_field_names = [field.name for field in case_fields]
-
-            combined_fields = lead_fields # + case_field_names
-
-            # Check field types and save index and type if it's DateTimeField or DateField
-            for i, field_name in enumerate(combined_fields):
-                try:
-                    if field_name in lead_fields:
-                        # Check lead fields
-                        field = lead._meta.get_field(field_name)
-                        if isinstance(field, models.DateTimeField):
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                        elif isinstance(field, models.DateField):
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                    else:
-                        # Handle case fields if needed
-                        # Assuming you might have some way to access field type
-                        case_field = CaseField.objects.get(user=lead.organisation, name=field_name)
-                        if case_field.field_type == 'date':
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                        elif case_field.field_type == 'datetime':
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                except FieldDoesNotExist:
-                    pass
-
+        curr_user = self.get_performance_user()
 
+        organisation_id = self.get_table_organisation()
+        if organisation_id:
+            lead_fields, datetime_fields_info = get_table_columns(
+                organisation_id, exclude=('description',), include_case_fields=self.include_case_fields
+            )
             context.update({
-                "lead_fields": ['Order-ID'] + combined_fields,
+                "lead_fields": lead_fields,
+                "lead_fields_json": json.dumps(lead_fields),
                 "datetime_fields_info": json.dumps(datetime_fields_info) 
             })
 
-
-        for lead in leads:
-            if lead.status == "取消":
-                continue
-            
-            commission = int(lead.quote) * int(lead.commission) / 100 if lead.agent == curr_user else 0
-            co_commission = int(lead.quote) * int(lead.co_commission) / 100 if lead.manager == curr_user else 0
-
-            total_commission += (commission + co_commission)
-
-            if lead.status == '已完成':
-                num_completed_leads += 1
-                completed_lead_commission += (commission + co_commission)
-
-        performance_summary = {
-            'num_leads': num_leads,
-            'total_commission': total_commission,
-            'num_completed_leads': num_completed_leads,
-            'completed_lead_commission': completed_lead_commission,
-        }
-
         # Pass the performance summary and leads to context
-        context['performance_summary'] = performance_summary
-        context['leads'] = leads
-        context['curr_id'] = user_id
+        context['performance_summary'] = get_user_summary(curr_user, self.get_time_range())
+        context['curr_id'] = curr_user.pk
         context['curr_name'] = curr_user.username
-        
+        context['status_choices'] = Lead.STATUS_CHOICES
         return context
 
-class performanceRankingView(LoginRequiredMixin, generic.ListView):
+class UserPerformanceListView(UserPerformanceMixin, LoginRequiredMixin, generic.ListView):
+    template_name = "performances/user_performance_list.html"
+    context_object_name = 'leads'
+    include_case_fields = False
+
+class UserPerformanceLeadDataView(LeadTableJsonMixin, UserPerformanceListView):
+    """Server-side rows for the lead table of a user's performance page."""
+
+    # The user's organisation rather than LeadTableJsonMixin's lead lookup
+    get_table_organisation = UserPerformanceMixin.get_table_organisation
+
+class performanceRankingView(TimeRangeMixin, LoginRequiredMixin, generic.ListView):
     template_name = "performances/performance_ranking.html"
     context_object_name = 'performances'
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = None
-        if user.is_lvl4:
-            queryset = Lead.objects.all()
-        elif user.is_lvl3:
-            queryset = Lead.objects.filter(organisation=user.userprofile)
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = Lead.objects.filter(organisation=up)
-        elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-            queryset = Lead.objects.filter(organisation=up)
-
-        # Apply time range filtering
-        time_range = self.request.GET.get('time_range', 'all')
-        if time_range != 'all':
-            queryset = self.filter_by_time_range(queryset, time_range)
-
-        return queryset
-            
-    def filter_by_time_range(self, queryset, time_range):
-        if time_range == 'years':
-            year = int(self.request.GET.get('year', datetime.now().year))
-            start_date = datetime(year, 1, 1)
-            end_date = datetime(year, 12, 31, 23, 59, 59)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'quarters':
-            year = int(self.request.GET.get('quarter_year', datetime.now().year))
-            quarter = self.request.GET.get('quarter')
-            quarter_start_end = {
-                'Q1': (1, 3),
-                'Q2': (4, 6),
-                'Q3': (7, 9),
-                'Q4': (10, 12)
-            }
-            start_month, end_month = quarter_start_end[quarter]
-            start_date = datetime(year, start_month, 1)
-            end_date = datetime(year, end_month, 1).replace(day=1) + timedelta(days=31) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'months':
-            year = int(self.request.GET.get('month_year', datetime.now().year))
-            month = int(self.request.GET.get('month', datetime.now().month))
-            start_date = datetime(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'custom':
-            start_datetime = parse_datetime(self.request.GET.get('start_datetime'))
-            end_datetime = parse_datetime(self.request.GET.get('end_datetime'))
-
-            if start_datetime and end_datetime and end_datetime >= start_datetime:
-                return queryset.filter(date_added__range=(start_datetime, end_datetime))
-
-            return queryset
-        
-        return queryset  
-    
+        return self.filter_by_time_range(Lead.objects.visible_to(self.request.user))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        leads = self.get_queryset()
         user = self.request.user
 
-        up = None
-        if user.is_lvl3:
-            up = user.userprofile
-        elif user.is_lvl2:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-        elif user.is_lvl1:
-            sr = UserRelation.objects.get(user=user)
-            up = sr.supervisor.userprofile
-
-        all_agents = []
-        if user.is_lvl4:
-            all_agents = User.objects.all()
-        elif user.is_lvl3:
-            all_agents = User.objects.filter(
-                Q(is_lvl3=True, userprofile=up) |
-                Q(Q(is_lvl1=True) | Q(is_lvl2=True), user_name__supervisor__userprofile=up)
+        up = self.request.scope.organisation_id
+        all_agents = get_ranked_users(user, up)
+
+        # Counted over the organisation's lead snapshot, or the daily rollups for lvl4
+        organisation_id = None if user.is_lvl4 else up
+        time_range = self.get_time_range()
+        # lvl4 users see ended ranges as of their last report
+        report = get_latest_report(time_range) if user.is_lvl4 else None
+        if report is not None:
+            stats = report.get_stats()
+        elif user.is_lvl4 or up:
+            stats = get_cached_result(
+                f'performance_ranking:{organisation_id}:{time_range.cache_key()}',
+                get_lead_version(organisation_id),
+                lambda: get_snapshot_stats(time_range, organisation_id),
             )
-        elif user.is_lvl2:
-            all_agents = User.objects.filter(
-                Q(is_lvl3=True, userprofile=up) |
-                Q(Q(is_lvl1=True) | Q(is_lvl2=True), user_name__supervisor__userprofile=up)
-            )
-        elif user.is_lvl1:
-            all_agents = User.objects.filter(
-                Q(is_lvl3=True, userprofile=up) |
-                Q(Q(is_lvl1=True) | Q(is_lvl2=True), user_name__supervisor__userprofile=up)
-            )
-
+        else:
+            stats = {}
         agent_data = {}
-        for agent in all_agents:
-            agent_data[agent] = {
-                'user_id': agent.pk,
-                'username': agent.username,
-                'num_leads': 0,
-                'total_commission': 0,
-                'num_completed_leads': 0,
-                'completed_lead_commission': 0,
-            }
-
-        for lead in leads:
-            if lead.status == "取消":
-                continue 
-
-            if lead.agent:
-                agent_info = agent_data[lead.agent]
-                agent_info['num_leads'] += 1
-                commission = int((lead.quote) * (int(lead.commission) / 100))
-                agent_info['total_commission'] += commission
-                if lead.status=='已完成':
-                    agent_info['completed_lead_commission'] += commission
-                    agent_info['num_completed_leads'] += 1
-            if lead.manager:
-                agent_info = agent_data[lead.manager]
-                agent_info['num_leads'] += 1
-                co_commission = int((lead.quote) * (int(lead.co_commission) / 100))
-                agent_info['total_commission'] += co_commission
-                if lead.status=='已完成':
-                    agent_info['completed_lead_commission'] += co_commission
-                    agent_info['num_completed_leads'] += 1
-
-
-            if lead.agent and lead.manager and lead.agent == lead.manager:
-                agent_data[lead.manager]['num_leads'] -= 1
-                if lead.status == '已完成':
-                    agent_data[lead.manager]['num_completed_leads'] -= 1
+        for agent_id, username in all_agents.values_list('pk', 'username'):
+            agent_data[agent_id] = {'user_id': agent_id, 'username': username, **stats.get(agent_id, empty_stats())}
 
         performances = sorted(
             [
@@ -582,154 +289,93 @@ class performanceRankingView(LoginRequiredMixin, generic.ListView):
             reverse=True  # Sort in descending order
         )
         context['performances'] = performances
+        context['report'] = report
         return context
     
-class personalPerformanceView(LoginRequiredMixin, generic.ListView):
+class personalPerformanceView(UserPerformanceMixin, LoginRequiredMixin, generic.ListView):
     template_name = "performances/personal_stats.html"
     context_object_name = 'performances'
 
-    def get_queryset(self):
-        user = self.request.user
-
-        leads = Lead.objects.filter(
-            Q(agent=user) | Q(manager=user)
+    def get_performance_user(self):
+        return self.request.user
+
+class personalPerformanceLeadDataView(LeadTableJsonMixin, personalPerformanceView):
+    """Server-side rows for the lead table of the personal performance page."""
+
+    # The user's organisation rather than LeadTableJsonMixin's lead lookup
+    get_table_organisation = UserPerformanceMixin.get_table_organisation
+
+class PerformanceTrendsView(TimeRangeMixin, LoginRequiredMixin, View):
+    """
+    Monthly or weekly series of every user or team in the scope, as JSON, with
+    moving averages, running totals and period-over-period changes.
+
+    GET params: group=user|team, period=month|week, window (moving average
+    length, 1 to 12) and the time range of the performance pages.
+    """
+
+    def get(self, request, *args, **kwargs):
+        group = request.GET.get('group', 'user')
+        period = request.GET.get('period', 'month')
+        try:
+            window = int(request.GET.get('window', 3))
+        except ValueError:
+            window = 0
+        if group not in ('user', 'team') or period not in PERIODS or not 1 <= window <= MAX_WINDOW:
+            return JsonResponse({'errors': "Invalid group, period or window"}, status=400)
+
+        scope = request.scope
+        organisation_id = None if scope.level == 4 else scope.organisation_id
+        time_range = self.get_time_range()
+        trends = get_cached_result(
+            f'performance_trends:{scope.level}:{scope.organisation_id}:{group}:{period}:{window}:{time_range.cache_key()}',
+            (get_lead_version(organisation_id), get_team_version()),
+            lambda: self.get_trends(group, period, window, organisation_id),
         )
+        return JsonResponse({'group': group, 'period': period, 'window': window, **trends})
+
+    def get_groups(self, group, organisation_id):
+        if group == 'user':
+            return [
+                (user_id, username, [user_id])
+                for user_id, username in get_ranked_users(self.request.user, organisation_id).values_list('pk', 'username')
+            ]
+        return get_team_groups(self.request)
+
+    def get_trends(self, group, period, window, organisation_id):
+        leads = Lead.objects.all()
+        if not self.request.user.is_lvl4:
+            if organisation_id is None:
+                leads = Lead.objects.none()
+            else:
+                leads = leads.filter(organisation=organisation_id)
+        time_range = self.get_time_range()
+        rows = trend_rows(time_range.filter(leads), period)
+        return build_trends(rows, period_axis(rows, time_range, period), self.get_groups(group, organisation_id), window)
+
+class CommissionSimulationView(TimeRangeMixin, SupervisorAndLoginRequiredMixin, View):
+    """
+    What-if payouts: how the completed leads of the organisation in the time
+    range would pay out under other agent or manager rates, globally, per
+    user or per team. POST scenarios, see CommissionSimulationForm.
+
+    The leads are read once and every scenario is computed in memory, nothing
+    is saved.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        organisation_id = request.scope.organisation_id
+        users = list(get_ranked_users(request.user, organisation_id).values_list('pk', 'username'))
+        teams = get_team_groups(request)
+        form = CommissionSimulationForm(
+            request.POST,
+            user_ids={user_id for user_id, username in users},
+            team_ids={team_id for team_id, name, members in teams},
+        )
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
 
-        # Apply time range filtering
-        time_range = self.request.GET.get('time_range', 'all')
-        if time_range != 'all':
-            leads = self.filter_by_time_range(leads, time_range)
-
-        return leads
-            
-    def filter_by_time_range(self, queryset, time_range):
-        if time_range == 'years':
-            year = int(self.request.GET.get('year', datetime.now().year))
-            start_date = datetime(year, 1, 1)
-            end_date = datetime(year, 12, 31, 23, 59, 59)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'quarters':
-            year = int(self.request.GET.get('quarter_year', datetime.now().year))
-            quarter = self.request.GET.get('quarter')
-            quarter_start_end = {
-                'Q1': (1, 3),
-                'Q2': (4, 6),
-                'Q3': (7, 9),
-                'Q4': (10, 12)
-            }
-            start_month, end_month = quarter_start_end[quarter]
-            start_date = datetime(year, start_month, 1)
-            end_date = datetime(year, end_month, 1).replace(day=1) + timedelta(days=31) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'months':
-            year = int(self.request.GET.get('month_year', datetime.now().year))
-            month = int(self.request.GET.get('month', datetime.now().month))
-            start_date = datetime(year, month, 1)
-            end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-            return queryset.filter(date_added__range=(start_date, end_date))
-        
-        elif time_range == 'custom':
-            start_datetime = parse_datetime(self.request.GET.get('start_datetime'))
-            end_datetime = parse_datetime(self.request.GET.get('end_datetime'))
-
-            if start_datetime and end_datetime and end_datetime >= start_datetime:
-                return queryset.filter(date_added__range=(start_datetime, end_datetime))
-
-            return queryset
-        
-        return queryset  
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user_id = self.request.user.pk
-        leads = self.get_queryset()
-        curr_user = self.request.user
-
-        # Performance summary
-        num_leads = leads.count()
-        total_commission = 0
-        num_completed_leads = 0
-        completed_lead_commission = 0
-
-        lead_fields = []
-        case_field_names = []
-        datetime_fields_info = []
-
-        lead = self.get_queryset().first()
-        if lead:
-            lead_fields = [field.name for field in lead._meta.get_fields()]
-            if "extrafields" in lead_fields:
-                lead_fields.remove("extrafields")
-            if "followups" in lead_fields:
-                lead_fields.remove('followups')
-            if "id" in lead_fields:
-                lead_fields.remove('id')
-            if "organisation" in lead_fields:
-                lead_fields.remove('organisation')
-            if "description" in lead_fields:
-                lead_fields.remove('description')
-            if "phone_number" in lead_fields:
-                lead_fields.remove("phone_number")
-
-            case_fields = CaseField.objects.filter(user=lead.organisation)
-            case_field_names = [field.name for field in case_fields]
-
-            combined_fields = lead_fields  + case_field_names
-
-            # Check field types and save index and type if it's DateTimeField or DateField
-            for i, field_name in enumerate(combined_fields):
-                try:
-                    if field_name in lead_fields:
-                        # Check lead fields
-                        field = lead._meta.get_field(field_name)
-                        if isinstance(field, models.DateTimeField):
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                        elif isinstance(field, models.DateField):
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                    else:
-                        # Handle case fields if needed
-                        # Assuming you might have some way to access field type
-                        case_field = CaseField.objects.get(user=lead.organisation, name=field_name)
-                        if case_field.field_type == 'date':
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                        elif case_field.field_type == 'datetime':
-                            datetime_fields_info.append({'index': i+1, 'type': 'date'})
-                except FieldDoesNotExist:
-                    pass
-
-
-            context.update({
-                "lead_fields": ['Order-ID'] +  combined_fields,
-                "datetime_fields_info": json.dumps(datetime_fields_info) 
-            })
-
-
-        for lead in leads:
-            if lead.status == "取消":
-                continue
-            
-            commission = int(lead.quote) * int(lead.commission) / 100 if lead.agent == curr_user else 0
-            co_commission = int(lead.quote) * int(lead.co_commission) / 100 if lead.manager == curr_user else 0
-
-            total_commission += (commission + co_commission)
-
-            if lead.status == '已完成':
-                num_completed_leads += 1
-                completed_lead_commission += (commission + co_commission)
-
-        performance_summary = {
-            'num_leads': num_leads,
-            'total_commission': total_commission,
-            'num_completed_leads': num_completed_leads,
-            'completed_lead_commission': completed_lead_commission,
-        }
-
-        # Pass the performance summary and leads to context
-        context['performance_summary'] = performance_summary
-        context['leads'] = leads
-        context['curr_id'] = user_id
-        context['curr_name'] = curr_user.username
-        
-        return context
\ No newline at end of file
+        leads = self.filter_by_time_range(Lead.objects.filter(organisation=organisation_id))
+        result = simulate(load_simulation_leads(leads), form.cleaned_data['scenarios'], users, teams)
+        return JsonResponse(result)
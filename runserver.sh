@@ -2,4 +2,6 @@ python manage.py collectstatic --no-input
 
 python manage.py migrate
 
+python manage.py createcachetable
+
 gunicorn --worker-tmp-dir /dev/shm djcrm.wsgi
\ No newline at end of file
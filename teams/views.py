@@ -1,7 +1,6 @@
 import random
 from django.core.mail import send_mail
 from django.db import IntegrityError
-from django.core.exceptions import ObjectDoesNotExist
 from django.views import generic
 from django.shortcuts import reverse, get_object_or_404, redirect
 from django.contrib import messages
@@ -195,11 +194,10 @@ class UserCreateView(NoLvl1AndLoginRequiredMixin, generic.CreateView):
         if self.request.user.is_lvl3 or self.request.user.is_lvl4:
             UserRelation.objects.create(user=user, supervisor=self.request.user)
         else:
-            try:
-                supervisor = UserRelation.objects.get(user=self.request.user).supervisor
-                UserRelation.objects.create(user=user, supervisor=supervisor)
-            except ObjectDoesNotExist:
+            supervisor_id = self.request.scope.supervisor_id
+            if supervisor_id is None:
                 raise ValueError("The requesting user does not have a supervisor.")
+            UserRelation.objects.create(user=user, supervisor_id=supervisor_id)
 
         # send_mail(
         #     subject="You are invited to join",
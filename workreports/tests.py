@@ -1,3 +1,43 @@
+from unittest import mock
+from django.core.cache import cache
 from django.test import TestCase
+from django.shortcuts import reverse
+from leads.models import User, UserProfile, UserRelation, Team, TeamMember, WorkReport
 
-# Create your tests here.
+
+class WorkReportListTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.supervisor = User.objects.create_user(username="supervisor", password="pass", is_lvl3=True)
+        self.organisation = UserProfile.objects.create(user=self.supervisor)
+        self.manager = User.objects.create_user(username="manager", password="pass", is_lvl2=True)
+        self.agent = User.objects.create_user(username="agent", password="pass", is_lvl1=True)
+        self.other = User.objects.create_user(username="other", password="pass", is_lvl1=True)
+        for user in (self.manager, self.agent, self.other):
+            UserRelation.objects.create(user=user, supervisor=self.supervisor)
+        team = Team.objects.create(name="team", team_leader=self.manager)
+        TeamMember.objects.create(team=team, member=self.agent)
+
+    def create_reports(self, creator, count):
+        return [WorkReport.objects.create(title=f"{creator}", organisation=self.organisation, creator=creator) for _ in range(count)]
+
+    def test_reports_of_the_team_are_listed(self):
+        self.create_reports(self.manager, 1)
+        self.create_reports(self.agent, 1)
+        self.create_reports(self.other, 1)
+        self.assertCountEqual(WorkReport.objects.visible_to(self.agent).values_list('creator', flat=True), [self.manager.pk, self.agent.pk])
+        self.assertCountEqual(WorkReport.objects.visible_to(self.manager).values_list('creator', flat=True), [self.manager.pk, self.agent.pk])
+        self.assertCountEqual(WorkReport.objects.visible_to(self.other).values_list('creator', flat=True), [self.other.pk])
+        self.assertEqual(WorkReport.objects.visible_to(self.supervisor).count(), 3)
+
+    def test_reports_are_paged_newest_first(self):
+        reports = self.create_reports(self.agent, 5)
+        self.client.force_login(self.agent)
+        with mock.patch('workreports.views.WORKREPORT_PAGE_SIZE', 2):
+            pages, query = [], 'time_range=all'
+            while query:
+                response = self.client.get(reverse('workreports:report-list') + '?' + query)
+                pages.append([report.pk for report in response.context['workreports']])
+                query = response.context.get('next_page')
+        self.assertEqual(pages, [[reports[4].pk, reports[3].pk], [reports[2].pk, reports[1].pk], [reports[0].pk]])
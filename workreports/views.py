@@ -6,9 +6,8 @@ from django.shortcuts import render, redirect, reverse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import generic, View
 from agents.mixins import SupervisorAndLoginRequiredMixin, NotSuperuserAndLoginRequiredMixin, NoLvl1AndLoginRequiredMixin
-from leads.models import WorkReport, UserRelation, Team, TeamMember
+from leads.models import WorkReport
 from .forms import *
-from django.db.models import Q
 from django.db import models
 from django.core.exceptions import FieldDoesNotExist
 import datetime
@@ -19,6 +18,8 @@ from datetime import datetime, timedelta
 # Used by major update
 from django.core.exceptions import ObjectDoesNotExist
 
+WORKREPORT_PAGE_SIZE = 50
+
 class WorkReportCreateView(LoginRequiredMixin, generic.CreateView):
     form_class = WorkReportForm
     template_name = 'workreports/workreport_create.html'  # Your template for the form
@@ -30,12 +31,10 @@ class WorkReportCreateView(LoginRequiredMixin, generic.CreateView):
 
         # For lvl1 and lvl2, set organisation to be their supervisor's userprofile
         if user.is_lvl1 or user.is_lvl2:
-            try:
-                supervisor_relation = UserRelation.objects.get(user=user)
-                form.instance.organisation = supervisor_relation.supervisor.userprofile
-            except UserRelation.DoesNotExist:
+            if self.request.scope.organisation is None:
                 form.add_error(None, "Supervisor not found.")
                 return self.form_invalid(form)
+            form.instance.organisation = self.request.scope.organisation
 
         # For lvl3 and lvl4, set organisation to be their own userprofile
         elif user.is_lvl3 or user.is_lvl4:
@@ -52,48 +51,44 @@ class WorkReportListView(LoginRequiredMixin, generic.ListView):
     context_object_name = 'workreports'
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = None
-        if user.is_lvl1:
-            # Step 1: Get all teams the user is a member of
-            team_memberships = TeamMember.objects.filter(member=user).values_list('team', flat=True)
-
-            # Step 2: Get all team members and team leaders from those teams
-            team_users = User.objects.filter(
-                Q(id__in=TeamMember.objects.filter(team__in=team_memberships).values_list('member', flat=True)) |
-                Q(id__in=Team.objects.filter(id__in=team_memberships).values_list('team_leader', flat=True))
-            ).distinct()
-
-            team_users_set = set(team_users)  # Convert queryset to a set
-            team_users_set.add(user) 
-
-            # Step 4: Fetch all work reports created by the combined group
-            queryset = WorkReport.objects.filter(creator__in=team_users_set).distinct()
-
-        elif user.is_lvl2:
-            # Step 1: Get all teams the user leads
-            teams_led = Team.objects.filter(team_leader=user).values_list('id', flat=True)
-
-            # Step 2: Get all team members and include the user
-            team_users = User.objects.filter(
-                Q(id__in=TeamMember.objects.filter(team__in=teams_led).values_list('member', flat=True)) |
-                Q(id=user.id)
-            ).distinct()
-
-            # Step 3: Fetch all work reports created by the combined group
-            queryset = WorkReport.objects.filter(creator__in=team_users).distinct()
-
-        elif user.is_lvl3:
-            queryset = WorkReport.objects.filter(organisation=user.userprofile)
-        elif user.is_lvl4:
-            queryset = WorkReport.objects.all()
+        queryset = WorkReport.objects.visible_to(self.request.user).select_related('creator')
 
      # Apply time range filtering
         time_range = self.request.GET.get('time_range', 'all')
         if time_range != 'all':
             queryset = self.filter_by_time_range(queryset, time_range)
 
-        return queryset
+        # Newest first, so pages are read off the (creator, date_added) and (organisation, date_added) indexes
+        cursor = self.get_cursor()
+        if cursor is None:
+            return queryset.order_by('-date_added', '-pk')
+        return queryset.before(*cursor)
+
+    def get_cursor(self):
+        # The date_added and pk of the last report of the previous page
+        date_added, _, pk = self.request.GET.get('cursor', '').rpartition('|')
+        try:
+            date_added = parse_datetime(date_added)
+        except ValueError:
+            return None
+        if date_added is None or not pk.isdigit():
+            return None
+        return date_added, int(pk)
+
+    def get_context_data(self, **kwargs):
+        # One report more than a page tells whether there is a next one
+        reports = list(self.object_list[:WORKREPORT_PAGE_SIZE + 1])
+        context = super().get_context_data(object_list=reports[:WORKREPORT_PAGE_SIZE], **kwargs)
+        if len(reports) > WORKREPORT_PAGE_SIZE:
+            last = reports[WORKREPORT_PAGE_SIZE - 1]
+            query = self.request.GET.copy()
+            query['cursor'] = f'{last.date_added.isoformat()}|{last.pk}'
+            context['next_page'] = query.urlencode()
+        if 'cursor' in self.request.GET:
+            query = self.request.GET.copy()
+            del query['cursor']
+            context['first_page'] = query.urlencode()
+        return context
 
     def filter_by_time_range(self, queryset, time_range):
         if time_range == 'years':